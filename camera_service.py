@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Camera Service - one process serving many live feeds with asyncio
+
+Every camera is a coroutine on one event loop. Decoding runs on a thread
+pool, and the frames of all cameras go through one shared detector that
+batches whatever frames are waiting. Tracker, speed trap and VANET state are
+kept per camera. A file source is played at its own frame rate like a live
+camera (looping with --loop); when processing falls behind, stale frames
+are skipped rather than queued, so lag stays bounded.
+
+Health (state, fps, lag, dropped frames, reconnects, errors) is printed
+periodically and can be fetched as JSON over HTTP with --health-port.
+
+Usage:
+    python camera_service.py highway_mini.mp4 --loop
+    python camera_service.py north=highway_mini.mp4 south=rtsp://10.0.0.5/stream --loop --health-port 8080
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import detectors
+import pipeline
+from tracker import make_tracker
+from vanet_speed_sharing import VANETSpeedSharing
+
+SPEED_TRAP = {'red_line_y': 198, 'blue_line_y': 268, 'offset': 7, 'distance': 100}  # 100 meters between the lines
+
+
+class Camera:
+    """One feed with its own tracker, speed trap, VANET and health counters.
+
+    `source` is a file path, a stream URL or a device index. Files are paced
+    to their frame rate unless realtime=False and restart at the end when
+    loop=True; streams are reopened after a failed read.
+    """
+
+    def __init__(self, name, source, loop=False, realtime=None, tracker_mode='centroid',
+                 size=(1020, 500), vehicle_timeout=10.0):
+        self.name = name
+        self.source = source
+        self.is_file = isinstance(source, str) and os.path.isfile(source)
+        self.loop = loop
+        self.realtime = self.is_file if realtime is None else realtime
+        self.size = size
+        self.vehicle_timeout = vehicle_timeout
+
+        self.tracker = make_tracker(tracker_mode)
+        self.trap = pipeline.SpeedTrap(**SPEED_TRAP)  # timed by frame timestamps, see process()
+        self.roi = self.trap.roi(size[0])
+        self.vanet = VANETSpeedSharing()
+        self.speeds = {}       # last measured speed per vehicle ID
+        self.last_seen = {}    # vehicle ID -> timestamp of its last frame
+        self.recent_events = deque(maxlen=50)
+
+        self.capture = None
+        self.fps = 30.0
+        self.started_at = None
+        self.played = 0        # frames since started_at, across loops
+
+        # Health
+        self.state = 'starting'
+        self.frames = 0
+        self.dropped = 0
+        self.crossings = 0
+        self.reconnects = 0
+        self.errors = 0
+        self.last_error = None
+        self.processing_fps = 0.0
+        self.lag = 0.0
+        self.last_frame_at = None
+
+    def open(self):
+        if self.started_at is not None:
+            self.reconnects += 1
+            self._restart_tracking()  # timestamps start over with the reopened feed
+        self.close()
+        self.capture = cv2.VideoCapture(self.source)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open {self.source}")
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else 30.0
+        self.started_at = time.time()
+        self.played = 0
+        self.state = 'running'
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def next_frame_delay(self):
+        """Seconds until the next frame of a paced file is due"""
+        if not self.realtime or self.started_at is None:
+            return 0.0
+        return max(0.0, self.started_at + self.played / self.fps - time.time())
+
+    def read(self):
+        """Decode the next frame; returns (frame, timestamp) or None when the feed has ended.
+
+        Blocking, so the service runs it on a decode thread. A paced file
+        that has fallen behind skips (grabs without decoding) the frames
+        that are already stale, like a live camera would have.
+        """
+        if self.realtime:
+            due = int((time.time() - self.started_at) * self.fps)
+            while self.played < due - 1 and self.capture.grab():
+                self.played += 1
+                self.dropped += 1
+        ret, frame = self.capture.read()
+        if not ret and self.is_file and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self._restart_tracking()  # vehicles at the end of the file do not continue at its start
+            ret, frame = self.capture.read()
+        if not ret:
+            return None
+        # Files are timed by their own frames, paced or not, so speeds do not
+        # depend on processing speed; only live streams use the wall clock
+        timestamp = self.started_at + self.played / self.fps if self.is_file else time.time()
+        self.played += 1
+        return cv2.resize(frame, self.size), timestamp
+
+    def process(self, records, timestamp):
+        """Track, time and share the detections of one frame"""
+        tracks = self.tracker.update(records['box'].astype(np.int32))
+        for event in self.trap.update(tracks, timestamp):
+            self.speeds[event['id']] = event['speed']
+            self.crossings += 1
+            self.recent_events.append({'time': timestamp, 'id': int(event['id']),
+                                       'direction': event['direction'], 'speed': event['speed']})
+
+        for x3, y3, x4, y4, vehicle_id in tracks:
+            self.vanet.add_or_update_vehicle(vehicle_id, (x3 + x4) / 2, (y3 + y4) / 2,
+                                             self.speeds.get(vehicle_id, 0.0))
+            self.last_seen[vehicle_id] = timestamp
+        self.vanet.simulate_communication()
+        self._forget_departed(timestamp)
+
+        now = time.time()
+        if self.last_frame_at is not None and now > self.last_frame_at:
+            self.processing_fps = 0.9 * self.processing_fps + 0.1 / (now - self.last_frame_at)
+        self.last_frame_at = now
+        self.lag = max(0.0, now - timestamp)  # an unpaced file runs ahead of its timestamps
+        self.frames += 1
+
+    def _restart_tracking(self):
+        # Tracks and crossing timers do not carry over a jump in the feed; the counts do
+        self.tracker.reset()
+        self.trap.reset(counters=False)
+        self._forget(list(self.last_seen))
+
+    def _forget_departed(self, timestamp):
+        # A long-running feed must not accumulate state for vehicles that left
+        self._forget([v for v, seen in self.last_seen.items() if timestamp - seen > self.vehicle_timeout])
+        self.vanet.message_log = self.vanet.get_recent_messages(int(self.vehicle_timeout))
+
+    def _forget(self, departed):
+        for vehicle_id in departed:
+            del self.last_seen[vehicle_id]
+            self.speeds.pop(vehicle_id, None)
+            self.vanet.vehicles.pop(vehicle_id, None)
+        if departed:
+            self.trap.forget(departed)
+
+    def health(self):
+        return {
+            'state': self.state,
+            'source': str(self.source),
+            'frames': self.frames,
+            'fps': round(self.processing_fps, 1),
+            'lag_s': round(self.lag, 3),
+            'dropped': self.dropped,
+            'vehicles': len(self.last_seen),
+            'crossings': self.crossings,
+            'going_down': self.trap.count_down,
+            'going_up': self.trap.count_up,
+            'reconnects': self.reconnects,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'seconds_since_frame': round(time.time() - self.last_frame_at, 1) if self.last_frame_at else None,
+        }
+
+
+class CameraService:
+    """Runs many Camera feeds on one asyncio event loop with one shared detector"""
+
+    def __init__(self, cameras, model, batch_size=8, health_interval=5.0, retry_delay=2.0):
+        self.cameras = cameras
+        self.model = model
+        self.batch_size = batch_size
+        self.health_interval = health_interval
+        self.retry_delay = retry_delay
+        self.decode_pool = ThreadPoolExecutor(max_workers=len(cameras), thread_name_prefix='decode')
+        self.inference_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        self.requests = None
+
+    def health(self):
+        return {camera.name: camera.health() for camera in self.cameras}
+
+    async def detect(self, camera, frame):
+        """Queue one frame for the shared detector and wait for its vehicle records"""
+        future = asyncio.get_running_loop().create_future()
+        await self.requests.put((camera, frame, future))
+        return await future
+
+    def _predict(self, batch):
+        frames = [frame[camera.roi[1]:camera.roi[3], camera.roi[0]:camera.roi[2]] for camera, frame, _ in batch]
+        results = self.model.predict(frames if len(frames) > 1 else frames[0],
+                                     classes=list(pipeline.VEHICLE_CLASSES), verbose=False)
+        records = []
+        for (camera, _, _), result in zip(batch, results):
+            camera_records = pipeline.filter_classes(pipeline.detection_records(result))
+            camera_records['box'] += np.array([camera.roi[0], camera.roi[1]] * 2, dtype=np.float32)
+            records.append(camera_records)
+        return records
+
+    async def _inference_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.requests.get()]
+            while len(batch) < self.batch_size and not self.requests.empty():
+                batch.append(self.requests.get_nowait())
+            try:
+                records = await loop.run_in_executor(self.inference_pool, self._predict, batch)
+            except Exception as error:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, _, future), camera_records in zip(batch, records):
+                if not future.done():
+                    future.set_result(camera_records)
+
+    async def _run_camera(self, camera):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if camera.capture is None:
+                    await loop.run_in_executor(self.decode_pool, camera.open)
+                await asyncio.sleep(camera.next_frame_delay())
+                item = await loop.run_in_executor(self.decode_pool, camera.read)
+                if item is None:
+                    if camera.is_file:
+                        camera.state = 'finished'
+                        return
+                    camera.state = 'reconnecting'
+                    await asyncio.sleep(self.retry_delay)
+                    await loop.run_in_executor(self.decode_pool, camera.open)
+                    continue
+                frame, timestamp = item
+                records = await self.detect(camera, frame)
+                camera.process(records, timestamp)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                camera.errors += 1
+                camera.last_error = repr(error)
+                camera.state = 'error'
+                camera.close()
+                await asyncio.sleep(self.retry_delay)
+
+    async def _report_health(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            print(f"--- {time.strftime('%H:%M:%S')} ---")
+            for name, health in self.health().items():
+                print(f"{name:<12} {health['state']:<12} {health['fps']:>6.1f} fps  lag {health['lag_s']:>6.2f}s  "
+                      f"dropped {health['dropped']:>5}  down {health['going_down']:>4}  up {health['going_up']:>4}  "
+                      f"errors {health['errors']}")
+
+    async def _serve_health(self, reader, writer):
+        await reader.readline()
+        body = json.dumps(self.health(), indent=2).encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    async def run(self, duration=None, health_port=None):
+        """Serve until every camera has finished, or for `duration` seconds"""
+        self.requests = asyncio.Queue()
+        helpers = [asyncio.create_task(self._inference_loop())]
+        if self.health_interval:
+            helpers.append(asyncio.create_task(self._report_health()))
+        server = None
+        if health_port is not None:
+            server = await asyncio.start_server(self._serve_health, '0.0.0.0', health_port)
+            print(f"Health endpoint: http://localhost:{health_port}/")
+
+        feeds = [asyncio.create_task(self._run_camera(camera)) for camera in self.cameras]
+        try:
+            await asyncio.wait(feeds, timeout=duration)
+        finally:
+            for task in feeds + helpers:
+                task.cancel()
+            await asyncio.gather(*feeds, *helpers, return_exceptions=True)
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+            for camera in self.cameras:
+                camera.close()
+                if camera.state not in ('finished', 'error'):
+                    camera.state = 'stopped'
+            self.decode_pool.shutdown()
+            self.inference_pool.shutdown()
+        return self.health()
+
+
+def parse_source(spec, index):
+    """'name=source' or 'source'; a bare integer is a local device index"""
+    name, _, source = spec.partition('=') if '=' in spec.split('://')[0] else ('', '', spec)
+    return name or f"cam{index}", int(source) if source.isdigit() else source
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve speed estimation for many camera feeds in one process')
+    parser.add_argument('sources', nargs='+', help="files, stream URLs or device indexes, optionally as name=source")
+    parser.add_argument('--loop', action='store_true', help='loop file sources forever (camera stand-in)')
+    parser.add_argument('--no-realtime', action='store_true', help='read files as fast as possible instead of at their fps')
+    parser.add_argument('--backend', default='torch', choices=detectors.BACKENDS)
+    parser.add_argument('--weights', default=detectors.DEFAULT_WEIGHTS)
+    parser.add_argument('--tracker', default='centroid')
+    parser.add_argument('--batch-size', type=int, default=8, help='max frames per detector call across cameras')
+    parser.add_argument('--health-interval', type=float, default=5.0, help='seconds between health reports (0 = off)')
+    parser.add_argument('--health-port', type=int, default=None, help='serve health JSON over HTTP on this port')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    args = parser.parse_args()
+
+    cameras = []
+    for index, spec in enumerate(args.sources):
+        name, source = parse_source(spec, index)
+        cameras.append(Camera(name, source, loop=args.loop, realtime=False if args.no_realtime else None,
+                              tracker_mode=args.tracker))
+    service = CameraService(cameras, detectors.load_detector(args.backend, args.weights),
+                            batch_size=args.batch_size, health_interval=args.health_interval)
+    try:
+        health = asyncio.run(service.run(args.duration, args.health_port))
+    except KeyboardInterrupt:
+        health = service.health()
+    print(json.dumps(health, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,119 +5,75 @@
 # Import required libraries
 
 import cv2
-import pandas as pd
-from ultralytics import YOLO
+import detectors
+from detection_cache import DetectionCache
 from tracker import*
-
-model=YOLO('yolov8n.pt')
-
-vi=cv2.VideoCapture('highway_mini.mp4')
-
-class_list = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave', 'oven',
-              'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush']
-
-tracker=Tracker()
-count=0
-
-import time
-down = {}
-up = {}
-counter_down = []
-counter_up = []
-
-while True:
-  ret,frame=vi.read()
-  if not ret:
-    break
-  count+=1
-  frame=cv2.resize(frame,(1020,500))
-
-  results=model.predict(frame)
-  print(results[0].boxes.data.shape) # prints the shape of the detected bounding boxes
-  a=results[0].boxes.data
-  a=a.detach().cpu().numpy()
-  px=pd.DataFrame(a).astype("float")
-  #print(px)
-  list = []
-
-  for index, row in px.iterrows():
-        x1 = int(row[0])
-        y1 = int(row[1])
-        x2 = int(row[2])
-        y2 = int(row[3])
-        d = int(row[5])
-        c = class_list[d]
-        if 'car' in c:
-            list.append([x1, y1, x2, y2])
-  bbox_id=tracker.update(list)
-  for bbox in bbox_id:
-    x3,y3,x4,y4,id=bbox
-    cx=int(x3+x4)//2
-    cy=int(y3+y4)//2
-    red_line_y=198
-    blue_line_y=268
-    offset = 7
-
-    if red_line_y<(cy+offset) and red_line_y > (cy-offset):
-           down[id]=time.time()   # current time when vehichle touch the first line
-    if id in down:
-
-           if blue_line_y<(cy+offset) and blue_line_y > (cy-offset):
-             elapsed_time=time.time() - down[id]  # current time when vehicle touch the second line. Also we a re minusing the previous time ( current time of line 1)
-             if counter_down.count(id)==0:
-                counter_down.append(id)
-                distance = 100 # meters
-                a_speed_ms = distance / elapsed_time
-                a_speed_kh = a_speed_ms * 3.6  # this will give kilometers per hour for each vehicle. This is the condition for going downside
-                cv2.circle(frame,(cx,cy),4,(0,0,255),-1)
-                cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)  # Draw bounding box
-                cv2.putText(frame,str(id),(x3,y3),cv2.FONT_HERSHEY_COMPLEX,0.6,(255,255,255),1)
-                cv2.putText(frame,str(int(a_speed_kh))+'Km/h',(x4,y4 ),cv2.FONT_HERSHEY_COMPLEX,0.8,(0,255,255),2)
-
-
-        #####going UP blue line#####
-    if blue_line_y<(cy+offset) and blue_line_y > (cy-offset):
-           up[id]=time.time()
-    if id in up:
-
-           if red_line_y<(cy+offset) and red_line_y > (cy-offset):
-             elapsed1_time=time.time() - up[id]
-             # formula of speed= distance/time
-             if counter_up.count(id)==0:
-                counter_up.append(id)
-                distance1 = 100 # meters  (Distance between the 2 lines is 10 meters )
-                a_speed_ms1 = distance1 / elapsed1_time
-                a_speed_kh1 = a_speed_ms1 * 3.6
-                cv2.circle(frame,(cx,cy),4,(0,0,255),-1)
-                cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)  # Draw bounding box
-                cv2.putText(frame,str(id),(x3,y3),cv2.FONT_HERSHEY_COMPLEX,0.6,(255,255,255),1)
-                cv2.putText(frame,str(int(a_speed_kh1))+'Km/h',(x4,y4),cv2.FONT_HERSHEY_COMPLEX,0.8,(0,255,255),2)
-
-
-    text_color = (255,255,255)  # white color for text
-    red_color = (0, 0, 255)  # (B, G, R)
-    blue_color = (255, 0, 0)  # (B, G, R)
-    green_color = (0, 255, 0)  # (B, G, R)
-
-    cv2.line(frame,(172,198),(774,198),red_color,3)  #  starting cordinates and end of line cordinates
-    cv2.putText(frame,('red line'),(172,198),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-
-    cv2.line(frame,(8,268),(927,268),blue_color,3)  # seconde line
-    cv2.putText(frame,('blue line'),(8,268),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-
-    cv2.putText(frame, ('Going Down - ' + str(len(counter_down))), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    cv2.putText(frame, ('Going Up - ' + str(len(counter_up))), (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-
-  cv2.imshow('Car Speed Estimation', frame)
-  
-  # Frame-by-frame control:
-  # Press SPACEBAR to advance to next frame
-  # Press ESC to exit
-  key = cv2.waitKey(0) & 0xFF  # Wait for key press (0 = wait indefinitely)
-  if key == 27:  # ESC key to exit
-     break
-  elif key == ord(' '):  # SPACEBAR to continue to next frame
-     continue
-vi.release()
-cv2.destroyAllWindows()
-
+import pipeline
+
+args=pipeline.script_args('Car speed estimation')
+
+model=detectors.load_detector(args.backend)  # --backend onnxruntime/opencv runs the exported model on CPU
+
+source=pipeline.VideoSource(args.video)
+
+tracker=make_tracker(args.tracker)
+trap=pipeline.SpeedTrap(red_line_y=198, blue_line_y=268, offset=7, distance=100, crossing=args.crossing)  # 100 meters between the lines
+
+text_color = (255,255,255)  # white color for text
+red_color = (0, 0, 255)  # (B, G, R)
+blue_color = (255, 0, 0)  # (B, G, R)
+green_color = (0, 255, 0)  # (B, G, R)
+
+def draw(packet):
+  frame=packet['frame']
+  print(packet['results'][0].boxes.data.shape if 'results' in packet else 'detection skipped') # prints the shape of the detected bounding boxes
+
+  # Speed is shown on the frame where the vehicle reaches the second line
+  for event in packet['events']:
+    x3,y3,x4,y4=event['box']
+    cx,cy=event['center']
+    cv2.circle(frame,(cx,cy),4,(0,0,255),-1)
+    cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)  # Draw bounding box
+    cv2.putText(frame,str(event['id']),(x3,y3),cv2.FONT_HERSHEY_COMPLEX,0.6,(255,255,255),1)
+    cv2.putText(frame,str(int(event['speed']))+'Km/h',(x4,y4),cv2.FONT_HERSHEY_COMPLEX,0.8,(0,255,255),2)
+
+  cv2.line(frame,(172,198),(774,198),red_color,3)  #  starting cordinates and end of line cordinates
+  cv2.putText(frame,('red line'),(172,198),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+  cv2.line(frame,(8,268),(927,268),blue_color,3)  # seconde line
+  cv2.putText(frame,('blue line'),(8,268),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+  cv2.putText(frame, ('Going Down - ' + str(trap.count_down)), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+  cv2.putText(frame, ('Going Up - ' + str(trap.count_up)), (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+# Frame-by-frame control:
+# Press SPACEBAR (or any key) to advance to next frame
+# Press ESC to exit
+# With --headless frames run as fast as possible and crossings go to --output
+# --record also encodes the annotated frames, on a background thread
+recorder=pipeline.recording(args, source.fps)
+if args.headless:
+  output=pipeline.batch_sink(args.output)
+  if recorder is not None:
+    output=pipeline.chain(pipeline.render(draw, every=args.render_every), recorder, output)
+else:
+  output=pipeline.chain(pipeline.render(draw, every=args.render_every), recorder,
+                        pipeline.display('Car Speed Estimation', wait=0))  # 0 = wait indefinitely for a key
+
+# Decoding and inference run ahead on their own threads while a frame is on screen
+pipeline.run(source,
+             pipeline.preprocess((1020,500), model_size=640, roi=trap.roi(1020),  # only the band around the speed-trap lines is measured
+                                 rect=args.backend in detectors.RECT_BACKENDS, buffers=args.batch_size + 8,
+                                 display=not args.headless or recorder is not None),
+             pipeline.threaded(maxsize=4, name='decode'),
+             pipeline.skipping(args, tracker, trap),  # same thread as track(), whose tracker stride() reads
+             pipeline.detect(model, batch_size=args.batch_size, max_latency=args.max_latency,
+                             cache=DetectionCache.for_args(args)),
+             pipeline.track(tracker),
+             pipeline.threaded(maxsize=4, name='inference'),
+             pipeline.speed(trap, clock=args.clock),  # same thread as draw(), which reads the trap counters
+             output)
+
+source.release()
+if not args.headless:
+  cv2.destroyAllWindows()
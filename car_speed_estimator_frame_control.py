@@ -4,167 +4,168 @@
 # This version provides enhanced frame-by-frame control
 # Import required libraries
 
+import bisect
 import cv2
-import pandas as pd
-from ultralytics import YOLO
+import detectors
+from detection_cache import DetectionCache
+from frame_index import FrameIndex
 from tracker import*
+import pipeline
 
-model=YOLO('yolov8n.pt')
+args=pipeline.script_args('Car speed estimation with frame-by-frame control', events=True, history=True)
 
-vi=cv2.VideoCapture('highway_mini.mp4')
+model=detectors.load_detector(args.backend)  # --backend onnxruntime/opencv runs the exported model on CPU
 
-class_list = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave', 'oven',
-              'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush']
-
-tracker=Tracker()
-count=0
-
-import time
-down = {}
-up = {}
-counter_down = []
-counter_up = []
+tracker=make_tracker(args.tracker)
+trap=pipeline.SpeedTrap(red_line_y=198, blue_line_y=268, offset=7, distance=100, crossing=args.crossing)  # 100 meters between the lines
 
 print("=== FRAME-BY-FRAME VIDEO CONTROL ===")
 print("Controls:")
 print("  SPACEBAR - Next frame")
 print("  'p' - Play/Pause (auto-advance)")
 print("  'r' - Reset to beginning")
+print("  'n' - Jump to next speed crossing")
+print("  'g' - Go to frame number (typed in the console)")
+print("  't' - Go to time in seconds (typed in the console)")
+print("  'a' / 'd' - Step back / forward through recent frames (no re-detection)")
 print("  ESC - Exit")
 print("=====================================")
 
 auto_play = False
-current_frame = 0
-total_frames = int(vi.get(cv2.CAP_PROP_FRAME_COUNT))
 
-while True:
-  ret,frame=vi.read()
-  if not ret:
-    print("End of video reached. Press 'r' to restart or ESC to exit.")
+def restart():
+  source.restart()
+  tracker.reset()
+  trap.reset()
+
+def on_end():
+  print("End of video reached. Press 'r' to restart or ESC to exit.")
+  while True:
     key = cv2.waitKey(0) & 0xFF
     if key == ord('r'):  # Reset video
-        vi.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        current_frame = 0
-        count = 0
-        down.clear()
-        up.clear()
-        counter_down.clear()
-        counter_up.clear()
-        continue
-    elif key == 27:  # ESC
-        break
-    else:
-        continue
-        
-  count+=1
-  current_frame = int(vi.get(cv2.CAP_PROP_POS_FRAMES))
-  frame=cv2.resize(frame,(1020,500))
-
-  results=model.predict(frame)
-  print(f"Frame {current_frame}/{total_frames}: {results[0].boxes.data.shape}") # prints the shape of the detected bounding boxes
-  a=results[0].boxes.data
-  a=a.detach().cpu().numpy()
-  px=pd.DataFrame(a).astype("float")
-  #print(px)
-  list = []
-
-  for index, row in px.iterrows():
-        x1 = int(row[0])
-        y1 = int(row[1])
-        x2 = int(row[2])
-        y2 = int(row[3])
-        d = int(row[5])
-        c = class_list[d]
-        if 'car' in c:
-            list.append([x1, y1, x2, y2])
-  bbox_id=tracker.update(list)
-  for bbox in bbox_id:
-    x3,y3,x4,y4,id=bbox
-    cx=int(x3+x4)//2
-    cy=int(y3+y4)//2
-    red_line_y=198
-    blue_line_y=268
-    offset = 7
-
-    if red_line_y<(cy+offset) and red_line_y > (cy-offset):
-           down[id]=time.time()   # current time when vehichle touch the first line
-    if id in down:
-
-           if blue_line_y<(cy+offset) and blue_line_y > (cy-offset):
-             elapsed_time=time.time() - down[id]  # current time when vehicle touch the second line. Also we a re minusing the previous time ( current time of line 1)
-             if counter_down.count(id)==0:
-                counter_down.append(id)
-                distance = 100 # meters
-                a_speed_ms = distance / elapsed_time
-                a_speed_kh = a_speed_ms * 3.6  # this will give kilometers per hour for each vehicle. This is the condition for going downside
-                cv2.circle(frame,(cx,cy),4,(0,0,255),-1)
-                cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)  # Draw bounding box
-                cv2.putText(frame,str(id),(x3,y3),cv2.FONT_HERSHEY_COMPLEX,0.6,(255,255,255),1)
-                cv2.putText(frame,str(int(a_speed_kh))+'Km/h',(x4,y4 ),cv2.FONT_HERSHEY_COMPLEX,0.8,(0,255,255),2)
-
-
-        #####going UP blue line#####
-    if blue_line_y<(cy+offset) and blue_line_y > (cy-offset):
-           up[id]=time.time()
-    if id in up:
-
-           if red_line_y<(cy+offset) and red_line_y > (cy-offset):
-             elapsed1_time=time.time() - up[id]
-             # formula of speed= distance/time
-             if counter_up.count(id)==0:
-                counter_up.append(id)
-                distance1 = 100 # meters  (Distance between the 2 lines is 10 meters )
-                a_speed_ms1 = distance1 / elapsed1_time
-                a_speed_kh1 = a_speed_ms1 * 3.6
-                cv2.circle(frame,(cx,cy),4,(0,0,255),-1)
-                cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)  # Draw bounding box
-                cv2.putText(frame,str(id),(x3,y3),cv2.FONT_HERSHEY_COMPLEX,0.6,(255,255,255),1)
-                cv2.putText(frame,str(int(a_speed_kh1))+'Km/h',(x4,y4),cv2.FONT_HERSHEY_COMPLEX,0.8,(0,255,255),2)
-
-
-    text_color = (255,255,255)  # white color for text
-    red_color = (0, 0, 255)  # (B, G, R)
-    blue_color = (255, 0, 0)  # (B, G, R)
-    green_color = (0, 255, 0)  # (B, G, R)
-
-    cv2.line(frame,(172,198),(774,198),red_color,3)  #  starting cordinates and end of line cordinates
-    cv2.putText(frame,('red line'),(172,198),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-
-    cv2.line(frame,(8,268),(927,268),blue_color,3)  # seconde line
-    cv2.putText(frame,('blue line'),(8,268),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-
-    cv2.putText(frame, ('Going Down - ' + str(len(counter_down))), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    cv2.putText(frame, ('Going Up - ' + str(len(counter_up))), (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    
-    # Add frame counter
-    cv2.putText(frame, f'Frame: {current_frame}/{total_frames}', (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    
-    # Add play mode indicator
-    mode_text = "AUTO" if auto_play else "MANUAL"
-    cv2.putText(frame, f'Mode: {mode_text}', (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-
-  cv2.imshow('Car Speed Estimation - Frame Control', frame)
-  
-  # Enhanced frame control
-  wait_time = 100 if auto_play else 0  # Auto-play with 100ms delay, or wait for key
-  key = cv2.waitKey(wait_time) & 0xFF
-  
-  if key == 27:  # ESC key to exit
-     break
-  elif key == ord(' '):  # SPACEBAR - next frame (always works)
-     continue
-  elif key == ord('p'):  # 'p' - toggle play/pause
+        tracker.reset()
+        trap.reset()
+        return True
+    elif key == pipeline.ESC_KEY:
+        return False
+
+# Keyframe/timestamp index cached next to the video makes seeks exact and fast
+frame_index=FrameIndex.for_video(args.video)
+source=pipeline.VideoSource(args.video, on_end=None if args.headless else on_end, frame_index=frame_index)
+total_frames = source.total_frames
+
+# Frames (1-based) where vehicles finish crossing: from --events plus those seen while reviewing
+crossing_frames = sorted({row['frame'] for row in pipeline.read_crossings(args.events)}) if args.events else []
+pre_roll = int(2 * frame_index.fps)  # land 2 s before a crossing so the red line is seen first
+
+def jump(frame):
+  source.seek(frame)
+  tracker.reset()  # tracks do not continue across a jump
+  trap.reset(counters=False)
+  print(f"Jumped to frame {frame + 1}/{total_frames} ({frame_index.timestamp(frame):.2f}s)")
+
+def next_crossing():
+  shown = source.next_frame - 1
+  i = bisect.bisect_right(crossing_frames, shown + pre_roll + 1)  # crossing positions are 1-based
+  if i == len(crossing_frames):
+    print("No further crossings known")
+    return
+  jump(max(crossing_frames[i] - 1 - pre_roll, 0))
+
+text_color = (255,255,255)  # white color for text
+red_color = (0, 0, 255)  # (B, G, R)
+blue_color = (255, 0, 0)  # (B, G, R)
+green_color = (0, 255, 0)  # (B, G, R)
+
+def draw(packet):
+  frame=packet['frame']
+  current_frame=packet['position']
+  print(f"Frame {current_frame}/{total_frames}: {packet['results'][0].boxes.data.shape if 'results' in packet else 'detection skipped'}") # prints the shape of the detected bounding boxes
+
+  if packet['events'] and current_frame not in crossing_frames:
+    bisect.insort(crossing_frames, current_frame)
+  for event in packet['events']:
+    x3,y3,x4,y4=event['box']
+    cx,cy=event['center']
+    cv2.circle(frame,(cx,cy),4,(0,0,255),-1)
+    cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)  # Draw bounding box
+    cv2.putText(frame,str(event['id']),(x3,y3),cv2.FONT_HERSHEY_COMPLEX,0.6,(255,255,255),1)
+    cv2.putText(frame,str(int(event['speed']))+'Km/h',(x4,y4),cv2.FONT_HERSHEY_COMPLEX,0.8,(0,255,255),2)
+
+  cv2.line(frame,(172,198),(774,198),red_color,3)  #  starting cordinates and end of line cordinates
+  cv2.putText(frame,('red line'),(172,198),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+  cv2.line(frame,(8,268),(927,268),blue_color,3)  # seconde line
+  cv2.putText(frame,('blue line'),(8,268),cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+  cv2.putText(frame, ('Going Down - ' + str(trap.count_down)), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+  cv2.putText(frame, ('Going Up - ' + str(trap.count_up)), (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+  # Add frame counter
+  cv2.putText(frame, f'Frame: {current_frame}/{total_frames}', (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+  # Add play mode indicator
+  mode_text = "AUTO" if auto_play else "MANUAL"
+  cv2.putText(frame, f'Mode: {mode_text}', (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+# Recent frames with their detections and tracker/trap state, for stepping back
+history=pipeline.FrameHistory(args.history_mb, snapshot=lambda: {
+  'tracker': tracker,
+  'going_down': trap.count_down,
+  'going_up': trap.count_up,
+})
+
+def on_review(entry):
+  state=history.state(entry)
+  print(f"Frame {entry['position']}/{total_frames}: {len(entry['tracks'])} tracks {[t[4] for t in entry['tracks']]}, "
+        f"down {state['going_down']}, up {state['going_up']}")
+
+def on_key(key):
+  global auto_play
+  if key == ord('p'):  # 'p' - toggle play/pause
      auto_play = not auto_play
      print(f"Mode changed to: {'AUTO-PLAY' if auto_play else 'MANUAL (frame-by-frame)'}")
   elif key == ord('r'):  # 'r' - restart video
-     vi.set(cv2.CAP_PROP_POS_FRAMES, 0)
-     current_frame = 0
-     count = 0
-     down.clear()
-     up.clear()
-     counter_down.clear()
-     counter_up.clear()
+     restart()
      print("Video restarted")
-
-vi.release()
-cv2.destroyAllWindows()
+  elif key == ord('n'):  # 'n' - next speed crossing
+     next_crossing()
+  elif key == ord('g'):  # 'g' - go to frame
+     try:
+       jump(int(input(f"Go to frame (1-{total_frames}): ")) - 1)
+     except ValueError:
+       print("Not a frame number")
+  elif key == ord('t'):  # 't' - go to timestamp
+     try:
+       jump(frame_index.frame_at(float(input("Go to time (seconds): "))))
+     except ValueError:
+       print("Not a time in seconds")
+
+# Enhanced frame control: auto-play with 100ms delay, or wait for key
+# With --headless frames run as fast as possible and crossings go to --output
+# --record also encodes the annotated frames, on a background thread
+recorder=pipeline.recording(args, source.fps)
+if args.headless:
+  output=pipeline.batch_sink(args.output)
+  if recorder is not None:
+    output=pipeline.chain(pipeline.render(draw, every=args.render_every), recorder, output)
+else:
+  output=pipeline.chain(pipeline.render(draw, every=args.render_every), recorder,
+                        pipeline.display('Car Speed Estimation - Frame Control',
+                                         wait=lambda: 100 if auto_play else 0, on_key=on_key,
+                                         history=history, on_review=on_review))
+
+pipeline.run(source,
+             pipeline.preprocess((1020,500), model_size=640, roi=trap.roi(1020),  # only the band around the speed-trap lines is measured
+                                 rect=args.backend in detectors.RECT_BACKENDS, buffers=args.batch_size + 8,
+                                 display=not args.headless or recorder is not None),
+             pipeline.skipping(args, tracker, trap),
+             pipeline.detect(model, batch_size=args.batch_size, max_latency=args.max_latency,
+                             cache=DetectionCache.for_args(args)),
+             pipeline.track(tracker),
+             pipeline.speed(trap, clock=args.clock),
+             output)
+
+source.release()
+if not args.headless:
+  cv2.destroyAllWindows()
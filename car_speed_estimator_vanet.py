@@ -3,31 +3,24 @@
 
 # Import required libraries
 import cv2
-import pandas as pd
-from ultralytics import YOLO
+import detectors
+from detection_cache import DetectionCache
 from tracker import*
 from vanet_speed_sharing import VANETSpeedSharing
-import time
-import math
+import pipeline
 import random
 
-# Initialize YOLO model and video
-model = YOLO('yolov8n.pt')
-vi = cv2.VideoCapture('highway_mini.mp4')
+args = pipeline.script_args('Car speed estimation with VANET speed sharing')
 
-class_list = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave', 'oven',
-              'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush']
+# Initialize YOLO model
+model = detectors.load_detector(args.backend)  # --backend onnxruntime/opencv runs the exported model on CPU
 
 # Initialize tracker and VANET
-tracker = Tracker()
+tracker = make_tracker(args.tracker)
 vanet = VANETSpeedSharing()
-count = 0
 
-# Speed calculation variables
-down = {}
-up = {}
-counter_down = []
-counter_up = []
+# Speed calculation (100 meters between the lines)
+trap = pipeline.SpeedTrap(red_line_y=198, blue_line_y=268, offset=7, distance=100, crossing=args.crossing)
 
 # Colors for display
 text_color = (255, 255, 255)  # white
@@ -67,26 +60,37 @@ def draw_speed_sharing_info(frame, vehicle_id, x, y, own_speed, shared_speeds):
         cv2.putText(frame, f"V{other_id}: {int(received_speed)}km/h", (x, y + y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.3, purple_color, 1)
         y_offset += 15
 
+def draw_static_overlay(layer):
+    """Reference lines and the VANET status panel: drawn once, then pasted by the overlay"""
+    cv2.line(layer, (172, 198), (774, 198), red_color, 3)
+    cv2.putText(layer, ('red line'), (172, 198), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+    cv2.line(layer, (8, 268), (927, 268), blue_color, 3)
+    cv2.putText(layer, ('blue line'), (8, 268), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+
+    # VANET status box (make it larger)
+    cv2.rectangle(layer, (750, 10), (1010, 150), (0, 0, 0), -1)  # Black background
+    cv2.rectangle(layer, (750, 10), (1010, 150), text_color, 2)   # White border
+
+    cv2.putText(layer, "VANET STATUS", (760, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, yellow_color, 2)
+    cv2.putText(layer, "Yellow lines = Communication", (760, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.3, yellow_color, 1)
+
+overlay = pipeline.Overlay(draw_static_overlay)
+
 def draw_vanet_status(frame, vanet_system, current_frame, total_frames, auto_play):
-    """Draw VANET system status with frame control info"""
+    """Draw VANET system status with frame control info (the panel itself is in the overlay)"""
     total_vehicles = len(vanet_system.vehicles)
     communication_pairs = len(vanet_system.get_communication_pairs())
     recent_messages = len(vanet_system.get_recent_messages(2))
     
-    # VANET status box (make it larger)
-    cv2.rectangle(frame, (750, 10), (1010, 150), (0, 0, 0), -1)  # Black background
-    cv2.rectangle(frame, (750, 10), (1010, 150), text_color, 2)   # White border
-    
-    cv2.putText(frame, "VANET STATUS", (760, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, yellow_color, 2)
-    cv2.putText(frame, f"Active Vehicles: {total_vehicles}", (760, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Comm. Links: {communication_pairs}", (760, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Msgs/2sec: {recent_messages}", (760, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, "Yellow lines = Communication", (760, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.3, yellow_color, 1)
+    overlay.text(frame, 'vehicles', f"Active Vehicles: {total_vehicles}", (760, 50), 0.4, text_color)
+    overlay.text(frame, 'links', f"Comm. Links: {communication_pairs}", (760, 70), 0.4, text_color)
+    overlay.text(frame, 'messages', f"Msgs/2sec: {recent_messages}", (760, 90), 0.4, text_color)
     
     # Frame control info
     mode_text = "AUTO" if auto_play else "MANUAL"
-    cv2.putText(frame, f"Frame: {current_frame}/{total_frames}", (760, 130), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Mode: {mode_text}", (760, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
+    overlay.text(frame, 'frame', f"Frame: {current_frame}/{total_frames}", (760, 130), 0.4, text_color)
+    overlay.text(frame, 'mode', f"Mode: {mode_text}", (760, 145), 0.4, text_color)
 
 print("=== CAR SPEED ESTIMATION WITH VANET - FRAME CONTROL ===")
 print("Features:")
@@ -103,158 +107,123 @@ print("  ESC - Exit")
 print("==========================================================")
 
 auto_play = False
-current_frame = 0
-total_frames = int(vi.get(cv2.CAP_PROP_FRAME_COUNT))
 
-while True:
-    ret, frame = vi.read()
-    if not ret:
-        print("End of video reached. Press 'r' to restart or ESC to exit.")
+def reset_state():
+    global vanet
+    tracker.reset()
+    trap.reset()
+    vanet = VANETSpeedSharing()  # Reset VANET
+
+def on_end():
+    print("End of video reached. Press 'r' to restart or ESC to exit.")
+    while True:
         key = cv2.waitKey(0) & 0xFF
         if key == ord('r'):  # Reset video
-            vi.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            current_frame = 0
-            count = 0
-            down.clear()
-            up.clear()
-            counter_down.clear()
-            counter_up.clear()
-            vanet = VANETSpeedSharing()  # Reset VANET
+            reset_state()
             print("Video restarted")
-            continue
-        elif key == 27:  # ESC
-            break
-        else:
-            continue
-            
-    count += 1
-    current_frame = int(vi.get(cv2.CAP_PROP_POS_FRAMES))
-    frame = cv2.resize(frame, (1020, 500))
-
-    # YOLO detection
-    results = model.predict(frame)
-    a = results[0].boxes.data
-    a = a.detach().cpu().numpy()
-    px = pd.DataFrame(a).astype("float")
-    
-    detected_cars = []
-
-    # Extract car detections
-    for index, row in px.iterrows():
-        x1 = int(row[0])
-        y1 = int(row[1])
-        x2 = int(row[2])
-        y2 = int(row[3])
-        d = int(row[5])
-        c = class_list[d]
-        if 'car' in c:
-            detected_cars.append([x1, y1, x2, y2])
-
-    # Update tracker
-    bbox_id = tracker.update(detected_cars)
+            return True
+        elif key == pipeline.ESC_KEY:
+            return False
+
+source = pipeline.VideoSource(args.video, on_end=None if args.headless else on_end)
+total_frames = source.total_frames
+
+def update_vanet(packet):
+    """Feed tracked vehicles and their speeds into the VANET simulation"""
+    measured = {event['id']: event['speed'] for event in packet['events']}
     vehicle_speeds = {}  # Store speeds for VANET
-    
-    for bbox in bbox_id:
-        x3, y3, x4, y4, vehicle_id = bbox
+    shared = {}
+
+    for x3, y3, x4, y4, vehicle_id in packet['tracks']:
         cx = int((x3 + x4) / 2)
         cy = int((y3 + y4) / 2)
-        red_line_y = 198
-        blue_line_y = 268
-        offset = 7
-        
-        current_speed = 0  # Default speed
-
-        # Speed calculation (downward traffic)
-        if red_line_y < (cy + offset) and red_line_y > (cy - offset):
-            down[vehicle_id] = time.time()
-        if vehicle_id in down:
-            if blue_line_y < (cy + offset) and blue_line_y > (cy - offset):
-                elapsed_time = time.time() - down[vehicle_id]
-                if counter_down.count(vehicle_id) == 0:
-                    counter_down.append(vehicle_id)
-                    distance = 100  # meters
-                    a_speed_ms = distance / elapsed_time
-                    current_speed = a_speed_ms * 3.6  # km/h
-                    vehicle_speeds[vehicle_id] = current_speed
-
-        # Speed calculation (upward traffic)
-        if blue_line_y < (cy + offset) and blue_line_y > (cy - offset):
-            up[vehicle_id] = time.time()
-        if vehicle_id in up:
-            if red_line_y < (cy + offset) and red_line_y > (cy - offset):
-                elapsed1_time = time.time() - up[vehicle_id]
-                if counter_up.count(vehicle_id) == 0:
-                    counter_up.append(vehicle_id)
-                    distance1 = 100  # meters
-                    a_speed_ms1 = distance1 / elapsed1_time
-                    current_speed = a_speed_ms1 * 3.6  # km/h
-                    vehicle_speeds[vehicle_id] = current_speed
-        
+
         # If no speed calculated, use a random speed for demo (simulate sensor data)
-        if vehicle_id not in vehicle_speeds:
+        if vehicle_id in measured:
+            current_speed = measured[vehicle_id]
+        else:
             # Use a realistic speed range
             current_speed = random.uniform(40, 80)  # km/h
-            vehicle_speeds[vehicle_id] = current_speed
+        vehicle_speeds[vehicle_id] = current_speed
 
         # Update VANET with vehicle position and speed
         vanet.add_or_update_vehicle(vehicle_id, cx, cy, current_speed)
 
-        # Draw bounding box and vehicle ID
-        cv2.rectangle(frame, (x3, y3), (x4, y4), green_color, 2)
-        cv2.circle(frame, (cx, cy), 4, red_color, -1)
-        
         # Get shared speed information from VANET
         if vehicle_id in vanet.vehicles:
-            vehicle_node = vanet.vehicles[vehicle_id]
-            shared_speeds = vehicle_node.get_nearby_speeds()
-            
-            # Draw speed sharing information
-            draw_speed_sharing_info(frame, vehicle_id, x3, y3, current_speed, shared_speeds)
+            shared[vehicle_id] = dict(vanet.vehicles[vehicle_id].get_nearby_speeds())
 
     # Simulate VANET communication
-    messages_sent = vanet.simulate_communication()
-    
+    vanet.simulate_communication()
+
+    packet['vehicle_speeds'] = vehicle_speeds
+    packet['shared_speeds'] = shared
+
+def draw(packet):
+    frame = packet['frame']
+
+    for x3, y3, x4, y4, vehicle_id in packet['tracks']:
+        cx = int((x3 + x4) / 2)
+        cy = int((y3 + y4) / 2)
+
+        # Draw bounding box and vehicle ID
+        cv2.rectangle(frame, (x3, y3), (x4, y4), green_color, 2)
+        cv2.circle(frame, (cx, cy), 4, red_color, -1)
+
+        # Draw speed sharing information
+        if vehicle_id in packet['shared_speeds']:
+            draw_speed_sharing_info(frame, vehicle_id, x3, y3, packet['vehicle_speeds'][vehicle_id],
+                                    packet['shared_speeds'][vehicle_id])
+
     # Draw communication lines between vehicles
     draw_communication_lines(frame, vanet)
-    
-    # Draw reference lines
-    cv2.line(frame, (172, 198), (774, 198), red_color, 3)
-    cv2.putText(frame, ('red line'), (172, 198), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    
-    cv2.line(frame, (8, 268), (927, 268), blue_color, 3)
-    cv2.putText(frame, ('blue line'), (8, 268), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    
+
+    # Reference lines and the status panel come from the cached overlay
+    overlay.apply(frame)
+
     # Draw traffic counters
-    cv2.putText(frame, ('Going Down - ' + str(len(counter_down))), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    cv2.putText(frame, ('Going Up - ' + str(len(counter_up))), (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    
+    overlay.text(frame, 'down', 'Going Down - ' + str(trap.count_down), (10, 30), 0.5, text_color, line_type=cv2.LINE_AA)
+    overlay.text(frame, 'up', 'Going Up - ' + str(trap.count_up), (10, 60), 0.5, text_color, line_type=cv2.LINE_AA)
+
     # Draw VANET status with frame info
-    draw_vanet_status(frame, vanet, current_frame, total_frames, auto_play)
+    draw_vanet_status(frame, vanet, packet['position'], total_frames, auto_play)
 
-    cv2.imshow('Car Speed Estimation with VANET - Frame Control', frame)
-    
-    # Enhanced frame control
-    wait_time = 100 if auto_play else 0  # Auto-play with 100ms delay, or wait for key
-    key = cv2.waitKey(wait_time) & 0xFF
-    
-    if key == 27:  # ESC key to exit
-        break
-    elif key == ord(' '):  # SPACEBAR - next frame (always works)
-        continue
-    elif key == ord('p'):  # 'p' - toggle play/pause
+def on_key(key):
+    global auto_play
+    if key == ord('p'):  # 'p' - toggle play/pause
         auto_play = not auto_play
         mode_text = "AUTO-PLAY" if auto_play else "MANUAL (frame-by-frame)"
         print(f"Mode changed to: {mode_text}")
     elif key == ord('r'):  # 'r' - restart video
-        vi.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        current_frame = 0
-        count = 0
-        down.clear()
-        up.clear()
-        counter_down.clear()
-        counter_up.clear()
-        vanet = VANETSpeedSharing()  # Reset VANET
+        source.restart()
+        reset_state()
         print("Video restarted")
 
-vi.release()
-cv2.destroyAllWindows()
+# Enhanced frame control: auto-play with 100ms delay, or wait for key
+# With --headless frames run as fast as possible and crossings go to --output
+# --record also encodes the annotated frames, on a background thread
+recorder = pipeline.recording(args, source.fps)
+if args.headless:
+    output = pipeline.batch_sink(args.output)
+    if recorder is not None:
+        output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder, output)
+else:
+    output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder,
+                            pipeline.display('Car Speed Estimation with VANET - Frame Control',
+                                             wait=lambda: 100 if auto_play else 0, on_key=on_key))
+
+pipeline.run(source,
+             pipeline.preprocess((1020, 500), model_size=640,
+                                 rect=args.backend in detectors.RECT_BACKENDS, buffers=args.batch_size + 8,
+                                 display=not args.headless or recorder is not None),
+             pipeline.skipping(args, tracker, trap),
+             pipeline.detect(model, batch_size=args.batch_size, max_latency=args.max_latency,
+                             cache=DetectionCache.for_args(args)),
+             pipeline.track(tracker),
+             pipeline.speed(trap, clock=args.clock),
+             pipeline.vanet(update_vanet),
+             output)
+
+source.release()
+if not args.headless:
+    cv2.destroyAllWindows()
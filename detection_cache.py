@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Detection Cache - reuse detector output across runs on the same video
+
+Detections are stored per video and per detector configuration, keyed by
+the video's content hash, the model (backend + weights hash) and every
+setting that changes the output: input frame size, detection region,
+classes and predict() options such as conf. When only tracker, speed-trap
+or VANET parameters change, a re-run reads the detections from the cache
+instead of running the model.
+
+Files live in .detection_cache/<video hash>/<settings hash>.npz in a
+columnar layout: the frame positions, an offsets array and one (M, 6)
+float32 array of [x1, y1, x2, y2, conf, cls] rows for all frames.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import detectors
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.detection_cache')
+CACHE_VERSION = 1
+
+
+def video_hash(path, cache_dir=CACHE_DIR):
+    """Content hash of a video, remembered by path, size and mtime so it is computed once"""
+    stat = os.stat(path)
+    known_file = os.path.join(cache_dir, 'video_hashes.json')
+    key = os.path.abspath(path)
+    known = {}
+    if os.path.exists(known_file):
+        with open(known_file, 'r') as f:
+            known = json.load(f)
+    entry = known.get(key)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return entry['hash']
+
+    digest = detectors.file_hash(path)
+    known[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(known_file, 'w') as f:
+        json.dump(known, f, indent=2)
+    return digest
+
+
+def model_key(backend='torch', weights=detectors.DEFAULT_WEIGHTS):
+    """Identifies the detector: backend name plus the weights' content hash.
+
+    Weights that are not on disk yet (ultralytics downloads them on first
+    use) are identified by name.
+    """
+    return f"{backend}:{detectors.file_hash(weights) if os.path.exists(weights) else weights}"
+
+
+class DetectionCache:
+    """Per-frame detections of one video under one detector configuration.
+
+    open(**settings) selects (and loads) the file for the given settings;
+    pipeline.detect() calls it with the frame size, region, classes and
+    predict options it uses. Frames are addressed by their 1-based
+    position in the video. save() writes new frames back to disk.
+    """
+
+    def __init__(self, video, model, cache_dir=CACHE_DIR):
+        self.video_dir = os.path.join(cache_dir, video_hash(video, cache_dir)[:16])
+        self.model = model
+        self.path = None
+        self.frames = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_args(cls, args):
+        """Cache for a script's --video/--backend, or None with --no-cache"""
+        if args.no_cache:
+            return None
+        return cls(args.video, model_key(args.backend))
+
+    def open(self, **settings):
+        settings = dict(settings, model=self.model, version=CACHE_VERSION)
+        key = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+        path = os.path.join(self.video_dir, key[:16] + '.npz')
+        if path == self.path:
+            return
+        self.save()
+        self.path = path
+        self.frames = {}
+        self.dirty = False
+        if os.path.exists(path):
+            with np.load(path) as data:
+                positions, offsets, rows = data['positions'], data['offsets'], data['rows']
+            self.frames = {int(p): rows[offsets[i]:offsets[i + 1]] for i, p in enumerate(positions)}
+            print(f"Detection cache: {len(self.frames)} frames from {path}")
+
+    def get(self, position):
+        """The (N, 6) detections of a frame, or None if not cached"""
+        rows = self.frames.get(position)
+        if rows is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return rows
+
+    def put(self, position, rows):
+        self.frames[position] = np.ascontiguousarray(rows, dtype=np.float32).reshape(-1, 6)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty or self.path is None:
+            return
+        positions = np.array(sorted(self.frames), dtype=np.int64)
+        counts = np.array([len(self.frames[p]) for p in positions], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        rows = np.concatenate([self.frames[p] for p in positions]) if len(positions) else np.zeros((0, 6), np.float32)
+        os.makedirs(self.video_dir, exist_ok=True)
+        tmp = self.path + '.tmp.npz'
+        np.savez(tmp, positions=positions, offsets=offsets, rows=rows)
+        os.replace(tmp, self.path)
+        self.dirty = False
+        print(f"Detection cache: {self.hits} hits, {self.misses} misses, {len(positions)} frames saved to {self.path}")
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Detector Backends - YOLOv8 on PyTorch, ONNX Runtime or OpenCV DNN
+
+Every backend exposes model.predict(frame_or_frames, **kwargs) and returns
+one result per frame whose boxes.data is an (N, 6) array of
+[x1, y1, x2, y2, conf, cls], so pipeline.detect() works with any of them.
+
+The exported backends load an ONNX file that is exported from the .pt
+weights once and cached by the weights' content hash, so later runs start
+without importing torch or ultralytics. The 'onnxruntime-int8' backend
+additionally quantizes that export to INT8, calibrated on frames sampled
+from our own videos (see quantization_report.py for its accuracy cost).
+"""
+
+import hashlib
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+DEFAULT_WEIGHTS = 'yolov8n.pt'
+MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.model_cache')
+
+DEFAULT_CALIBRATION_VIDEOS = ('highway_mini.mp4',)
+
+BACKENDS = ('torch', 'onnxruntime', 'onnxruntime-int8', 'opencv')
+
+# Backends taking any input shape that is a multiple of 32 (ultralytics'
+# rectangular letterbox); the ONNX exports are fixed at imgsz x imgsz
+RECT_BACKENDS = ('torch',)
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_onnx(weights=DEFAULT_WEIGHTS, imgsz=640, cache_dir=MODEL_CACHE_DIR):
+    """Path of the ONNX export of `weights`, exporting it on first use.
+
+    The artifact is cached as <name>-<hash>-<imgsz>.onnx, so changed
+    weights get a fresh export and unchanged weights never re-export.
+    """
+    name = os.path.splitext(os.path.basename(weights))[0]
+    cached = os.path.join(cache_dir, f"{name}-{file_hash(weights)[:16]}-{imgsz}.onnx")
+    if os.path.exists(cached):
+        return cached
+
+    from ultralytics import YOLO  # only needed the first time
+
+    print(f"Exporting {weights} to ONNX (one-time, cached in {cache_dir})...")
+    exported = YOLO(weights).export(format='onnx', imgsz=imgsz)
+    os.makedirs(cache_dir, exist_ok=True)
+    shutil.move(str(exported), cached)
+    return cached
+
+
+def sample_frames(videos, num_frames=64):
+    """Evenly spaced decoded frames from `videos`"""
+    per_video = max(1, num_frames // len(videos))
+    frames = []
+    for path in videos:
+        capture = cv2.VideoCapture(path)
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        for position in np.linspace(0, max(total - 1, 0), per_video).astype(int):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+            ret, frame = capture.read()
+            if ret:
+                frames.append(frame)
+        capture.release()
+    if not frames:
+        raise ValueError(f"No calibration frames could be read from {list(videos)}")
+    return frames
+
+
+def calibration_regions(size=(1020, 500)):
+    """The regions the scripts send to the model: the whole frame and the speed-trap band"""
+    import pipeline  # imported here: pipeline imports this module
+    return (None, pipeline.SpeedTrap().roi(size[0]))
+
+
+def calibration_inputs(frames, regions, imgsz=640, size=(1020, 500)):
+    """Model inputs made from decoded `frames` by pipeline.preprocess, as the scripts make them.
+
+    One input per frame and region (x1, y1, x2, y2 at working resolution
+    `size`, or None for the whole frame).
+    """
+    import pipeline
+
+    inputs = []
+    for region in regions:
+        stage = pipeline.preprocess(size, model_size=imgsz, roi=region, display=False, buffers=1)
+        inputs.extend(packet['input'].copy() for packet in stage({'frame': frame} for frame in frames))
+    return inputs
+
+
+def quantize_onnx(onnx_path, calibration_videos=DEFAULT_CALIBRATION_VIDEOS, num_frames=64,
+                  imgsz=640, cache_dir=MODEL_CACHE_DIR, regions=None):
+    """Path of a static INT8 quantization of `onnx_path`, creating it on first use.
+
+    Activation ranges are calibrated on num_frames frames sampled from
+    calibration_videos and turned into model inputs by the same
+    pipeline.preprocess() letterboxing as at inference, once per region
+    (default: calibration_regions()). Weights are quantized per channel to int8
+    and activations to uint8 in QDQ format. The artifact is cached by the
+    hashes of the fp32 model and the calibration videos and by the
+    regions, so new footage triggers a fresh calibration.
+    """
+    regions = calibration_regions() if regions is None else regions
+    digest = hashlib.sha256(file_hash(onnx_path).encode())
+    for path in calibration_videos:
+        digest.update(file_hash(path).encode())
+    digest.update(str(num_frames).encode())
+    digest.update(f"preprocess:{regions}".encode())
+    name = os.path.splitext(os.path.basename(onnx_path))[0]
+    cached = os.path.join(cache_dir, f"{name}-int8-{digest.hexdigest()[:16]}.onnx")
+    if os.path.exists(cached):
+        return cached
+
+    try:
+        from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                              QuantType, quantize_static)
+    except ImportError as exc:
+        raise ImportError("INT8 quantization needs: pip install onnxruntime") from exc
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self, inputs, input_name):
+            self.blobs = iter([make_blob(image, imgsz)[0] for image in inputs])
+            self.input_name = input_name
+
+        def get_next(self):
+            blob = next(self.blobs, None)
+            return None if blob is None else {self.input_name: blob}
+
+    import onnxruntime as ort
+    input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    inputs = calibration_inputs(sample_frames(calibration_videos, num_frames), regions, imgsz)
+    print(f"Calibrating INT8 model on {len(inputs)} inputs (one-time, cached in {cache_dir})...")
+    os.makedirs(cache_dir, exist_ok=True)
+    quantize_static(onnx_path, cached, FrameReader(inputs, input_name),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CalibrationMethod.MinMax)
+    return cached
+
+
+class Boxes:
+    """Minimal stand-in for ultralytics Boxes: data is an (N, 6) array"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Result:
+    """Minimal stand-in for an ultralytics Results object"""
+
+    def __init__(self, data):
+        self.boxes = Boxes(data)
+
+
+def letterbox(frame, size=640, pad_value=114):
+    """Resize keeping aspect ratio and pad to size x size, as ultralytics does.
+
+    Returns the padded image, the scale gain and the (left, top) padding.
+    """
+    h, w = frame.shape[:2]
+    gain = min(size / h, size / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    pad_w, pad_h = (size - new_w) / 2, (size - new_h) / 2
+    left, top = int(round(pad_w - 0.1)), int(round(pad_h - 0.1))
+    right, bottom = size - new_w - left, size - new_h - top
+    if (new_w, new_h) != (w, h):
+        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    padded = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                value=(pad_value, pad_value, pad_value))
+    return padded, gain, (left, top)
+
+
+def make_blob(frame, size=640):
+    """Letterbox a BGR frame into a (1, 3, size, size) float32 RGB blob"""
+    padded, gain, pad = letterbox(frame, size)
+    return cv2.dnn.blobFromImage(padded, 1 / 255.0, swapRB=True), gain, pad
+
+
+def postprocess(output, gain, pad, frame_shape, conf=0.25, iou=0.7, classes=None, max_det=300):
+    """Turn raw YOLOv8 output (1, 4 + num_classes, anchors) into (N, 6) detections.
+
+    Applies the confidence threshold, class filter and class-aware NMS, then
+    maps boxes from the letterboxed input back to frame coordinates.
+    """
+    predictions = np.asarray(output).reshape(output.shape[-2], output.shape[-1]).T
+    scores = predictions[:, 4:]
+    class_ids = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(scores)), class_ids]
+
+    keep = confidences >= conf
+    if classes is not None:
+        keep &= np.isin(class_ids, classes)
+    predictions, class_ids, confidences = predictions[keep], class_ids[keep], confidences[keep]
+    if len(predictions) == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+
+    xywh = predictions[:, :4]
+    boxes = np.empty_like(xywh)
+    boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+    boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+
+    # Class-aware NMS by shifting each class to its own coordinate range
+    offset = class_ids[:, None] * 7680.0
+    nms_boxes = np.hstack([boxes[:, :2] + offset, xywh[:, 2:]])
+    idx = np.asarray(cv2.dnn.NMSBoxes(nms_boxes.tolist(), confidences.tolist(), conf, iou), dtype=int).reshape(-1)
+    idx = idx[np.argsort(-confidences[idx])][:max_det]
+
+    boxes = boxes[idx]
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= gain
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, frame_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, frame_shape[0])
+
+    detections = np.empty((len(idx), 6), dtype=np.float32)
+    detections[:, :4] = boxes
+    detections[:, 4] = confidences[idx]
+    detections[:, 5] = class_ids[idx]
+    return detections
+
+
+class ExportedDetector:
+    """Base for detectors running an exported ONNX YOLOv8 model.
+
+    Subclasses implement forward(blob) for a (1, 3, imgsz, imgsz) float32
+    RGB blob. predict() accepts the same keyword arguments as the
+    ultralytics model (conf, iou, classes, max_det); others are ignored.
+    """
+
+    def __init__(self, onnx_path, imgsz=640, conf=0.25, iou=0.7):
+        self.onnx_path = onnx_path
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+
+    def forward(self, blob):
+        raise NotImplementedError
+
+    def predict(self, source, conf=None, iou=None, classes=None, max_det=300, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        results = []
+        for frame in frames:
+            blob, gain, pad = make_blob(frame, self.imgsz)
+            output = self.forward(blob)
+            results.append(Result(postprocess(output, gain, pad, frame.shape,
+                                              conf=self.conf if conf is None else conf,
+                                              iou=self.iou if iou is None else iou,
+                                              classes=classes, max_det=max_det)))
+        return results
+
+
+class OnnxRuntimeDetector(ExportedDetector):
+    """YOLOv8 ONNX model on ONNX Runtime's CPU execution provider"""
+
+    def __init__(self, onnx_path, imgsz=640, conf=0.25, iou=0.7, providers=('CPUExecutionProvider',)):
+        super().__init__(onnx_path, imgsz, conf, iou)
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise ImportError("The 'onnxruntime' backend needs: pip install onnxruntime") from exc
+        self.session = ort.InferenceSession(onnx_path, providers=list(providers))
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenCVDnnDetector(ExportedDetector):
+    """YOLOv8 ONNX model on OpenCV's DNN module (no extra dependency)"""
+
+    def __init__(self, onnx_path, imgsz=640, conf=0.25, iou=0.7):
+        super().__init__(onnx_path, imgsz, conf, iou)
+        self.net = cv2.dnn.readNetFromONNX(onnx_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward()
+
+
+def load_detector(backend='torch', weights=DEFAULT_WEIGHTS, imgsz=640, cache_dir=MODEL_CACHE_DIR,
+                  calibration_videos=DEFAULT_CALIBRATION_VIDEOS, calibration_frames=64):
+    """Create a detector for pipeline.detect().
+
+    'torch' is the ultralytics YOLO model itself; 'onnxruntime' and
+    'opencv' run the cached ONNX export of the same weights, and
+    'onnxruntime-int8' its INT8 quantization calibrated on
+    calibration_videos.
+    """
+    if backend == 'torch':
+        from ultralytics import YOLO
+        return YOLO(weights)
+    if backend == 'onnxruntime':
+        return OnnxRuntimeDetector(export_onnx(weights, imgsz, cache_dir), imgsz)
+    if backend == 'onnxruntime-int8':
+        onnx_path = export_onnx(weights, imgsz, cache_dir)
+        return OnnxRuntimeDetector(quantize_onnx(onnx_path, calibration_videos, calibration_frames, imgsz, cache_dir),
+                                   imgsz)
+    if backend == 'opencv':
+        return OpenCVDnnDetector(export_onnx(weights, imgsz, cache_dir), imgsz)
+    raise ValueError(f"Unknown detector backend '{backend}', expected one of {BACKENDS}")
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Frame Index - persisted keyframe and timestamp index for fast seeking
+
+Seeking a cv2.VideoCapture by frame number makes the decoder start from
+the previous keyframe, and some containers land on the wrong frame. The
+index records every frame's timestamp and which frames are keyframes by
+reading the compressed packets once (no decoding), and is cached next to
+the video as <video>.frameindex.npz. With it, a seek goes to the nearest
+keyframe and grabs forward to the exact frame, forward jumps that do not
+pass a keyframe just grab ahead, and timestamps map to frame numbers
+without touching the video.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.frameindex.npz'
+
+
+class FrameIndex:
+    """Frame timestamps (ms), keyframe numbers, fps and frame count of one video.
+
+    Frame numbers are 0-based: frame n is what the (n+1)-th read() returns.
+    """
+
+    def __init__(self, fps, timestamps_ms, keyframes):
+        self.fps = fps
+        self.timestamps_ms = np.asarray(timestamps_ms, dtype=np.float64)
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.frame_count = len(self.timestamps_ms)
+
+    @classmethod
+    def build(cls, path):
+        """Scan the video's packets once; falls back to decoding if raw reads are unsupported"""
+        capture = cv2.VideoCapture(path)
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        raw = capture.set(cv2.CAP_PROP_FORMAT, -1)  # packets only, no decoding
+        timestamps = []
+        is_key = []
+        while capture.grab():
+            is_key.append(raw and bool(capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+            timestamps.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+        capture.release()
+
+        # Packets arrive in decode order; frames are numbered in presentation order
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        order = np.argsort(timestamps, kind='stable')
+        frame_of_packet = np.empty_like(order)
+        frame_of_packet[order] = np.arange(len(order))
+        keyframes = np.sort(frame_of_packet[np.asarray(is_key, dtype=bool)])
+        return cls(fps, timestamps[order], keyframes)
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return np.array([INDEX_VERSION, stat.st_size, int(stat.st_mtime)], dtype=np.int64)
+
+    def save(self, path, video_path):
+        np.savez_compressed(path, signature=self._signature(video_path), fps=self.fps,
+                            timestamps_ms=self.timestamps_ms, keyframes=self.keyframes)
+
+    @classmethod
+    def load(cls, path, video_path):
+        """The cached index, or None if it is missing or the video has changed"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if not np.array_equal(data['signature'], cls._signature(video_path)):
+                return None
+            return cls(float(data['fps']), data['timestamps_ms'], data['keyframes'])
+
+    @classmethod
+    def for_video(cls, video_path):
+        """Load the index cached next to the video, building and saving it on first use"""
+        path = video_path + INDEX_SUFFIX
+        index = cls.load(path, video_path)
+        if index is None:
+            print(f"Indexing {video_path} (one-time, cached in {path})...")
+            index = cls.build(video_path)
+            try:
+                index.save(path, video_path)
+            except OSError as error:
+                print(f"Could not cache frame index: {error}")
+        return index
+
+    def timestamp(self, frame):
+        """Seconds of `frame` into the video"""
+        frame = min(max(frame, 0), self.frame_count - 1)
+        return self.timestamps_ms[frame] / 1000.0
+
+    def frame_at(self, seconds):
+        """The frame on screen at `seconds` into the video"""
+        frame = int(np.searchsorted(self.timestamps_ms, seconds * 1000.0, side='right')) - 1
+        return min(max(frame, 0), self.frame_count - 1)
+
+    def keyframe_before(self, frame):
+        """The last keyframe at or before `frame`.
+
+        Without keyframe information (the backend could not read raw
+        packets) this is `frame` itself, leaving the seek to OpenCV.
+        """
+        if len(self.keyframes) == 0:
+            return frame
+        i = int(np.searchsorted(self.keyframes, frame, side='right')) - 1
+        return int(self.keyframes[i]) if i >= 0 else 0
+
+    def seek(self, capture, frame, current=None):
+        """Position `capture` so its next read() returns `frame`.
+
+        `current` is the frame the next read() would return now. Going
+        forward without passing a keyframe just grabs ahead; otherwise the
+        capture jumps to the keyframe at or before `frame` and grabs forward
+        from there, so the landing frame is exact.
+        """
+        frame = min(max(frame, 0), self.frame_count - 1)
+        start = self.keyframe_before(frame)
+        if current is None or not start <= current <= frame:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+            current = start
+        for _ in range(frame - current):
+            if not capture.grab():
+                break
+        return frame
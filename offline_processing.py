@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Offline Processing - sharded multi-process speed estimation for long videos
+
+The video is split into frame ranges (shards) that worker processes run
+through the speed-trap pipeline, each with its own detector and tracker.
+Every shard starts `overlap` frames before its range so its tracker and
+speed-trap timers are warmed up. Those overlap frames are also processed
+by the previous shard, and the tracks that both shards produce there are
+used to stitch the shard-local track IDs into one set of global IDs.
+
+Crossing times use the video clock (frame timestamps), so the crossing events
+and speeds match a sequential run as long as `overlap` covers the time a
+vehicle needs to get from the first line to the second.
+
+Usage:
+    python offline_processing.py archive.mp4 --workers 8
+    python offline_processing.py highway_mini.mp4 --workers 4 --verify
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+import cv2
+
+import detectors
+import pipeline
+from frame_index import FrameIndex
+from tracker import make_tracker
+
+SPEED_TRAP = {'red_line_y': 198, 'blue_line_y': 268, 'offset': 7, 'distance': 100}  # 100 meters between the lines
+
+# Detector of this worker process, loaded once by _init_worker
+_worker = {}
+
+
+def plan_shards(total_frames, shards, overlap=300):
+    """Split frames [0, total_frames) into `shards` ranges.
+
+    Returns (warmup_start, start, end) per shard: the shard reports frames
+    [start, end) and processes from warmup_start = start - overlap.
+    """
+    shards = max(1, min(shards, total_frames))
+    bounds = [round(i * total_frames / shards) for i in range(shards + 1)]
+    return [(max(0, start - overlap), start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+def _init_worker(backend, weights):
+    # One process per core: keep each worker's libraries single-threaded
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    cv2.setNumThreads(1)
+    _worker['model'] = detectors.load_detector(backend, weights)
+
+
+def process_shard(video, warmup_start, start, end, tracker_mode='centroid', rect=False, batch_size=1,
+                  max_latency=None, model=None):
+    """Run the speed trap over frames [warmup_start, end) of `video`.
+
+    Returns the shard's tracks per frame (frame number -> [[x1, y1, x2, y2, id], ...])
+    and the crossing events completed in [start, end), all with shard-local IDs.
+    rect=True letterboxes the speed-trap band into a rectangular model input
+    (see pipeline.preprocess), for detectors.RECT_BACKENDS; batch_size and
+    max_latency go to pipeline.detect().
+    """
+    model = model if model is not None else _worker['model']
+    source = pipeline.VideoSource(video, frame_index=FrameIndex.for_video(video))  # exact seek to warmup_start
+    source.seek(warmup_start)
+    trap = pipeline.SpeedTrap(**SPEED_TRAP)
+
+    packets = pipeline.build(source,
+                             pipeline.preprocess((1020, 500), model_size=640, roi=trap.roi(1020), rect=rect,
+                                                 buffers=batch_size + 8, display=False),
+                             pipeline.detect(model, batch_size=batch_size, max_latency=max_latency, verbose=False),
+                             pipeline.track(make_tracker(tracker_mode)),
+                             pipeline.speed(trap))  # timed by the frames' media_time
+
+    tracks = {}
+    events = []
+    for packet in packets:
+        frame = packet['position'] - 1
+        if frame >= end:
+            break
+        tracks[frame] = [[int(value) for value in bbox] for bbox in packet['tracks']]
+        if frame < start:
+            continue
+        for event in packet['events']:
+            events.append({'frame': frame, 'id': int(event['id']), 'direction': event['direction'],
+                           'speed': event['speed'], 'elapsed': event['elapsed']})
+    source.release()
+    return {'warmup_start': warmup_start, 'start': start, 'end': end, 'tracks': tracks, 'events': events}
+
+
+def _process_shard_args(args):
+    return process_shard(*args)
+
+
+def _match_ids(previous_tracks, previous_ids, shard):
+    """Map the shard's local IDs to the global IDs of the previous shard.
+
+    previous_tracks are the previous shard's tracks with its local IDs and
+    previous_ids maps those to global IDs.
+
+    Every box that both shards report on the same overlap frame is a vote
+    for (local ID, global ID); pairs are taken one-to-one by vote count.
+    """
+    votes = Counter()
+    for frame in range(shard['warmup_start'], shard['start']):
+        by_box = {tuple(bbox[:4]): bbox[4] for bbox in previous_tracks.get(frame, [])}
+        for bbox in shard['tracks'].get(frame, []):
+            global_id = previous_ids.get(by_box.get(tuple(bbox[:4])))
+            if global_id is not None:
+                votes[(bbox[4], global_id)] += 1
+
+    mapping, taken = {}, set()
+    for (local_id, global_id), _ in votes.most_common():
+        if local_id not in mapping and global_id not in taken:
+            mapping[local_id] = global_id
+            taken.add(global_id)
+    return mapping
+
+
+def stitch(shards):
+    """Combine shard results (in frame order) into global tracks and events.
+
+    Global IDs are numbered by first appearance, as a single sequential
+    tracker would number them. An ID measured in two shards keeps its
+    first crossing per direction, like the SpeedTrap counters do.
+    """
+    tracks = {}
+    events = []
+    next_global = 0
+    previous_tracks = {}
+    previous_ids = {}
+
+    for shard in shards:
+        # local ID -> global ID for this shard
+        mapping = _match_ids(previous_tracks, previous_ids, shard)
+        for frame in range(shard['start'], shard['end']):
+            frame_tracks = []
+            for x1, y1, x2, y2, local_id in shard['tracks'].get(frame, []):
+                if local_id not in mapping:
+                    mapping[local_id] = next_global
+                    next_global += 1
+                frame_tracks.append([x1, y1, x2, y2, mapping[local_id]])
+            tracks[frame] = frame_tracks
+        for event in shard['events']:
+            events.append(dict(event, id=mapping[event['id']]))
+
+        previous_tracks = shard['tracks']
+        previous_ids = mapping
+
+    measured = set()
+    unique_events = []
+    for event in sorted(events, key=lambda e: e['frame']):
+        key = (event['id'], event['direction'])
+        if key not in measured:
+            measured.add(key)
+            unique_events.append(event)
+    return tracks, unique_events
+
+
+def process_video(video, workers=None, shards=None, overlap=300, backend='torch',
+                  weights=detectors.DEFAULT_WEIGHTS, tracker_mode='centroid', batch_size=1, max_latency=None,
+                  model=None):
+    """Process `video` in shards on `workers` processes and stitch the results.
+
+    With workers=1 the shards run in this process (on `model` if given).
+    Returns (tracks per frame, crossing events).
+    """
+    workers = workers or os.cpu_count() or 1
+    total_frames = FrameIndex.for_video(video).frame_count  # built once here, loaded by the workers
+    plan = plan_shards(total_frames, shards or workers, overlap)
+    rect = backend in detectors.RECT_BACKENDS
+    jobs = [(video, warmup_start, start, end, tracker_mode, rect, batch_size, max_latency)
+            for warmup_start, start, end in plan]
+
+    if workers == 1:
+        if model is None:
+            model = detectors.load_detector(backend, weights)
+        results = [process_shard(*job, model=model) for job in jobs]
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(backend, weights)) as pool:
+            results = pool.map(_process_shard_args, jobs, chunksize=1)
+    return stitch(results)
+
+
+def compare_events(expected, actual, speed_tolerance=1e-6):
+    """Return a list of differences between two crossing-event lists"""
+    differences = []
+    if len(expected) != len(actual):
+        differences.append(f"{len(actual)} crossings vs {len(expected)} sequential")
+    for exp, act in zip(expected, actual):
+        same = (exp['frame'], exp['id'], exp['direction']) == (act['frame'], act['id'], act['direction'])
+        if not same or abs(exp['speed'] - act['speed']) > speed_tolerance:
+            differences.append(f"frame {act['frame']} id {act['id']} {act['direction']} {act['speed']:.2f} km/h "
+                               f"vs sequential frame {exp['frame']} id {exp['id']} {exp['direction']} {exp['speed']:.2f} km/h")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded multi-process speed estimation of a long video')
+    parser.add_argument('video')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--shards', type=int, default=None, help='number of frame ranges (default: one per worker)')
+    parser.add_argument('--overlap', type=int, default=300,
+                        help='warm-up frames before each shard; must cover a vehicle\'s travel between the lines')
+    parser.add_argument('--backend', default='torch', choices=detectors.BACKENDS)
+    parser.add_argument('--weights', default=detectors.DEFAULT_WEIGHTS)
+    parser.add_argument('--tracker', default='centroid')
+    parser.add_argument('--batch-size', type=int, default=8, help='frames per detector call in each worker')
+    parser.add_argument('--max-latency', type=float, default=None, metavar='SECONDS',
+                        help='send a partial batch once its oldest frame has waited this long (default: wait for a full batch)')
+    parser.add_argument('--output', default='offline_crossings.json')
+    parser.add_argument('--verify', action='store_true', help='also run sequentially and compare the crossings')
+    args = parser.parse_args()
+
+    if args.backend != 'torch':
+        # Export / quantize once here instead of racing in every worker
+        detectors.load_detector(args.backend, args.weights)
+
+    start = time.time()
+    tracks, events = process_video(args.video, args.workers, args.shards, args.overlap,
+                                   args.backend, args.weights, args.tracker, args.batch_size, args.max_latency)
+    elapsed = time.time() - start
+    print(f"Processed {len(tracks)} frames on {args.workers} workers in {elapsed:.1f}s "
+          f"({len(tracks) / elapsed:.1f} fps), {len(events)} crossings")
+
+    with open(args.output, 'w') as f:
+        json.dump({'video': args.video, 'frames': len(tracks), 'events': events}, f, indent=2)
+    print(f"Crossings saved: {args.output}")
+
+    if args.verify:
+        start = time.time()
+        _, sequential = process_video(args.video, workers=1, shards=1, backend=args.backend,
+                                      weights=args.weights, tracker_mode=args.tracker,
+                                      batch_size=args.batch_size, max_latency=args.max_latency)
+        print(f"Sequential run: {time.time() - start:.1f}s")
+        differences = compare_events(sequential, events)
+        if differences:
+            print("DIFFERENCES FROM SEQUENTIAL RUN:")
+            for line in differences:
+                print(f"  {line}")
+            return 1
+        print("Crossings match the sequential run")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
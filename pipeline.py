@@ -0,0 +1,1247 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming Pipeline - the shared frame loop of all estimator scripts
+
+    frame source -> preprocess -> detect -> track -> speed -> VANET -> render -> sink
+
+Every stage is a generator that takes an iterable of packets and yields
+them on, so stages compose with build()/run() and can be swapped per
+script. Inserting threaded() between stages runs everything upstream of it
+on its own thread, so decode, inference and rendering can overlap.
+
+A packet is a dict that each stage adds its results to:
+
+    index       running frame number (1-based)
+    position    1-based frame number in the video (CAP_PROP_POS_FRAMES after the read)
+    start_time  time.time() when the frame was read
+    media_time  seconds into the video of this frame (container timestamp)
+    frame       the image; preprocess resizes it and render draws on it
+    input       letterboxed model input made by preprocess(model_size=...)
+    input_map   (scale, offset, lower, upper) from input to frame coordinates
+    results     raw model.predict() results for this frame
+    records     DETECTION_DTYPE array of the vehicle detections
+    detections  (N, 4) int32 array of vehicle boxes [x1, y1, x2, y2]
+    tracks      [[x1, y1, x2, y2, id], ...] from the tracker
+    events      speed-trap crossings completed on this frame
+    skip_detection  set by stride() or MotionGate on frames the detector does not run on
+    skip_display    set by render(every=N) on frames that are not drawn or shown
+    gated       set by MotionGate on frames skipped for lack of motion
+"""
+
+import argparse
+import csv
+import json
+import os
+import pickle
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import detectors
+from tracker import TRACKERS
+
+CLASS_LIST = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave', 'oven',
+              'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush']
+
+# COCO class IDs counted as vehicles: car, motorcycle, bus, truck
+VEHICLE_CLASSES = (2, 3, 5, 7)
+
+# One detection as laid out in a results[0].boxes.data row, so the model
+# output can be viewed as records without copying
+DETECTION_DTYPE = np.dtype([('box', np.float32, (4,)), ('conf', np.float32), ('cls', np.float32)])
+
+ESC_KEY = 27
+BACK_KEY = ord('a')      # step back through FrameHistory
+FORWARD_KEY = ord('d')   # step forward through FrameHistory
+
+
+class VideoSource:
+    """Frame source over a cv2.VideoCapture that can be restarted or seek mid-stream.
+
+    on_end is called when the video runs out; if it returns True the video
+    is rewound and the stream continues, otherwise the stream ends. With a
+    frame_index.FrameIndex, seek() lands on exact frames via keyframes and
+    total_frames/fps come from the index.
+    """
+
+    def __init__(self, path='highway_mini.mp4', on_end=None, frame_index=None):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        self.frame_index = frame_index
+        if frame_index is not None:
+            self.total_frames = frame_index.frame_count
+            self.fps = frame_index.fps
+        else:
+            self.total_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.on_end = on_end
+        self.index = 0
+        self.next_frame = 0    # 0-based frame the next read returns
+
+    def restart(self):
+        """Rewind to the first frame"""
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self.index = 0
+        self.next_frame = 0
+
+    def seek(self, frame):
+        """Continue the stream at 0-based `frame`"""
+        if self.frame_index is not None:
+            frame = self.frame_index.seek(self.capture, frame, current=self.next_frame)
+        else:
+            frame = min(max(frame, 0), max(self.total_frames - 1, 0))
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        self.next_frame = frame
+
+    def release(self):
+        self.capture.release()
+
+    def __iter__(self):
+        while True:
+            start_time = time.time()
+            ret, frame = self.capture.read()
+            if not ret:
+                if self.on_end is not None and self.on_end():
+                    self.restart()
+                    continue
+                return
+            self.index += 1
+            self.next_frame += 1
+            yield {
+                'index': self.index,
+                'position': self.next_frame,
+                'start_time': start_time,
+                'media_time': self.media_time(self.next_frame - 1),
+                'frame': frame,
+            }
+
+    def media_time(self, frame):
+        """Seconds into the video of the 0-based `frame` just read.
+
+        Uses the frame index or the container timestamp (CAP_PROP_POS_MSEC),
+        falling back to frame / fps where the backend reports no timestamps.
+        """
+        if self.frame_index is not None:
+            return self.frame_index.timestamp(frame)
+        msec = self.capture.get(cv2.CAP_PROP_POS_MSEC)
+        if msec > 0 or frame == 0:
+            return msec / 1000.0
+        return frame / (self.fps if self.fps > 0 else 30.0)
+
+
+def preprocess(size=(1020, 500), model_size=None, roi=None, rect=False, display=True, buffers=8):
+    """Resize every frame to the working resolution.
+
+    With model_size (the detector's input size, e.g. 640) the decoded frame
+    is also letterboxed straight from full resolution into 'input', a
+    model_size x model_size image that detect() sends to the model as is,
+    instead of the model resizing the working-resolution frame a second
+    time. With roi=(x1, y1, x2, y2) in working-resolution coordinates (see
+    SpeedTrap.roi) only that region goes into the input. rect=True pads
+    only up to the next multiple of 32, like ultralytics' rectangular
+    letterbox, so a wide speed-trap band becomes e.g. a 640x192 input
+    instead of 640x640; use it for models that take any stride-32 shape
+    (detectors.RECT_BACKENDS), not for the fixed-shape ONNX exports. 'input_map'
+    holds the (scale, offset, lower, upper) arrays with which detect() maps
+    boxes back to working-resolution coordinates, so speeds are measured
+    in the same space while detections no longer depend on it.
+
+    display=False (headless runs) skips the working-resolution frame
+    altogether when there is a model input; 'frame' then stays the decoded
+    image at source resolution, so stages reading it must not assume
+    working-resolution coordinates (MotionGate scales it itself). Inputs are written into
+    `buffers` preallocated images used in turn, which must exceed the
+    frames in flight between preprocess and detect (threaded() queue
+    sizes plus the detect batch size).
+    """
+    width, height = size
+    layout = {}   # geometry for the current source frame shape
+
+    def plan(shape):
+        h, w = shape[:2]
+        kx, ky = w / width, h / height
+        x1, y1, x2, y2 = roi if roi is not None else (0, 0, width, height)
+        src = (int(x1 * kx), int(y1 * ky), min(w, int(np.ceil(x2 * kx))), min(h, int(np.ceil(y2 * ky))))
+        src_w, src_h = src[2] - src[0], src[3] - src[1]
+        gain = min(model_size / src_w, model_size / src_h)
+        new_w, new_h = int(round(src_w * gain)), int(round(src_h * gain))
+        if rect:
+            input_w = new_w + (model_size - new_w) % 32
+            input_h = new_h + (model_size - new_h) % 32
+        else:
+            input_w = input_h = model_size
+        left = int(round((input_w - new_w) / 2 - 0.1))
+        top = int(round((input_h - new_h) / 2 - 0.1))
+        gx, gy = new_w / src_w, new_h / src_h
+        scale = np.array([1 / (gx * kx), 1 / (gy * ky)] * 2, dtype=np.float32)
+        offset = np.array([(src[0] - left / gx) / kx, (src[1] - top / gy) / ky] * 2, dtype=np.float32)
+        layout.update(shape=shape, src=src, window=(left, top, left + new_w, top + new_h),
+                      input_map=(scale, offset, np.array([x1, y1] * 2, dtype=np.float32),
+                                 np.array([x2, y2] * 2, dtype=np.float32)),
+                      buffers=[np.full((input_h, input_w, 3), 114, dtype=np.uint8) for _ in range(buffers)])
+
+    def stage(packets):
+        turn = 0
+        for packet in packets:
+            frame = packet['frame']
+            if model_size is not None:
+                if layout.get('shape') != frame.shape:
+                    plan(frame.shape)
+                sx1, sy1, sx2, sy2 = layout['src']
+                left, top, right, bottom = layout['window']
+                buffer = layout['buffers'][turn % buffers]
+                turn += 1
+                cv2.resize(frame[sy1:sy2, sx1:sx2], (right - left, bottom - top),
+                           dst=buffer[top:bottom, left:right], interpolation=cv2.INTER_LINEAR)
+                packet['input'] = buffer
+                packet['input_map'] = layout['input_map']
+            if display or model_size is None:
+                packet['frame'] = cv2.resize(frame, size)
+            yield packet
+    return stage
+
+
+def detection_records(result):
+    """View one model.predict() result as a DETECTION_DTYPE record array.
+
+    Accepts torch results and the NumPy results of the exported backends
+    in detectors.py.
+    """
+    data = result.boxes.data
+    if hasattr(data, 'detach'):
+        data = data.detach().cpu().numpy()
+    data = np.ascontiguousarray(data, dtype=np.float32).reshape(-1, 6)
+    return data.view(DETECTION_DTYPE).reshape(-1)
+
+
+def filter_classes(records, classes=VEHICLE_CLASSES):
+    """Keep the records whose class ID is in `classes`"""
+    return records[np.isin(records['cls'], classes)]
+
+
+def detect(model, classes=VEHICLE_CLASSES, batch_size=1, max_latency=None, roi=None, cache=None, **predict_kwargs):
+    """Run the detector and keep the detections whose COCO class ID is in `classes`.
+
+    `classes` is also passed to model.predict so NMS only considers vehicle
+    classes. With roi=(x1, y1, x2, y2) only that region of each frame is
+    sent to the model (see SpeedTrap.roi) and boxes are mapped back to
+    full-frame coordinates. Packets with an 'input' from preprocess() send
+    that instead and map boxes with its 'input_map'; the region is then
+    set on preprocess().
+
+    With batch_size > 1 frames are collected and sent to model.predict as
+    one list, and results are handed on in frame order. A batch is sent
+    early once its oldest frame has waited max_latency seconds, so live
+    feeds can trade throughput for latency; None waits for a full batch.
+    The deadline holds while no frame arrives: upstream stages then run
+    on a reader thread, as if threaded(maxsize=1) came before detect().
+    The last partial batch is always flushed at the end of the stream.
+
+    Packets flagged with 'skip_detection' (see stride()) pass through
+    without being sent to the model, keeping their place in frame order.
+
+    With a detection_cache.DetectionCache, frames already in the cache for
+    the same frame size, region, classes and predict options are not sent
+    to the model; new detections are added and saved at the end of the
+    stream. Cached packets carry a detectors.Result in 'results'.
+    """
+    predict_kwargs.setdefault('classes', list(classes))
+    if roi is not None:
+        rx1, ry1, rx2, ry2 = roi
+        roi_offset = np.array([rx1, ry1, rx1, ry1], dtype=np.float32)
+
+    def set_records(packet, result):
+        records = filter_classes(detection_records(result), classes)
+        if 'input_map' in packet:
+            scale, offset, lower, upper = packet['input_map']
+            records['box'] = np.clip(records['box'] * scale + offset, lower, upper)
+        elif roi is not None:
+            records['box'] += roi_offset
+        packet['results'] = [result]
+        packet['records'] = records
+        packet['detections'] = records['box'].astype(np.int32)
+
+    def predict(batch):
+        targets = []
+        for packet in batch:
+            if packet.get('skip_detection'):
+                continue
+            cached = cache.get(packet['position']) if cache is not None else None
+            if cached is not None:
+                set_records(packet, detectors.Result(cached))
+            else:
+                targets.append(packet)
+        if not targets:
+            return batch
+        if 'input' in targets[0]:
+            frames = [packet['input'] for packet in targets]
+        else:
+            frames = [packet['frame'] for packet in targets]
+            if roi is not None:
+                frames = [frame[ry1:ry2, rx1:rx2] for frame in frames]
+        results = model.predict(frames if len(frames) > 1 else frames[0], **predict_kwargs)
+        for packet, result in zip(targets, results):
+            if cache is not None:
+                cache.put(packet['position'], detection_records(result).view(np.float32))
+            set_records(packet, result)
+        return batch
+
+    def open_cache(packet):
+        settings = {key: value for key, value in predict_kwargs.items() if key != 'verbose'}
+        if 'input' in packet:
+            # Rows are cached in input coordinates; the map identifies the input
+            settings['input_map'] = [a.tolist() for a in packet['input_map'][:2]]
+            cache.open(frame_size=packet['input'].shape[:2], **settings)
+        else:
+            cache.open(frame_size=packet['frame'].shape[:2], roi=roi, **settings)
+
+    def stage(packets):
+        deadline = [None]  # when the pending batch must be sent
+        if batch_size > 1 and max_latency is not None:
+            # Read ahead on a thread so a partial batch goes out on time even if the source stalls
+            packets = _handoff(packets, 1, 'block', 'detect input',
+                               timeout=lambda: None if deadline[0] is None else max(0.0, deadline[0] - time.time()))
+        try:
+            yield from batched(packets, deadline)
+        finally:
+            if cache is not None:
+                cache.save()
+
+    def batched(packets, deadline):
+        batch = []     # packets in frame order, including skipped ones
+        pending = 0    # packets in batch that go to the model
+        for packet in packets:
+            if packet is _IDLE:
+                if pending and time.time() >= deadline[0]:
+                    yield from predict(batch)
+                    batch = []
+                    pending = 0
+                    deadline[0] = None
+                continue
+            if cache is not None and cache.path is None:
+                open_cache(packet)
+            if packet.get('skip_detection'):
+                if pending:
+                    batch.append(packet)
+                else:
+                    yield packet
+                continue
+            if not pending and max_latency is not None:
+                deadline[0] = time.time() + max_latency
+            batch.append(packet)
+            pending += 1
+            if pending >= batch_size or (max_latency is not None and time.time() >= deadline[0]):
+                yield from predict(batch)
+                batch = []
+                pending = 0
+                deadline[0] = None
+        if batch:
+            yield from predict(batch)
+    return stage
+
+
+def stride(tracker, trap, max_stride=4, approach_margin=60):
+    """Adaptive detection stride: flag frames on which detection can be skipped.
+
+    Place before detect() and pair with track() and a tracker that can
+    coast tracks (KalmanTracker with max_age >= max_stride). While no
+    track is within approach_margin px of the red or blue line the stride
+    doubles up to max_stride; as soon as a vehicle approaches a line it
+    drops back to 1, so crossings are measured on detected frames. On
+    skipped frames track() propagates positions with the motion model.
+    Decisions use the tracker state after the previous frame, so combine
+    with batch_size=1. Trackers without predict() and tracks(), or whose
+    max_age would drop tracks between detections, are rejected.
+    """
+    if not (hasattr(tracker, 'predict') and hasattr(tracker, 'tracks')):
+        raise TypeError(f"stride() needs a tracker that can coast tracks between detections "
+                        f"(predict() and tracks(), e.g. KalmanTracker / --tracker kalman), "
+                        f"not {type(tracker).__name__}")
+    if getattr(tracker, 'max_age', max_stride) < max_stride:
+        raise ValueError(f"A stride of up to {max_stride} frames needs a tracker max_age of at least "
+                         f"{max_stride}, got {tracker.max_age}")
+    lines = np.array([trap.red_line_y, trap.blue_line_y], dtype=float)
+
+    def stage(packets):
+        current = 1
+        since_detection = max_stride    # always detect on the first frame
+        for packet in packets:
+            tracks = tracker.tracks()
+            if tracks:
+                cy = (np.array([t[1] for t in tracks]) + np.array([t[3] for t in tracks])) / 2.0
+                near_line = bool((np.abs(cy[:, None] - lines[None, :]) <= approach_margin).any())
+            else:
+                near_line = False
+            current = 1 if near_line else min(current * 2, max_stride)
+
+            skip = since_detection < current
+            packet['skip_detection'] = skip
+            packet['stride'] = current
+            since_detection = since_detection + 1 if skip else 1
+            yield packet
+    return stage
+
+
+class MotionGate:
+    """Pre-detector gate that skips YOLO on frames without motion.
+
+    A MOG2 background subtractor runs on each frame downscaled to `scale`
+    times the working resolution `size`, whatever resolution the packet's
+    frame has (preprocess(display=False) leaves it at the decoded size).
+    When no foreground blob of at least min_area px overlaps `region`
+    (x1, y1, x2, y2; default the whole frame), both in working-resolution
+    coordinates like SpeedTrap.roi(), the packet is flagged
+    'skip_detection' with no detections, so the tracker and speed trap
+    still see the frame as an empty road. Detection stays on
+    for `hold` frames after the last motion so departing vehicles are
+    still tracked. Use the instance as a stage before detect(); the number
+    of gated frames is printed when the stream ends.
+    """
+
+    def __init__(self, region=None, size=(1020, 500), scale=0.25, min_area=400, hold=5, history=500,
+                 var_threshold=16):
+        self.region = region
+        self.size = size
+        self.scale = scale
+        self.min_area = min_area
+        self.hold = hold
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=var_threshold,
+                                                             detectShadows=True)
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.total_frames = 0
+        self.gated_frames = 0
+
+    def has_motion(self, frame):
+        small_size = (int(self.size[0] * self.scale), int(self.size[1] * self.scale))
+        small = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+        mask = self.subtractor.apply(small)
+        # MOG2 marks shadows as 127; only count real foreground
+        _, mask = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        if self.region is not None:
+            x1, y1, x2, y2 = (int(v * self.scale) for v in self.region)
+            mask = mask[y1:y2, x1:x2]
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        min_area = self.min_area * self.scale * self.scale
+        return bool((stats[1:count, cv2.CC_STAT_AREA] >= min_area).any())
+
+    def summary(self):
+        percent = 100.0 * self.gated_frames / self.total_frames if self.total_frames else 0.0
+        return f"Motion gate: skipped detection on {self.gated_frames}/{self.total_frames} frames ({percent:.1f}%)"
+
+    def __call__(self, packets):
+        quiet = self.hold
+        try:
+            for packet in packets:
+                self.total_frames += 1
+                quiet = 0 if self.has_motion(packet['frame']) else quiet + 1
+                if quiet > self.hold and not packet.get('skip_detection'):
+                    self.gated_frames += 1
+                    packet['skip_detection'] = True
+                    packet['gated'] = True
+                    packet['records'] = np.empty(0, dtype=DETECTION_DTYPE)
+                    packet['detections'] = np.empty((0, 4), dtype=np.int32)
+                yield packet
+        finally:
+            print(self.summary())
+
+
+def track(tracker):
+    """Assign track IDs with any tracker exposing update(boxes).
+
+    Frames skipped by stride() or MotionGate are filled in from the
+    tracker's motion model via predict() and tracks() when it has one;
+    other trackers are updated with the packet's detections, which a
+    gated frame leaves empty.
+    """
+    coasts = hasattr(tracker, 'predict') and hasattr(tracker, 'tracks')
+
+    def stage(packets):
+        for packet in packets:
+            if packet.get('skip_detection') and coasts:
+                tracker.predict()
+                packet['tracks'] = tracker.tracks()
+            elif packet.get('skip_detection') and 'detections' not in packet:
+                packet['tracks'] = tracker.update(np.empty((0, 4), dtype=np.int32))
+            else:
+                packet['tracks'] = tracker.update(packet['detections'])
+            yield packet
+    return stage
+
+
+class SpeedTrap:
+    """Two-line speed trap timing each track between the red and blue lines.
+
+    A vehicle going down starts its timer at the red line and is measured
+    at the blue line; going up is the reverse. Each ID is measured once
+    per direction. Crossing times come from update(tracks, now), or from
+    clock() when no time is given.
+
+    crossing='interpolate' keeps every track's previous center and finds
+    the tracks whose center moved across a line since then, all at once,
+    timing the crossing by linear interpolation between the two frames;
+    vehicles are measured however far they move per frame, so frames can
+    be skipped or the frame rate lowered. Centers older than max_gap
+    seconds are not interpolated from. If time goes backwards (a loop or
+    reconnect) the stored centers and the timers started later are dropped. crossing='band' is the original
+    test: a line counts as reached on a frame whose center is within
+    `offset` px of it.
+
+    count_down and count_up are running totals; measured_down and
+    measured_up hold the IDs already measured, which forget(ids) drops
+    along with the rest of a departed vehicle's state.
+    """
+
+    def __init__(self, red_line_y=198, blue_line_y=268, offset=7, distance=100,
+                 directions=('down', 'up'), clock=time.time, crossing='interpolate', max_gap=1.0):
+        if crossing not in ('interpolate', 'band'):
+            raise ValueError(f"Unknown crossing test '{crossing}', expected 'interpolate' or 'band'")
+        self.red_line_y = red_line_y
+        self.blue_line_y = blue_line_y
+        self.offset = offset
+        self.distance = distance  # meters between the lines
+        self.directions = directions
+        self.clock = clock
+        self.crossing = crossing
+        self.max_gap = max_gap
+        self.down = {}
+        self.up = {}
+        self.count_down = 0
+        self.count_up = 0
+        self.measured_down = set()
+        self.measured_up = set()
+        self._forget_centers()
+
+    def _forget_centers(self):
+        # Last center y and time per track ID, sorted by ID
+        self.last_ids = np.empty(0, dtype=np.int64)
+        self.last_y = np.empty(0, dtype=np.float64)
+        self.last_time = np.empty(0, dtype=np.float64)
+        self.latest = -np.inf
+
+    def reset(self, counters=True):
+        """Forget running timers, and with counters=True also the counts (e.g. after a seek)"""
+        self.down.clear()
+        self.up.clear()
+        self._forget_centers()
+        self.measured_down.clear()
+        self.measured_up.clear()
+        if counters:
+            self.count_down = 0
+            self.count_up = 0
+
+    def forget(self, ids):
+        """Drop all per-vehicle state of these IDs, e.g. vehicles that left a long-running feed"""
+        ids = set(ids)
+        for vehicle_id in ids:
+            self.down.pop(vehicle_id, None)
+            self.up.pop(vehicle_id, None)
+        self.measured_down -= ids
+        self.measured_up -= ids
+        keep = ~np.isin(self.last_ids, list(ids))
+        self.last_ids = self.last_ids[keep]
+        self.last_y = self.last_y[keep]
+        self.last_time = self.last_time[keep]
+
+    def roi(self, frame_width, margin=80):
+        """Region (x1, y1, x2, y2) covering the measurement band plus `margin` px, for detect(roi=...)"""
+        top = min(self.red_line_y, self.blue_line_y) - margin
+        bottom = max(self.red_line_y, self.blue_line_y) + margin
+        return (0, max(0, top), frame_width, bottom)
+
+    def near(self, line_y, cy):
+        return line_y < (cy + self.offset) and line_y > (cy - self.offset)
+
+    def update(self, tracks, now=None):
+        """Return the crossings completed by these tracks at time `now` as event dicts"""
+        now = self.clock() if now is None else now
+        if now < self.latest:
+            self._rewind(now)
+        self.latest = now
+        if self.crossing == 'interpolate':
+            return self._update_interpolated(tracks, now)
+        events = []
+        for x3, y3, x4, y4, vehicle_id in tracks:
+            cx = int(x3 + x4) // 2
+            cy = int(y3 + y4) // 2
+            for direction, start_y, end_y, timers in (('down', self.red_line_y, self.blue_line_y, self.down),
+                                                      ('up', self.blue_line_y, self.red_line_y, self.up)):
+                if direction not in self.directions:
+                    continue
+                if self.near(start_y, cy):
+                    timers[vehicle_id] = now
+                if vehicle_id in timers and self.near(end_y, cy):
+                    self._measure(events, direction, vehicle_id, now - timers[vehicle_id],
+                                  (x3, y3, x4, y4), (cx, cy))
+        return events
+
+    def _rewind(self, now):
+        # Nothing timed after `now` can be interpolated from or measured against
+        self._forget_centers()
+        for timers in (self.down, self.up):
+            for vehicle_id in [v for v, started in timers.items() if started > now]:
+                del timers[vehicle_id]
+
+    def _measure(self, events, direction, vehicle_id, elapsed_time, box, center):
+        measured = self.measured_down if direction == 'down' else self.measured_up
+        if vehicle_id not in measured:
+            measured.add(vehicle_id)
+            if direction == 'down':
+                self.count_down += 1
+            else:
+                self.count_up += 1
+            speed_ms = self.distance / elapsed_time
+            events.append({
+                'id': vehicle_id,
+                'direction': direction,
+                'speed': speed_ms * 3.6,  # km/h
+                'elapsed': elapsed_time,
+                'box': box,
+                'center': center,
+            })
+
+    def _update_interpolated(self, tracks, now):
+        events = []
+        if len(tracks) == 0:
+            return events
+        tracks = np.asarray(tracks)
+        ids = tracks[:, 4].astype(np.int64)
+        cy = (tracks[:, 1] + tracks[:, 3]) / 2.0
+
+        # Previous center of each track, if recent enough
+        known = np.zeros(len(ids), dtype=bool)
+        y0 = cy.copy()
+        t0 = np.full(len(ids), now, dtype=np.float64)
+        if len(self.last_ids):
+            slot = np.minimum(np.searchsorted(self.last_ids, ids), len(self.last_ids) - 1)
+            gap = now - self.last_time[slot]
+            known = (self.last_ids[slot] == ids) & (gap > 0) & (gap <= self.max_gap)
+            y0[known] = self.last_y[slot[known]]
+            t0[known] = self.last_time[slot[known]]
+
+        # Signed distance to each line before and after; a sign change is a crossing
+        lines = np.array([self.red_line_y, self.blue_line_y], dtype=np.float64)
+        before = y0[:, None] - lines
+        after = cy[:, None] - lines
+        went_down = known[:, None] & (before < 0) & (after >= 0)
+        went_up = known[:, None] & (before >= 0) & (after < 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = before / (before - after)
+            times = t0[:, None] + fraction * (now - t0)[:, None]
+
+        red, blue = 0, 1
+        for row in np.flatnonzero((went_down | went_up).any(axis=1)):
+            vehicle_id = int(ids[row])
+            x3, y3, x4, y4 = (int(v) for v in tracks[row, :4])
+            center = (int(x3 + x4) // 2, int(y3 + y4) // 2)
+            for direction, start, end, timers, moved in (('down', red, blue, self.down, went_down),
+                                                         ('up', blue, red, self.up, went_up)):
+                if direction not in self.directions:
+                    continue
+                # Both lines can be passed between two frames; the start line comes first
+                if moved[row, start]:
+                    timers[vehicle_id] = times[row, start]
+                if moved[row, end] and vehicle_id in timers:
+                    self._measure(events, direction, vehicle_id, float(times[row, end] - timers[vehicle_id]),
+                                  (x3, y3, x4, y4), center)
+
+        # Remember the new centers, replacing older entries of the same IDs and dropping stale ones
+        keep = ~np.isin(self.last_ids, ids) & (now - self.last_time <= self.max_gap)
+        all_ids = np.concatenate([self.last_ids[keep], ids])
+        order = np.argsort(all_ids, kind='stable')
+        self.last_ids = all_ids[order]
+        self.last_y = np.concatenate([self.last_y[keep], cy])[order]
+        self.last_time = np.concatenate([self.last_time[keep], np.full(len(ids), now, dtype=np.float64)])[order]
+        return events
+
+
+def speed(trap, clock='media'):
+    """Feed tracks through a SpeedTrap and attach completed crossings.
+
+    With clock='media' crossings are timed by the frames' 'media_time',
+    so speeds are right however fast or slow frames are processed -
+    paused, batched, strided or split over shards. clock='wall' uses the
+    trap's own clock (time.time by default), e.g. for live feeds.
+    """
+    if clock not in ('media', 'wall'):
+        raise ValueError(f"Unknown clock '{clock}', expected 'media' or 'wall'")
+
+    def stage(packets):
+        for packet in packets:
+            now = packet['media_time'] if clock == 'media' else None
+            packet['events'] = trap.update(packet['tracks'], now)
+            yield packet
+    return stage
+
+
+def _each(fn):
+    def stage(packets):
+        for packet in packets:
+            fn(packet)
+            yield packet
+    return stage
+
+
+def vanet(update):
+    """Hand every packet to a script-specific VANET update(packet)"""
+    return _each(update)
+
+
+def render(draw, every=1):
+    """Hand packets to a script-specific draw(packet) overlay.
+
+    With every=N only every Nth frame is drawn; the others are flagged
+    'skip_display' and display() passes them on without showing them, so
+    the render rate is decoupled from the processing rate.
+    """
+    def stage(packets):
+        for packet in packets:
+            if every > 1 and packet['index'] % every:
+                packet['skip_display'] = True
+            else:
+                draw(packet)
+            yield packet
+    return stage
+
+
+def _tiles(mask, gap):
+    """Bounding boxes (y1, y2, x1, x2) of the groups of set pixels in `mask`"""
+    grouped = cv2.dilate(mask, np.ones((gap, gap), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(grouped)
+    return [(y, y + h, x, x + w) for x, y, w, h, _ in stats[1:count]]
+
+
+class _Sprite:
+    """The pixels that draw(image) sets, ready to paste onto frames.
+
+    Drawing on a black and on a white image (or on two versions of a
+    sprite already drawn that way) gives each pixel's colour
+    premultiplied by its coverage (the black result) and how much of the
+    frame shows through (white minus black), so drawn pixels of any colour,
+    black panel backgrounds included, paste exactly. Opaque areas are
+    copied through a mask; only the tiles around partly covered
+    (anti-aliased) pixels are blended.
+    """
+
+    def __init__(self, draw, black, white, tile_gap=15):
+        draw(black)
+        draw(white)
+        self.color = black
+        self.keep = white - black
+        opaque = (self.keep == 0).all(axis=2)
+        partial = ~opaque & (self.keep != 255).any(axis=2)
+        self.mask = opaque.astype(np.uint8) * 255
+        self.opaque_tiles = _tiles(self.mask, tile_gap)
+        self.blend_tiles = _tiles(partial.astype(np.uint8), tile_gap)
+
+    def paste(self, frame, x=0, y=0):
+        height, width = frame.shape[:2]
+        for blend, tiles in ((False, self.opaque_tiles), (True, self.blend_tiles)):
+            for ty1, ty2, tx1, tx2 in tiles:
+                fy1, fy2 = max(ty1 + y, 0), min(ty2 + y, height)
+                fx1, fx2 = max(tx1 + x, 0), min(tx2 + x, width)
+                if fy1 >= fy2 or fx1 >= fx2:
+                    continue
+                region = frame[fy1:fy2, fx1:fx2]
+                sy, sx = slice(fy1 - y, fy2 - y), slice(fx1 - x, fx2 - x)
+                if blend:
+                    cv2.add(cv2.multiply(region, self.keep[sy, sx], scale=1 / 255.0), self.color[sy, sx], dst=region)
+                else:
+                    cv2.copyTo(self.color[sy, sx], self.mask[sy, sx], region)
+
+
+class Overlay:
+    """Cached annotation layer composited onto frames instead of redrawn.
+
+    draw_static(layer) draws what never changes - reference lines and
+    their labels, panel backgrounds, borders and titles - once per frame
+    size, and apply(frame) pastes it onto each frame through a mask.
+    text() draws dynamic labels the same way from a small patch per key,
+    rendered over the static layer and again only when its text changes.
+    """
+
+    def __init__(self, draw_static):
+        self.draw_static = draw_static
+        self.shape = None
+        self.layer = None
+        self.labels = {}
+
+    def apply(self, frame):
+        """Paste the static layer onto `frame` in place; call before text()"""
+        if frame.shape != self.shape:
+            self.shape = frame.shape
+            self.layer = _Sprite(self.draw_static, np.zeros(frame.shape, dtype=np.uint8),
+                                 np.full(frame.shape, 255, dtype=np.uint8))
+            self.labels = {}
+        self.layer.paste(frame)
+
+    def text(self, frame, key, text, org, scale, color, thickness=1, font=cv2.FONT_HERSHEY_SIMPLEX,
+             line_type=cv2.LINE_8):
+        """cv2.putText through a patch cached under `key` until the text or its style changes"""
+        params = (text, org, scale, color, thickness, font, line_type)
+        label = self.labels.get(key)
+        if label is None or label[0] != params:
+            (width, height), baseline = cv2.getTextSize(text, font, scale, thickness)
+            x, y = org[0] - thickness - 1, org[1] - height - thickness - 1
+            shape = (height + baseline + 2 * thickness + 3, width + 2 * thickness + 3, 3)
+            # Start from the static layer under the label, so text on a panel pastes as opaque pixels
+            black = np.zeros(shape, dtype=np.uint8)
+            white = np.full(shape, 255, dtype=np.uint8)
+            fy1, fy2 = max(y, 0), min(y + shape[0], self.shape[0])
+            fx1, fx2 = max(x, 0), min(x + shape[1], self.shape[1])
+            if fy1 < fy2 and fx1 < fx2:
+                under = (slice(fy1, fy2), slice(fx1, fx2))
+                inside = (slice(fy1 - y, fy2 - y), slice(fx1 - x, fx2 - x))
+                black[inside] = self.layer.color[under]
+                white[inside] = self.layer.color[under] + self.layer.keep[under]
+            sprite = _Sprite(lambda image: cv2.putText(image, text, (org[0] - x, org[1] - y), font, scale,
+                                                       color, thickness, line_type), black, white, tile_gap=shape[0])
+            label = (params, x, y, sprite)
+            self.labels[key] = label
+        _, x, y, sprite = label
+        sprite.paste(frame, x, y)
+
+
+class FrameHistory:
+    """Memory-bounded ring buffer of shown frames for stepping back and forth.
+
+    Each entry keeps the annotated frame, the packet's detections, tracks
+    and events, and a snapshot of script state taken by snapshot() (e.g.
+    tracker, speed trap and VANET), pickled so later frames cannot change
+    it. The oldest entries are evicted once the buffer holds more than
+    max_mb megabytes. Pass it to display() to review frames without
+    decoding or running the detector again.
+    """
+
+    PACKET_KEYS = ('index', 'position', 'records', 'detections', 'tracks', 'events')
+
+    def __init__(self, max_mb=256, snapshot=None):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.snapshot = snapshot
+        self.entries = deque()
+        self.nbytes = 0
+        self.cursor = -1    # entry being reviewed; -1 = the newest (live) frame
+
+    def add(self, packet):
+        entry = {key: packet[key] for key in self.PACKET_KEYS if key in packet}
+        entry['frame'] = packet['frame'].copy()
+        entry['state'] = pickle.dumps(self.snapshot()) if self.snapshot is not None else None
+        entry['nbytes'] = entry['frame'].nbytes + len(entry['state'] or b'') + sum(
+            entry[key].nbytes for key in ('records', 'detections') if key in entry)
+        self.entries.append(entry)
+        self.nbytes += entry['nbytes']
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            self.nbytes -= self.entries.popleft()['nbytes']
+        self.cursor = -1
+
+    def back(self):
+        """Step to the previous entry; stays on the oldest one"""
+        if self.entries:
+            self.cursor = max(self.cursor - 1, -len(self.entries))
+        return self.current()
+
+    def forward(self):
+        """Step to the next entry, or return None when already on the newest"""
+        if self.cursor == -1:
+            return None
+        self.cursor += 1
+        return self.current()
+
+    def current(self):
+        return self.entries[self.cursor] if self.entries else None
+
+    def state(self, entry):
+        """The script state snapshot stored with `entry`"""
+        return pickle.loads(entry['state']) if entry['state'] is not None else None
+
+    def review_frame(self, entry):
+        """The entry's frame with a banner marking it as history"""
+        frame = entry['frame'].copy()
+        label = f"REVIEW frame {entry.get('position', '?')} ({-self.cursor - 1} back)  a/d: step  other key: resume"
+        cv2.rectangle(frame, (0, frame.shape[0] - 24), (frame.shape[1], frame.shape[0]), (0, 0, 0), -1)
+        cv2.putText(frame, label, (8, frame.shape[0] - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1, cv2.LINE_AA)
+        return frame
+
+
+def display(window, wait=0, on_key=None, history=None, on_review=None):
+    """Show frames with cv2.imshow and handle keys.
+
+    wait is the cv2.waitKey delay in ms, or a callable returning it. ESC
+    ends the stream; any other key goes to on_key(key), which may also
+    return False to end the stream.
+
+    With a FrameHistory every shown frame is kept in it, and BACK_KEY /
+    FORWARD_KEY step through the buffered frames instantly, calling
+    on_review(entry) for each. Stepping forward past the newest frame, or
+    any other key, resumes the stream. Packets render() flagged with
+    'skip_display' pass straight through.
+    """
+    def stage(packets):
+        for packet in packets:
+            if packet.get('skip_display'):
+                yield packet
+                continue
+            cv2.imshow(window, packet['frame'])
+            if history is not None:
+                history.add(packet)
+            delay = wait() if callable(wait) else wait
+            key = cv2.waitKey(delay) & 0xFF
+            while history is not None and key in (BACK_KEY, FORWARD_KEY):
+                entry = history.back() if key == BACK_KEY else history.forward()
+                if entry is None:
+                    break
+                cv2.imshow(window, history.review_frame(entry) if history.cursor != -1 else entry['frame'])
+                if on_review is not None:
+                    on_review(entry)
+                key = cv2.waitKey(0) & 0xFF
+            yield packet
+            if key == ESC_KEY:
+                return
+            if on_key is not None and on_key(key) is False:
+                return
+    return stage
+
+
+def batch_sink(output='crossings.csv', log_every=500):
+    """Headless sink: no GUI calls, crossings go to a results file.
+
+    Replaces render() and display() for batch runs. Every crossing event is
+    collected with its frame position, and they are written to `output`
+    (CSV, or JSON if the name ends in .json) when the stream ends.
+    Throughput is printed every log_every frames and at the end.
+    """
+    fields = ('frame', 'id', 'direction', 'speed_kmh', 'elapsed_s')
+
+    def stage(packets):
+        rows = []
+        frames = 0
+        start = time.time()
+        try:
+            for packet in packets:
+                for event in packet.get('events', ()):
+                    rows.append({'frame': packet['position'], 'id': int(event['id']),
+                                 'direction': event['direction'], 'speed_kmh': round(event['speed'], 3),
+                                 'elapsed_s': round(event['elapsed'], 6)})
+                frames += 1
+                if log_every and frames % log_every == 0:
+                    print(f"{frames} frames, {frames / (time.time() - start):.1f} fps")
+                yield packet
+        finally:
+            elapsed = time.time() - start
+            with open(output, 'w', newline='') as f:
+                if output.endswith('.json'):
+                    json.dump(rows, f, indent=2)
+                else:
+                    writer = csv.DictWriter(f, fieldnames=fields)
+                    writer.writeheader()
+                    writer.writerows(rows)
+            print(f"Processed {frames} frames in {elapsed:.1f}s ({frames / elapsed if elapsed > 0 else 0.0:.1f} fps), "
+                  f"{len(rows)} crossings written to {output}")
+    return stage
+
+
+def video_sink(path, fps, event_clips=None, fourcc='mp4v', maxsize=32, policy='block'):
+    """Encode the annotated frames to a video file on a background thread.
+
+    Place after render(); packets pass on unchanged. Frames are handed to
+    a dedicated cv2.VideoWriter thread through a queue of at most maxsize
+    frames. `policy` decides what happens when the encoder falls behind:
+    'block' (lossless, for files) holds up the pipeline until the queue
+    has room; 'drop' discards the frame instead, so a live feed is never
+    held up by encoding, and the dropped frames are counted at the end.
+    Frames render() skipped are not written, so pass fps divided by its
+    `every`; their crossings still start and extend event clips.
+
+    With event_clips=(before, after) in seconds only short clips around
+    speed-trap crossings are written, as <path stem>_<frame><suffix>
+    named after the clip's first crossing; crossings within `after` of
+    each other share one clip. The pre-roll of a clip is never dropped.
+    """
+    if policy not in ('block', 'drop'):
+        raise ValueError(f"Unknown backpressure policy '{policy}', expected 'block' or 'drop'")
+    stem, suffix = os.path.splitext(path)
+
+    def write(frames, stats):
+        writer, current = None, None
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            target, frame = item
+            if target != current:
+                if writer is not None:
+                    writer.release()
+                writer = cv2.VideoWriter(target, cv2.VideoWriter_fourcc(*fourcc), fps,
+                                         (frame.shape[1], frame.shape[0]))
+                current = target
+                stats['files'] += 1
+            writer.write(frame)
+            stats['written'] += 1
+        if writer is not None:
+            writer.release()
+
+    def stage(packets):
+        frames = queue.Queue(maxsize)
+        stats = {'written': 0, 'dropped': 0, 'files': 0}
+        worker = threading.Thread(target=write, args=(frames, stats), name='video_sink', daemon=True)
+        worker.start()
+
+        def submit(target, frame, block=policy == 'block'):
+            if block:
+                frames.put((target, frame))
+                return
+            try:
+                frames.put_nowait((target, frame))
+            except queue.Full:
+                stats['dropped'] += 1
+
+        if event_clips is not None:
+            before, after = (max(1, int(round(seconds * fps))) for seconds in event_clips)
+            pre_roll = deque(maxlen=before)
+        clip, remaining = None, 0
+        try:
+            for packet in packets:
+                # A crossing on a frame render() skipped still opens or extends a clip
+                if event_clips is not None and packet.get('events'):
+                    if clip is None:
+                        clip = f"{stem}_{packet['position']}{suffix}"
+                        for earlier in pre_roll:
+                            submit(clip, earlier, block=True)
+                        pre_roll.clear()
+                    remaining = after
+                if not packet.get('skip_display'):
+                    frame = packet['frame']
+                    if event_clips is None:
+                        submit(path, frame)
+                    elif clip is not None:
+                        submit(clip, frame)
+                        remaining -= 1
+                        if remaining <= 0:
+                            clip = None
+                    else:
+                        pre_roll.append(frame)
+                yield packet
+        finally:
+            frames.put(None)
+            worker.join()
+            target = f"{stats['files']} clips ({stem}_<frame>{suffix})" if event_clips is not None else path
+            print(f"Recorded {stats['written']} frames to {target}, dropped {stats['dropped']}")
+    return stage
+
+
+def skipping(args, tracker, trap, size=(1020, 500)):
+    """stride() and MotionGate for a script's --detect-stride and --motion-gate, or None.
+
+    The gate watches the speed-trap band of the working resolution `size`
+    and comes after stride(), which would otherwise clear its flag.
+    """
+    stages = []
+    if args.detect_stride > 1:
+        stages.append(stride(tracker, trap, max_stride=args.detect_stride))
+    if args.motion_gate:
+        stages.append(MotionGate(region=trap.roi(size[0]), size=size))
+    return chain(*stages) if stages else None
+
+
+def recording(args, fps):
+    """video_sink() for a script's --record/--event-clips, or None"""
+    if not args.record:
+        return None
+    return video_sink(args.record, (fps or 30.0) / args.render_every, event_clips=args.event_clips)
+
+
+def chain(*stages):
+    """Combine several stages into one; None entries are skipped"""
+    stages = [inner for inner in stages if inner is not None]
+
+    def stage(packets):
+        for inner in stages:
+            packets = inner(packets)
+        return packets
+    return stage
+
+
+def read_crossings(path):
+    """Crossing events from a batch_sink() results file, in frame order"""
+    with open(path, 'r', newline='') as f:
+        if path.endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = [dict(row, frame=int(row['frame']), id=int(row['id']), speed_kmh=float(row['speed_kmh']),
+                         elapsed_s=float(row['elapsed_s'])) for row in csv.DictReader(f)]
+    return sorted(rows, key=lambda row: row['frame'])
+
+
+def script_args(description, video='highway_mini.mp4', events=False, history=False):
+    """Command-line options shared by the estimator scripts.
+
+    events=True adds --events, a batch_sink() results file whose
+    crossings can be jumped to; history=True adds --history-mb, the
+    memory cap of a FrameHistory.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--video', default=video)
+    parser.add_argument('--backend', default='torch',
+                        help="detector backend: torch, onnxruntime, onnxruntime-int8 or opencv (see detectors.py)")
+    parser.add_argument('--headless', action='store_true',
+                        help='no GUI: process frames as fast as possible, write crossings to --output, print throughput')
+    parser.add_argument('--output', default='crossings.csv', help='results file of --headless (.csv or .json)')
+    parser.add_argument('--clock', default='media', choices=('media', 'wall'),
+                        help='time crossings by video timestamps (media, default) or by the wall clock (wall)')
+    parser.add_argument('--crossing', default='interpolate', choices=('interpolate', 'band'),
+                        help='line-crossing test: interpolate between frames (default) or the +-offset px band')
+    parser.add_argument('--tracker', default='centroid', choices=sorted(TRACKERS),
+                        help='tracker mode (see tracker.py); kalman can coast tracks for --detect-stride')
+    parser.add_argument('--detect-stride', type=int, default=1, metavar='K',
+                        help='run the detector on as few as every Kth frame while no vehicle is near a line '
+                             '(needs --tracker kalman)')
+    parser.add_argument('--motion-gate', action='store_true',
+                        help='skip the detector on frames without motion in the speed-trap band (reports the gated count)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='frames per detector call; larger batches raise throughput at the cost of latency')
+    parser.add_argument('--max-latency', type=float, default=None, metavar='SECONDS',
+                        help='send a partial batch once its oldest frame has waited this long (default: wait for a full batch)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always run the detector instead of reusing detections cached by earlier runs')
+    if events:
+        parser.add_argument('--events', help='crossings file from a --headless run, for jumping to crossings')
+    parser.add_argument('--render-every', type=int, default=1,
+                        help='draw and show only every Nth frame; all frames are still processed')
+    parser.add_argument('--record', metavar='VIDEO',
+                        help='also encode the annotated frames to this file (e.g. annotated.mp4), also with --headless')
+    parser.add_argument('--event-clips', type=float, nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='with --record, only write clips from BEFORE to AFTER seconds around each crossing')
+    if history:
+        parser.add_argument('--history-mb', type=float, default=256,
+                            help='memory cap of the frame history used to step back (a) and forward (d)')
+    return parser.parse_args()
+
+
+_END = object()
+_IDLE = object()  # see _handoff()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def threaded(maxsize=4, policy='block', name=None):
+    """Run everything upstream of this point on a worker thread.
+
+    Packets are handed to the downstream stages through a queue holding at
+    most maxsize packets. Because OpenCV and torch release the GIL while
+    decoding, resizing and running the model, threads placed like
+
+        source, preprocess, threaded(), detect, track, threaded(), speed, render, display
+
+    keep the decoder, the inference worker and the render/sink (which
+    must stay on the main thread for cv2.imshow) busy at the same time.
+
+    Each segment is one thread and the queue is FIFO, so packets always
+    arrive in frame order. `policy` decides what happens when the queue is
+    full: 'block' (lossless) makes the producer wait for the consumer;
+    'drop_oldest' discards the oldest queued packet so a slow consumer of
+    a live feed always gets recent frames, which is reported at the end.
+    Stages that share state (stride() reads the tracker that track()
+    updates, draw functions read the SpeedTrap counters) must sit in the
+    same segment. Errors raised upstream are re-raised downstream, and the
+    worker stops when the downstream stages stop early.
+    """
+    if policy not in ('block', 'drop_oldest'):
+        raise ValueError(f"Unknown backpressure policy '{policy}', expected 'block' or 'drop_oldest'")
+
+    def stage(packets):
+        yield from _handoff(packets, maxsize, policy, name)
+    return stage
+
+
+def _handoff(packets, maxsize, policy, name, timeout=None):
+    """The worker thread and queue behind threaded().
+
+    With `timeout`, a function returning how many seconds to wait for the
+    next packet (None: no limit), _IDLE is yielded whenever none arrives
+    in time.
+    """
+    handoff = queue.Queue(maxsize)
+    stopped = threading.Event()
+    dropped = [0]
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def put_latest(packet):
+        while True:
+            try:
+                handoff.put_nowait(packet)
+                return True
+            except queue.Full:
+                try:
+                    handoff.get_nowait()
+                    dropped[0] += 1
+                except queue.Empty:
+                    pass
+
+    def produce():
+        upstream = iter(packets)
+        try:
+            for packet in upstream:
+                if stopped.is_set():
+                    break
+                if policy == 'drop_oldest':
+                    put_latest(packet)
+                elif not put(packet):
+                    break
+            put(_END)
+        except BaseException as error:
+            put(_Failure(error))
+        finally:
+            if hasattr(upstream, 'close'):
+                upstream.close()
+
+    worker = threading.Thread(target=produce, name=name, daemon=True)
+    worker.start()
+    try:
+        while True:
+            try:
+                item = handoff.get(timeout=timeout() if timeout is not None else None)
+            except queue.Empty:
+                yield _IDLE
+                continue
+            if item is _END:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        worker.join()
+        if dropped[0]:
+            print(f"{name or 'threaded'}: dropped {dropped[0]} packets under backpressure")
+
+
+def build(source, *stages):
+    """Chain stages onto a source and return the packet iterator; None stages are skipped"""
+    packets = iter(source)
+    for stage in stages:
+        if stage is not None:
+            packets = stage(packets)
+    return packets
+
+
+def run(source, *stages):
+    """Build the pipeline and pull every packet through it; returns the frame count"""
+    count = 0
+    for _ in build(source, *stages):
+        count += 1
+    return count
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Quantization Report - fp32 vs INT8 detector on the same clip
+Runs the speed-trap pipeline headless with two detector backends and
+reports throughput, per-frame detector latency and how much the car counts
+and line-crossing speeds change.
+
+Crossing times use the video clock (frame timestamps) rather than the
+wall clock, so the speed differences come from the detections alone and
+not from one backend being faster than the other.
+
+Usage:
+    python quantization_report.py                                  # onnxruntime vs onnxruntime-int8
+    python quantization_report.py --video clip.mp4 --frames 600
+    python quantization_report.py --reference torch --max-speed-diff 2
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import numpy as np
+
+import detectors
+import pipeline
+from tracker import Tracker
+
+
+class TimedDetector:
+    """Wraps a detector and records the latency of every predict() call"""
+
+    def __init__(self, model):
+        self.model = model
+        self.latencies = []
+
+    def predict(self, *args, **kwargs):
+        start = time.perf_counter()
+        results = self.model.predict(*args, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        return results
+
+
+def run_clip(model, video, max_frames=None, rect=False):
+    """Run the speed trap over `video` with `model`; returns the raw measurements.
+
+    Frames go through the same preprocess(model_size=640, roi=...) letterboxing
+    as in the estimator scripts, so the report measures the production input;
+    rect=True for detectors.RECT_BACKENDS.
+    """
+    source = pipeline.VideoSource(video)
+    trap = pipeline.SpeedTrap(red_line_y=198, blue_line_y=268, offset=7, distance=100)
+    timed = TimedDetector(model)
+
+    packets = pipeline.build(source,
+                             pipeline.preprocess((1020, 500), model_size=640, roi=trap.roi(1020), rect=rect,
+                                                 display=False),
+                             pipeline.detect(timed, verbose=False),
+                             pipeline.track(Tracker()),
+                             pipeline.speed(trap))  # timed by the frames' media_time
+
+    detections_per_frame = []
+    events = []
+    start = time.perf_counter()
+    for packet in itertools.islice(packets, max_frames):
+        detections_per_frame.append(len(packet['detections']))
+        for event in packet['events']:
+            events.append({'frame': packet['index'], 'direction': event['direction'], 'speed': event['speed']})
+    wall = time.perf_counter() - start
+    source.release()
+
+    frames = len(detections_per_frame)
+    return {
+        'frames': frames,
+        'fps': frames / wall if wall > 0 else 0.0,
+        'latencies': timed.latencies,
+        'detections_per_frame': detections_per_frame,
+        'events': events,
+        'count_down': trap.count_down,
+        'count_up': trap.count_up,
+    }
+
+
+def latency_summary(latencies):
+    ms = np.asarray(latencies, dtype=float) * 1000.0
+    if len(ms) == 0:
+        return {'mean_ms': 0.0, 'p50_ms': 0.0, 'p90_ms': 0.0, 'p99_ms': 0.0}
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'mean_ms': float(ms.mean()), 'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99)}
+
+
+def match_events(reference, candidate, max_frame_gap=3):
+    """Pair crossings of the two runs by direction and nearest frame.
+
+    Track IDs differ between runs, so a crossing is matched to the
+    unclaimed candidate crossing in the same direction that happened
+    closest in time, at most max_frame_gap frames away.
+    """
+    pairs = []
+    claimed = set()
+    for ref in reference:
+        best = None
+        for i, cand in enumerate(candidate):
+            if i in claimed or cand['direction'] != ref['direction']:
+                continue
+            gap = abs(cand['frame'] - ref['frame'])
+            if gap <= max_frame_gap and (best is None or gap < best[0]):
+                best = (gap, i)
+        if best is not None:
+            claimed.add(best[1])
+            pairs.append((ref, candidate[best[1]]))
+    return pairs
+
+
+def compare(reference, candidate, max_frame_gap=3):
+    """Differences of the candidate run relative to the reference run"""
+    pairs = match_events(reference['events'], candidate['events'], max_frame_gap)
+    speed_diffs = np.array([cand['speed'] - ref['speed'] for ref, cand in pairs], dtype=float)
+    ref_dets = np.asarray(reference['detections_per_frame'])
+    cand_dets = np.asarray(candidate['detections_per_frame'])
+    frames = min(len(ref_dets), len(cand_dets))
+    return {
+        'speedup': candidate['fps'] / reference['fps'] if reference['fps'] else 0.0,
+        'count_down_diff': candidate['count_down'] - reference['count_down'],
+        'count_up_diff': candidate['count_up'] - reference['count_up'],
+        'mean_detections_diff': float(cand_dets[:frames].mean() - ref_dets[:frames].mean()) if frames else 0.0,
+        'frames_with_different_detections': int((cand_dets[:frames] != ref_dets[:frames]).sum()),
+        'matched_crossings': len(pairs),
+        'unmatched_reference': len(reference['events']) - len(pairs),
+        'unmatched_candidate': len(candidate['events']) - len(pairs),
+        'mean_speed_diff_kmh': float(speed_diffs.mean()) if len(pairs) else 0.0,
+        'mean_abs_speed_diff_kmh': float(np.abs(speed_diffs).mean()) if len(pairs) else 0.0,
+        'max_abs_speed_diff_kmh': float(np.abs(speed_diffs).max()) if len(pairs) else 0.0,
+    }
+
+
+def print_report(names, runs, diff):
+    header = f"{'backend':<18} {'fps':>7} {'mean ms':>8} {'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7} {'down':>5} {'up':>4}"
+    print(header)
+    print('-' * len(header))
+    for name, run in zip(names, runs):
+        lat = latency_summary(run['latencies'])
+        print(f"{name:<18} {run['fps']:>7.1f} {lat['mean_ms']:>8.1f} {lat['p50_ms']:>7.1f} {lat['p90_ms']:>7.1f} "
+              f"{lat['p99_ms']:>7.1f} {run['count_down']:>5} {run['count_up']:>4}")
+
+    print(f"\n{names[1]} vs {names[0]}:")
+    print(f"  Throughput:          {diff['speedup']:.2f}x")
+    print(f"  Car count change:    down {diff['count_down_diff']:+d}, up {diff['count_up_diff']:+d}")
+    print(f"  Detections/frame:    {diff['mean_detections_diff']:+.2f} "
+          f"({diff['frames_with_different_detections']} frames differ)")
+    print(f"  Crossings matched:   {diff['matched_crossings']} "
+          f"(only in {names[0]}: {diff['unmatched_reference']}, only in {names[1]}: {diff['unmatched_candidate']})")
+    print(f"  Speed change (km/h): mean {diff['mean_speed_diff_kmh']:+.2f}, "
+          f"mean abs {diff['mean_abs_speed_diff_kmh']:.2f}, max abs {diff['max_abs_speed_diff_kmh']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare an fp32 and an INT8 detector on the same clip')
+    parser.add_argument('--video', default='highway_mini.mp4')
+    parser.add_argument('--frames', type=int, default=None, help='stop after this many frames')
+    parser.add_argument('--weights', default=detectors.DEFAULT_WEIGHTS)
+    parser.add_argument('--reference', default='onnxruntime', choices=detectors.BACKENDS)
+    parser.add_argument('--candidate', default='onnxruntime-int8', choices=detectors.BACKENDS)
+    parser.add_argument('--calibration-videos', nargs='+', default=list(detectors.DEFAULT_CALIBRATION_VIDEOS))
+    parser.add_argument('--calibration-frames', type=int, default=64)
+    parser.add_argument('--max-frame-gap', type=int, default=3, help='frames apart two crossings may be and still match')
+    parser.add_argument('--max-speed-diff', type=float, default=None,
+                        help='fail (exit 1) if any matched crossing speed differs by more km/h than this')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    names = [args.reference, args.candidate]
+    runs = []
+    for name in names:
+        model = detectors.load_detector(name, args.weights, calibration_videos=args.calibration_videos,
+                                        calibration_frames=args.calibration_frames)
+        runs.append(run_clip(model, args.video, args.frames, rect=name in detectors.RECT_BACKENDS))
+
+    diff = compare(runs[0], runs[1], args.max_frame_gap)
+    print_report(names, runs, diff)
+
+    if args.json:
+        report = {'video': args.video, 'difference': diff}
+        for name, run in zip(names, runs):
+            report[name] = {'frames': run['frames'], 'fps': run['fps'], 'count_down': run['count_down'],
+                            'count_up': run['count_up'], 'events': run['events']}
+            report[name].update(latency_summary(run['latencies']))
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved: {args.json}")
+
+    if args.max_speed_diff is not None and diff['max_abs_speed_diff_kmh'] > args.max_speed_diff:
+        print(f"\nSpeed difference {diff['max_abs_speed_diff_kmh']:.2f} km/h exceeds {args.max_speed_diff} km/h")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
 import streamlit as st
 import cv2
-import pandas as pd
-from ultralytics import YOLO
+import detectors
+from detection_cache import DetectionCache, model_key
+import pipeline
 import time
 import json
 import numpy as np
@@ -65,6 +66,8 @@ st.sidebar.subheader("🎛️ VANET Parameters")
 communication_range = st.sidebar.slider("Communication Range (pixels)", 50, 300, 180, 10)
 distance_between_lines = st.sidebar.slider("Distance Between Lines (meters)", 50, 200, 100, 10)
 detection_confidence = st.sidebar.slider("Detection Confidence", 0.1, 1.0, 0.5, 0.05)
+detector_backend = st.sidebar.selectbox("Detector Backend", detectors.BACKENDS,
+                                        help="onnxruntime/opencv run a cached ONNX export on CPU without torch")
 max_frames = st.sidebar.slider("Max Frames to Process", 50, 500, 100, 50)
 
 # Analysis options
@@ -103,8 +106,11 @@ with col1:
                 results_placeholder = st.empty()
                 
                 try:
-                    model = YOLO('yolov8n.pt')
+                    model = detectors.load_detector(detector_backend)
                     cap = cv2.VideoCapture(selected_video)
+                    # Detections of earlier runs with the same video and settings are reused
+                    cache = DetectionCache(selected_video, model_key(detector_backend))
+                    cache.open(frame_size=(height, width), conf=detection_confidence)
                     
                     analytics_data = {
                         'frames': [],
@@ -125,17 +131,18 @@ with col1:
                         start_time = time.time()
                         
                         # YOLO detection
-                        results = model.predict(frame, verbose=False, conf=detection_confidence)
+                        records = cache.get(frame_idx + 1)
+                        if records is None:
+                            results = model.predict(frame, verbose=False, conf=detection_confidence)
+                            records = pipeline.detection_records(results[0])
+                            cache.put(frame_idx + 1, records.view(np.float32))
+                        else:
+                            records = pipeline.detection_records(detectors.Result(records))
                         
-                        # Count vehicles
-                        vehicle_count = 0
-                        detected_classes = []
-                        if len(results[0].boxes) > 0:
-                            for box in results[0].boxes:
-                                class_id = int(box.cls[0])
-                                if class_id in [2, 5, 7]:  # car, bus, truck
-                                    vehicle_count += 1
-                                    detected_classes.append(class_id)
+                        # Count vehicles (car, motorcycle, bus, truck)
+                        vehicles = pipeline.filter_classes(records)
+                        vehicle_count = len(vehicles)
+                        detected_classes = vehicles['cls'].astype(int).tolist()
                         
                         # Calculate metrics
                         processing_time = time.time() - start_time
@@ -167,6 +174,7 @@ with col1:
                         frame_idx += 1
                     
                     cap.release()
+                    cache.save()
                     
                     # Display results
                     st.success("✅ Analysis Complete!")
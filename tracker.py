@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 
 class Tracker:
     def __init__(self):
@@ -10,6 +12,10 @@ class Tracker:
         self.id_count = 0
 
 
+    def reset(self):
+        # Forget all objects (e.g. after a seek); new IDs keep counting up
+        self.center_points = {}
+
     def update(self, objects_rect):
         # Objects boxes and ids
         objects_bbs_ids = []
@@ -47,4 +53,496 @@ class Tracker:
 
         # Update dictionary with IDs not used removed
         self.center_points = new_center_points.copy()
-        return objects_bbs_ids
\ No newline at end of file
+        return objects_bbs_ids
+
+
+def box_centers(boxes):
+    """Return the (N, 2) midpoints of (N, 4) corner boxes [x1, y1, x2, y2]"""
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    return (boxes[:, :2] + boxes[:, 2:]) / 2.0
+
+
+def distance_matrix(points_a, points_b):
+    """Euclidean distance between every pair of points, shape (len(a), len(b))"""
+    diff = points_a[:, None, :] - points_b[None, :, :]
+    return np.sqrt((diff ** 2).sum(axis=2))
+
+
+def assign_greedy(cost, max_cost=np.inf):
+    """One-to-one assignment taking the cheapest remaining pair first.
+
+    Pairs whose cost is not below max_cost are never matched.
+    Returns (rows, cols) index arrays of the matched pairs.
+    """
+    cost = np.asarray(cost, dtype=float)
+    rows, cols = np.nonzero(cost < max_cost)
+    order = np.argsort(cost[rows, cols], kind='stable')
+    row_used = np.zeros(cost.shape[0], dtype=bool)
+    col_used = np.zeros(cost.shape[1], dtype=bool)
+    matched_rows, matched_cols = [], []
+    for r, c in zip(rows[order], cols[order]):
+        if row_used[r] or col_used[c]:
+            continue
+        row_used[r] = col_used[c] = True
+        matched_rows.append(r)
+        matched_cols.append(c)
+    return np.array(matched_rows, dtype=np.intp), np.array(matched_cols, dtype=np.intp)
+
+
+def assign_hungarian(cost, max_cost=np.inf):
+    """Globally optimal one-to-one assignment (Hungarian / Kuhn-Munkres).
+
+    Pairs whose cost is not below max_cost are never matched.
+    Returns (rows, cols) index arrays of the matched pairs.
+    """
+    cost = np.asarray(cost, dtype=float)
+    valid = np.isfinite(cost) & (cost < max_cost)
+
+    # Most detections have exactly one candidate track and vice versa; match
+    # those directly and only run the solver on the contested remainder
+    row_degree = valid.sum(axis=1)
+    col_degree = valid.sum(axis=0)
+    lone = valid & (row_degree == 1)[:, None] & (col_degree == 1)[None, :]
+    rows, cols = np.nonzero(lone)
+
+    rest_rows = np.flatnonzero((row_degree > 0) & ~lone.any(axis=1))
+    rest_cols = np.flatnonzero((col_degree > 0) & ~lone.any(axis=0))
+    if len(rest_rows) and len(rest_cols):
+        sub = np.ix_(rest_rows, rest_cols)
+        sub_rows, sub_cols = _solve_assignment(cost[sub], valid[sub])
+        rows = np.concatenate([rows, rest_rows[sub_rows]])
+        cols = np.concatenate([cols, rest_cols[sub_cols]])
+
+    order = np.argsort(rows, kind='stable')
+    return rows[order].astype(np.intp), cols[order].astype(np.intp)
+
+
+def _solve_assignment(cost, valid):
+    """Hungarian solver on a dense matrix; pairs outside `valid` are never returned"""
+    # Gated pairs get a cost so large that using one is never better than
+    # leaving both sides unmatched; they are filtered out afterwards
+    big = 2.0 * np.abs(cost[valid]).max() * min(cost.shape) + 1.0
+    transposed = cost.shape[0] > cost.shape[1]
+    c = np.where(valid, cost, big)
+    if transposed:
+        c = c.T
+    n, m = c.shape
+
+    # Potentials-based O(n^2 m) algorithm, inner column scan vectorized
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.intp)    # p[j] = row assigned to column j (1-based)
+    way = np.zeros(m + 1, dtype=np.intp)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = c[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            used_cols = np.flatnonzero(used)
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.flatnonzero(p[1:])
+    rows = p[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    keep = valid[rows, cols]
+    return rows[keep], cols[keep]
+
+
+ASSIGNERS = {
+    'greedy': assign_greedy,
+    'hungarian': assign_hungarian,
+}
+
+
+class MatrixTracker:
+    """Drop-in replacement for Tracker with one-to-one association.
+
+    Builds the full detection-to-track centroid distance matrix in one NumPy
+    pass and assigns IDs either greedily by distance or with the globally
+    optimal Hungarian assignment, so two detections can never claim the
+    same ID. Boxes are the [x1, y1, x2, y2] corners the estimator scripts
+    pass in, and update() returns the same [x, y, w, h, id] lists.
+    """
+
+    def __init__(self, association='hungarian', max_distance=35):
+        if association not in ASSIGNERS:
+            raise ValueError(f"Unknown association '{association}', expected one of {sorted(ASSIGNERS)}")
+        self.association = association
+        self.assign = ASSIGNERS[association]
+        self.max_distance = max_distance
+        # Centers and IDs of the objects seen in the previous frame
+        self.centers = np.empty((0, 2))
+        self.ids = np.empty(0, dtype=np.int64)
+        self.id_count = 0
+
+    def reset(self):
+        """Forget all tracks (e.g. after a seek); new IDs keep counting up"""
+        self.centers = np.empty((0, 2))
+        self.ids = np.empty(0, dtype=np.int64)
+
+    def update(self, objects_rect):
+        centers = box_centers(objects_rect)
+        rows, cols = self.assign(distance_matrix(centers, self.centers), self.max_distance)
+
+        ids = np.empty(len(centers), dtype=np.int64)
+        ids[rows] = self.ids[cols]
+        new = np.ones(len(centers), dtype=bool)
+        new[rows] = False
+        n_new = int(new.sum())
+        ids[new] = np.arange(self.id_count, self.id_count + n_new)
+        self.id_count += n_new
+
+        # Objects not matched this frame are dropped, as in Tracker
+        self.centers = centers
+        self.ids = ids
+        return [[x, y, w, h, int(object_id)] for (x, y, w, h), object_id in zip(objects_rect, ids)]
+
+
+class KalmanTracker:
+    """SORT-style tracker with constant-velocity Kalman prediction.
+
+    Every track's state [cx, cy, vx, vy] lives in one (N, 4) array and is
+    predicted for all tracks at once; detections are matched against the
+    predicted centers. Unmatched tracks are kept alive for max_age frames,
+    so IDs survive detector flicker and frames where detection is skipped
+    (call predict() on those frames). Boxes are [x1, y1, x2, y2] corners and
+    update() returns the same [x, y, w, h, id] lists as Tracker.
+    """
+
+    # Constant-velocity transition and position-only measurement model
+    F = np.array([[1., 0., 1., 0.],
+                  [0., 1., 0., 1.],
+                  [0., 0., 1., 0.],
+                  [0., 0., 0., 1.]])
+    H = np.array([[1., 0., 0., 0.],
+                  [0., 1., 0., 0.]])
+
+    def __init__(self, association='hungarian', max_distance=35, max_age=5,
+                 process_noise=1.0, measurement_noise=1.0, initial_velocity_variance=100.0):
+        if association not in ASSIGNERS:
+            raise ValueError(f"Unknown association '{association}', expected one of {sorted(ASSIGNERS)}")
+        self.association = association
+        self.assign = ASSIGNERS[association]
+        self.max_distance = max_distance
+        self.max_age = max_age
+
+        # Discrete white-noise acceleration model, same for both axes
+        q = np.array([[0.25, 0.5], [0.5, 1.0]]) * process_noise
+        self.Q = np.zeros((4, 4))
+        self.Q[np.ix_([0, 2], [0, 2])] = q
+        self.Q[np.ix_([1, 3], [1, 3])] = q
+        self.R = np.eye(2) * measurement_noise
+        self.P0 = np.diag([measurement_noise, measurement_noise,
+                           initial_velocity_variance, initial_velocity_variance])
+
+        # Per-track state, one row per live track
+        self.state = np.empty((0, 4))
+        self.covariance = np.empty((0, 4, 4))
+        self.sizes = np.empty((0, 2))
+        self.ids = np.empty(0, dtype=np.int64)
+        self.age = np.empty(0, dtype=np.int64)    # frames since last matched
+        self.id_count = 0
+
+    def reset(self):
+        """Forget all tracks (e.g. after a seek); new IDs keep counting up"""
+        self.state = np.empty((0, 4))
+        self.covariance = np.empty((0, 4, 4))
+        self.sizes = np.empty((0, 2))
+        self.ids = np.empty(0, dtype=np.int64)
+        self.age = np.empty(0, dtype=np.int64)
+
+    def predict(self, steps=1):
+        """Advance every track by the motion model without a detection"""
+        for _ in range(steps):
+            self._predict()
+            self._drop_stale()
+
+    def _predict(self):
+        self.state = self.state @ self.F.T
+        self.covariance = np.einsum('ij,njk,lk->nil', self.F, self.covariance, self.F) + self.Q
+        self.age += 1
+
+    def tracks(self):
+        """Current estimate of every live track as [x1, y1, x2, y2, id]"""
+        half = self.sizes / 2.0
+        corners = np.hstack([self.state[:, :2] - half, self.state[:, :2] + half])
+        return [[int(x1), int(y1), int(x2), int(y2), int(object_id)]
+                for (x1, y1, x2, y2), object_id in zip(corners, self.ids)]
+
+    def update(self, objects_rect):
+        self._predict()
+
+        boxes = np.asarray(objects_rect, dtype=float).reshape(-1, 4)
+        centers = box_centers(boxes)
+        rows, cols = self.assign(distance_matrix(centers, self.state[:, :2]), self.max_distance)
+        self._correct(cols, centers[rows])
+        self.sizes[cols] = boxes[rows, 2:] - boxes[rows, :2]
+        self.age[cols] = 0
+
+        ids = np.empty(len(boxes), dtype=np.int64)
+        ids[rows] = self.ids[cols]
+        new = np.ones(len(boxes), dtype=bool)
+        new[rows] = False
+        ids[new] = self._start_tracks(centers[new], boxes[new])
+        self._drop_stale()
+
+        return [[x, y, w, h, int(object_id)] for (x, y, w, h), object_id in zip(objects_rect, ids)]
+
+    def _correct(self, idx, measurements):
+        """Kalman measurement update of the tracks at idx"""
+        if len(idx) == 0:
+            return
+        P = self.covariance[idx]
+        innovation = measurements - self.state[idx, :2]
+        S = P[:, :2, :2] + self.R
+        K = P[:, :, :2] @ np.linalg.inv(S)
+        self.state[idx] += np.einsum('nij,nj->ni', K, innovation)
+        self.covariance[idx] = P - K @ P[:, :2, :]
+
+    def _start_tracks(self, centers, boxes):
+        n = len(centers)
+        new_ids = np.arange(self.id_count, self.id_count + n)
+        self.id_count += n
+        self.state = np.vstack([self.state, np.hstack([centers, np.zeros((n, 2))])])
+        self.covariance = np.concatenate([self.covariance, np.broadcast_to(self.P0, (n, 4, 4))])
+        self.sizes = np.vstack([self.sizes, boxes[:, 2:] - boxes[:, :2]])
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.age = np.concatenate([self.age, np.zeros(n, dtype=np.int64)])
+        return new_ids
+
+    def _drop_stale(self):
+        alive = self.age <= self.max_age
+        if alive.all():
+            return
+        self.state = self.state[alive]
+        self.covariance = self.covariance[alive]
+        self.sizes = self.sizes[alive]
+        self.ids = self.ids[alive]
+        self.age = self.age[alive]
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Intersection-over-union of every pair of [x1, y1, x2, y2] boxes, shape (len(a), len(b))"""
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+class TrackStore:
+    """Track boxes, IDs, ages and stream labels in preallocated arrays that grow by doubling.
+
+    Live tracks occupy the first `count` rows; dropping tracks compacts the
+    arrays in place instead of rebuilding a container every frame.
+    """
+
+    FIELDS = ('boxes', 'ids', 'ages', 'streams')
+
+    def __init__(self, capacity=64):
+        self.boxes = np.empty((capacity, 4))
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.ages = np.empty(capacity, dtype=np.int64)
+        self.streams = np.empty(capacity, dtype=np.int64)
+        self.count = 0
+
+    @property
+    def capacity(self):
+        return len(self.ids)
+
+    def _reserve(self, size):
+        if size <= self.capacity:
+            return
+        capacity = max(self.capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            grown = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self.count] = old[:self.count]
+            setattr(self, name, grown)
+
+    def append(self, boxes, ids, streams=0):
+        n = len(ids)
+        self._reserve(self.count + n)
+        end = self.count + n
+        self.boxes[self.count:end] = boxes
+        self.ids[self.count:end] = ids
+        self.ages[self.count:end] = 0
+        self.streams[self.count:end] = streams
+        self.count = end
+
+    def keep(self, mask):
+        """Keep only the live tracks where mask is True, preserving order"""
+        if mask.all():
+            return
+        idx = np.flatnonzero(mask)
+        n = len(idx)
+        for name in self.FIELDS:
+            values = getattr(self, name)
+            values[:n] = values[idx]
+        self.count = n
+
+
+class IoUTracker:
+    """Tracker that associates boxes by overlap instead of a pixel gate.
+
+    The IoU between all detections and all track boxes is computed in one
+    NumPy pass, so association does not depend on frame resolution or
+    vehicle size. Track state lives in a TrackStore. Tracks unmatched for
+    more than max_age frames are dropped (0 drops them at once, like
+    Tracker). Boxes are [x1, y1, x2, y2] corners and update() returns the
+    same [x, y, w, h, id] lists as Tracker.
+    """
+
+    def __init__(self, association='hungarian', min_iou=0.3, max_age=0, capacity=64):
+        if association not in ASSIGNERS:
+            raise ValueError(f"Unknown association '{association}', expected one of {sorted(ASSIGNERS)}")
+        self.association = association
+        self.assign = ASSIGNERS[association]
+        self.min_iou = min_iou
+        self.max_age = max_age
+        self.store = TrackStore(capacity)
+        self.id_count = 0
+
+    def reset(self):
+        """Forget all tracks (e.g. after a seek); new IDs keep counting up"""
+        self.store.count = 0
+
+    def update(self, objects_rect):
+        store = self.store
+        n = store.count
+        boxes = np.asarray(objects_rect, dtype=float).reshape(-1, 4)
+
+        iou = iou_matrix(boxes, store.boxes[:n])
+        rows, cols = self.assign(1.0 - iou, 1.0 - self.min_iou)
+        store.boxes[cols] = boxes[rows]
+        store.ages[:n] += 1
+        store.ages[cols] = 0
+
+        ids = np.empty(len(boxes), dtype=np.int64)
+        ids[rows] = store.ids[cols]
+        new = np.ones(len(boxes), dtype=bool)
+        new[rows] = False
+        n_new = int(new.sum())
+        ids[new] = np.arange(self.id_count, self.id_count + n_new)
+        self.id_count += n_new
+
+        store.keep(store.ages[:n] <= self.max_age)
+        store.append(boxes[new], ids[new])
+
+        return [[x, y, w, h, int(object_id)] for (x, y, w, h), object_id in zip(objects_rect, ids)]
+
+
+class MultiStreamTracker:
+    """Track detections from many camera feeds in one call.
+
+    update() takes one list of [x1, y1, x2, y2] boxes per stream and returns
+    one list of [x, y, w, h, id] per stream. Every stream has its own ID
+    namespace, but association for all streams is a single batched NumPy
+    pass: one cost matrix over all detections and all tracks with
+    cross-stream pairs gated out. metric is 'centroid' (pixel distance,
+    gated at max_distance) or 'iou' (gated at min_iou). Greedy assignment
+    is the default because it stays cheap on the large combined matrix.
+    """
+
+    def __init__(self, num_streams, metric='centroid', association='greedy',
+                 max_distance=35, min_iou=0.3, max_age=0, capacity=256):
+        if metric not in ('centroid', 'iou'):
+            raise ValueError(f"Unknown metric '{metric}', expected 'centroid' or 'iou'")
+        if association not in ASSIGNERS:
+            raise ValueError(f"Unknown association '{association}', expected one of {sorted(ASSIGNERS)}")
+        self.num_streams = num_streams
+        self.metric = metric
+        self.assign = ASSIGNERS[association]
+        self.max_distance = max_distance
+        self.min_iou = min_iou
+        self.max_age = max_age
+        self.store = TrackStore(capacity)
+        self.id_counts = np.zeros(num_streams, dtype=np.int64)
+
+    def update(self, objects_rects):
+        if len(objects_rects) != self.num_streams:
+            raise ValueError(f"Expected detections for {self.num_streams} streams, got {len(objects_rects)}")
+        store = self.store
+        n = store.count
+        counts = np.array([len(rects) for rects in objects_rects], dtype=np.int64)
+        boxes = np.asarray([rect for rects in objects_rects for rect in rects], dtype=float).reshape(-1, 4)
+        det_streams = np.repeat(np.arange(self.num_streams), counts)
+
+        track_boxes = store.boxes[:n]
+        if self.metric == 'iou':
+            cost = 1.0 - iou_matrix(boxes, track_boxes)
+            max_cost = 1.0 - self.min_iou
+        else:
+            cost = distance_matrix(box_centers(boxes), box_centers(track_boxes))
+            max_cost = self.max_distance
+        cost[det_streams[:, None] != store.streams[None, :n]] = np.inf
+
+        rows, cols = self.assign(cost, max_cost)
+        store.boxes[cols] = boxes[rows]
+        store.ages[:n] += 1
+        store.ages[cols] = 0
+
+        ids = np.empty(len(boxes), dtype=np.int64)
+        ids[rows] = store.ids[cols]
+        new = np.ones(len(boxes), dtype=bool)
+        new[rows] = False
+        # New IDs count up per stream; detections are grouped by stream
+        new_streams = det_streams[new]
+        rank = np.arange(len(new_streams)) - np.searchsorted(new_streams, new_streams)
+        ids[new] = self.id_counts[new_streams] + rank
+        self.id_counts += np.bincount(new_streams, minlength=self.num_streams)
+
+        store.keep(store.ages[:n] <= self.max_age)
+        store.append(boxes[new], ids[new], new_streams)
+
+        results = []
+        start = 0
+        for rects in objects_rects:
+            end = start + len(rects)
+            results.append([[x, y, w, h, int(object_id)]
+                            for (x, y, w, h), object_id in zip(rects, ids[start:end])])
+            start = end
+        return results
+
+
+# Tracker implementations by mode name, for scripts that let the user pick one
+TRACKERS = {
+    'centroid': Tracker,
+    'matrix': MatrixTracker,
+    'kalman': KalmanTracker,
+    'iou': IoUTracker,
+}
+
+
+def make_tracker(mode='centroid', **kwargs):
+    """Create a tracker by mode name; kwargs go to its constructor"""
+    if mode not in TRACKERS:
+        raise ValueError(f"Unknown tracker mode '{mode}', expected one of {sorted(TRACKERS)}")
+    return TRACKERS[mode](**kwargs)
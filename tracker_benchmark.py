@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Tracker Benchmark - Throughput and identity stability on synthetic traffic
+Runs every tracker mode over generated vehicle trajectories (no video or
+model needed) and compares the results against a saved baseline.
+
+Throughput is gated relative to the reference tracker (centroid) timed in
+the same run, so the baseline holds on faster or slower machines.
+
+Usage:
+    python tracker_benchmark.py                   # run and check against baseline
+    python tracker_benchmark.py --save-baseline   # record new baseline numbers
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from tracker import make_tracker
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracker_benchmark_baseline.json')
+
+# Tracker configurations under test: name -> (mode, constructor kwargs)
+TRACKER_CONFIGS = {
+    'centroid': ('centroid', {}),
+    'matrix-greedy': ('matrix', {'association': 'greedy'}),
+    'matrix-hungarian': ('matrix', {'association': 'hungarian'}),
+    'kalman': ('kalman', {'max_age': 5}),
+    'iou': ('iou', {'max_age': 2}),
+}
+
+# Always timed, as the yardstick for the other configurations' throughput
+REFERENCE_TRACKER = 'centroid'
+
+# Traffic patterns: overrides of generate_trajectories() defaults
+SCENARIOS = {
+    'highway': {'vehicles': 20},
+    'dense': {'vehicles': 60},
+    'flicker': {'vehicles': 20, 'miss_rate': 0.2},
+    'occlusion': {'vehicles': 20, 'occlusion_rate': 0.02},
+    'lane_change': {'vehicles': 30, 'lane_change_rate': 0.03},
+}
+
+
+def generate_trajectories(frames=300, vehicles=20, width=1020, height=500, lanes=8,
+                          speed_range=(4, 16), miss_rate=0.02, occlusion_rate=0.0,
+                          occlusion_length=(3, 8), lane_change_rate=0.0, jitter=1.0, seed=0):
+    """Generate detections for synthetic highway traffic.
+
+    The left half of the lanes drives down the frame and the right half up.
+    `vehicles` cars are kept on screen, respawning at the entry edge when one
+    leaves, and cars in a lane queue behind slower ones instead of
+    overtaking through them. Each frame a car is dropped with probability
+    miss_rate, hidden for a few frames with probability occlusion_rate, and
+    starts moving to an adjacent same-direction lane with probability
+    lane_change_rate.
+
+    Returns one list per frame of (ground_truth_id, [x1, y1, x2, y2]) in
+    random order, containing only the cars the detector "saw".
+    """
+    rng = random.Random(seed)
+    lane_width = width / lanes
+    next_gt_id = [0]
+
+    def spawn(anywhere):
+        lane = rng.randrange(lanes)
+        down = lane < lanes // 2
+        w = rng.uniform(0.5, 0.8) * lane_width
+        h = rng.uniform(30, 60)
+        if anywhere:
+            cy = rng.uniform(0, height)
+        else:
+            cy = -h / 2 if down else height + h / 2
+        speed = rng.uniform(*speed_range)
+        car = {
+            'gt_id': next_gt_id[0], 'lane': lane, 'down': down,
+            'cx': (lane + 0.5) * lane_width, 'cy': cy, 'w': w, 'h': h,
+            'vy': speed if down else -speed, 'target_x': None, 'hidden_until': -1,
+        }
+        next_gt_id[0] += 1
+        return car
+
+    cars = [spawn(anywhere=True) for _ in range(vehicles)]
+    detections = []
+
+    for frame_idx in range(frames):
+        for i, car in enumerate(cars):
+            car['cy'] += car['vy']
+            exited = car['cy'] > height + car['h'] if car['down'] else car['cy'] < -car['h']
+            if exited:
+                cars[i] = car = spawn(anywhere=False)
+
+            # Lane crossing: drift toward an adjacent lane of the same direction
+            if car['target_x'] is None and rng.random() < lane_change_rate:
+                half = lanes // 2
+                first, last = (0, half - 1) if car['down'] else (half, lanes - 1)
+                options = [lane for lane in (car['lane'] - 1, car['lane'] + 1) if first <= lane <= last]
+                if options:
+                    car['lane'] = rng.choice(options)
+                    car['target_x'] = (car['lane'] + 0.5) * lane_width
+            if car['target_x'] is not None:
+                step = max(-3.0, min(3.0, car['target_x'] - car['cx']))
+                car['cx'] += step
+                if car['cx'] == car['target_x']:
+                    car['target_x'] = None
+
+        # Cars do not drive through each other: followers queue behind the car ahead
+        by_lane = {}
+        for car in cars:
+            by_lane.setdefault(car['lane'], []).append(car)
+        for lane_cars in by_lane.values():
+            lane_cars.sort(key=lambda c: c['cy'] if c['down'] else -c['cy'], reverse=True)
+            for leader, car in zip(lane_cars, lane_cars[1:]):
+                gap = (leader['h'] + car['h']) / 2 + 10
+                if car['down'] and car['cy'] > leader['cy'] - gap:
+                    car['cy'] = leader['cy'] - gap
+                    car['vy'] = min(car['vy'], leader['vy'])
+                elif not car['down'] and car['cy'] < leader['cy'] + gap:
+                    car['cy'] = leader['cy'] + gap
+                    car['vy'] = max(car['vy'], leader['vy'])
+
+        visible = []
+        for car in cars:
+            if frame_idx >= car['hidden_until'] and rng.random() < occlusion_rate:
+                car['hidden_until'] = frame_idx + rng.randint(*occlusion_length)
+            if frame_idx < car['hidden_until'] or rng.random() < miss_rate:
+                continue
+            if not -car['h'] / 2 < car['cy'] < height + car['h'] / 2:
+                continue
+
+            cx = car['cx'] + rng.gauss(0, jitter)
+            cy = car['cy'] + rng.gauss(0, jitter)
+            box = [int(cx - car['w'] / 2), int(cy - car['h'] / 2),
+                   int(cx + car['w'] / 2), int(cy + car['h'] / 2)]
+            visible.append((car['gt_id'], box))
+
+        rng.shuffle(visible)
+        detections.append(visible)
+
+    return detections
+
+
+def identity_metrics(detections, outputs):
+    """Count identity errors of tracker outputs against ground truth.
+
+    - id_switches: a car's ID changes between two consecutive frames in
+      which it was detected both times
+    - fragmentations: a car's ID changes across a detection gap (it was
+      missed for one or more frames and came back with a different ID)
+    - duplicate_ids: detections that share an ID with another detection
+      in the same frame
+    """
+    last_seen = {}    # gt_id -> (frame_idx, track_id)
+    id_switches = fragmentations = duplicate_ids = 0
+
+    for frame_idx, (frame_dets, frame_out) in enumerate(zip(detections, outputs)):
+        track_ids = [bbox[4] for bbox in frame_out]
+        duplicate_ids += len(track_ids) - len(set(track_ids))
+        for (gt_id, _), track_id in zip(frame_dets, track_ids):
+            if gt_id in last_seen:
+                prev_frame, prev_id = last_seen[gt_id]
+                if prev_id != track_id:
+                    if prev_frame == frame_idx - 1:
+                        id_switches += 1
+                    else:
+                        fragmentations += 1
+            last_seen[gt_id] = (frame_idx, track_id)
+
+    return {'id_switches': id_switches, 'fragmentations': fragmentations, 'duplicate_ids': duplicate_ids}
+
+
+def time_updates(config_name, boxes):
+    """Seconds one fresh tracker of `config_name` spends in update() over `boxes`"""
+    mode, kwargs = TRACKER_CONFIGS[config_name]
+    tracker = make_tracker(mode, **kwargs)
+    elapsed = 0.0
+    for frame_boxes in boxes:
+        start = time.perf_counter()
+        tracker.update(frame_boxes)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def run_tracker(config_name, detections):
+    """Identity metrics and peak memory of one tracker configuration (one traced run)"""
+    mode, kwargs = TRACKER_CONFIGS[config_name]
+    boxes = [[box for _, box in frame_dets] for frame_dets in detections]
+    tracker = make_tracker(mode, **kwargs)
+    tracemalloc.start()
+    outputs = [tracker.update(frame_boxes) for frame_boxes in boxes]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = identity_metrics(detections, outputs)
+    result['peak_memory_kb'] = peak / 1024.0
+    return result
+
+
+def run_benchmark(scenarios, configs, frames, seed, repeats):
+    """Results per scenario and configuration, always including REFERENCE_TRACKER.
+
+    Throughput is the best of `repeats` untraced runs, taken in turns over
+    all configurations so load changes on the machine hit them alike. Each
+    result's relative_throughput is its updates/sec divided by that of the
+    reference tracker on the same scenario.
+    """
+    configs = [REFERENCE_TRACKER] + [name for name in configs if name != REFERENCE_TRACKER]
+    results = {}
+    for scenario in scenarios:
+        detections = generate_trajectories(frames=frames, seed=seed, **SCENARIOS[scenario])
+        boxes = [[box for _, box in frame_dets] for frame_dets in detections]
+        best = {name: float('inf') for name in configs}
+        for _ in range(repeats):
+            for name in configs:
+                best[name] = min(best[name], time_updates(name, boxes))
+
+        results[scenario] = {}
+        for name in configs:
+            result = {'updates_per_sec': len(boxes) / best[name] if best[name] > 0 else 0.0}
+            result.update(run_tracker(name, detections))
+            results[scenario][name] = result
+        reference = results[scenario][REFERENCE_TRACKER]['updates_per_sec']
+        for r in results[scenario].values():
+            r['relative_throughput'] = r['updates_per_sec'] / reference if reference > 0 else 0.0
+    return results
+
+
+def print_results(results):
+    header = (f"{'scenario':<12} {'tracker':<17} {'upd/s':>9} {'rel':>6} {'switch':>7} {'frag':>6} {'dup':>5} "
+              f"{'peak KB':>9}")
+    print(header)
+    print('-' * len(header))
+    for scenario, by_config in results.items():
+        for name, r in by_config.items():
+            print(f"{scenario:<12} {name:<17} {r['updates_per_sec']:>9.0f} {r['relative_throughput']:>6.2f} {r['id_switches']:>7} "
+                  f"{r['fragmentations']:>6} {r['duplicate_ids']:>5} {r['peak_memory_kb']:>9.1f}")
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a list of regressions of results versus the baseline.
+
+    Identity metrics are deterministic for a given seed, so any increase is
+    a regression. Throughput relative to the reference tracker and peak
+    memory may drift by `tolerance`; absolute updates/sec depend on the
+    machine and are not compared.
+    """
+    regressions = []
+    for scenario, by_config in results.items():
+        for name, r in by_config.items():
+            base = baseline.get(scenario, {}).get(name)
+            if base is None:
+                continue
+            label = f"{scenario}/{name}"
+            if 'relative_throughput' in base and r['relative_throughput'] < base['relative_throughput'] * (1 - tolerance):
+                regressions.append(f"{label}: {r['relative_throughput']:.2f}x {REFERENCE_TRACKER} throughput "
+                                   f"vs baseline {base['relative_throughput']:.2f}x")
+            for metric in ('id_switches', 'fragmentations', 'duplicate_ids'):
+                if r[metric] > base[metric]:
+                    regressions.append(f"{label}: {metric} {r[metric]} vs baseline {base[metric]}")
+            if r['peak_memory_kb'] > base['peak_memory_kb'] * (1 + tolerance):
+                regressions.append(f"{label}: peak memory {r['peak_memory_kb']:.1f} KB vs baseline {base['peak_memory_kb']:.1f} KB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tracker modes on synthetic trajectories')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--trackers', nargs='+', default=list(TRACKER_CONFIGS), choices=list(TRACKER_CONFIGS))
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=9, help='timed runs per tracker (best is kept)')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='write results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.35,
+                        help=f'allowed drop of throughput relative to {REFERENCE_TRACKER} / memory growth before failing')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.scenarios, args.trackers, args.frames, args.seed, args.repeats)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'frames': args.frames, 'seed': args.seed, 'results': results}, f, indent=2)
+        print(f"\nBaseline saved: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline first")
+        return 0
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    if baseline.get('frames') != args.frames or baseline.get('seed') != args.seed:
+        print(f"\nBaseline was recorded with frames={baseline.get('frames')} seed={baseline.get('seed')}; not comparing")
+        return 0
+
+    regressions = compare_to_baseline(results, baseline['results'], args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,31 +3,26 @@
 
 # Import required libraries
 import cv2
-import pandas as pd
-from ultralytics import YOLO
+import detectors
+from detection_cache import DetectionCache
 from tracker import*
 from vanet_speed_sharing import VANETSpeedSharing
+import pipeline
 import time
 import math
 import random
 
-# Initialize YOLO model and video
-model = YOLO('yolov8n.pt')
-vi = cv2.VideoCapture('highway_mini.mp4')
+args = pipeline.script_args('Frame-by-frame VANET analysis', history=True)
 
-class_list = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave', 'oven',
-              'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush']
+# Initialize YOLO model
+model = detectors.load_detector(args.backend)  # --backend onnxruntime/opencv runs the exported model on CPU
 
 # Initialize tracker and VANET
-tracker = Tracker()
+tracker = make_tracker(args.tracker)
 vanet = VANETSpeedSharing()
-count = 0
 
-# Speed calculation variables
-down = {}
-up = {}
-counter_down = []
-counter_up = []
+# Speed calculation (simplified for demo: downward traffic only, 100 meters between the lines)
+trap = pipeline.SpeedTrap(red_line_y=198, blue_line_y=268, offset=7, distance=100, directions=('down',), crossing=args.crossing)
 
 # Colors for display
 text_color = (255, 255, 255)  # white
@@ -85,21 +80,32 @@ def draw_detailed_vehicle_info(frame, vehicle_id, x, y, own_speed, shared_speeds
     else:
         cv2.putText(frame, "No communications", (x, y+5), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (128, 128, 128), 1)
 
+def draw_static_overlay(layer):
+    """Reference lines and the analysis panel: drawn once, then pasted by the overlay"""
+    cv2.line(layer, (172, 198), (774, 198), red_color, 3)
+    cv2.putText(layer, ('red line'), (172, 190), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+    
+    cv2.line(layer, (8, 268), (927, 268), blue_color, 3)
+    cv2.putText(layer, ('blue line'), (8, 260), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+    
+    # Larger status box for detailed info
+    cv2.rectangle(layer, (10, 400), (400, 490), (0, 0, 0), -1)  # Black background
+    cv2.rectangle(layer, (10, 400), (400, 490), text_color, 2)   # White border
+    
+    cv2.putText(layer, "DETAILED VANET ANALYSIS", (20, 420), cv2.FONT_HERSHEY_SIMPLEX, 0.5, orange_color, 2)
+
+overlay = pipeline.Overlay(draw_static_overlay)
+
 def draw_detailed_vanet_status(frame, vanet_system, current_frame, total_frames):
-    """Draw detailed VANET analysis status"""
+    """Draw detailed VANET analysis status (the panel itself is in the overlay)"""
     total_vehicles = len(vanet_system.vehicles)
     communication_pairs = len(vanet_system.get_communication_pairs())
     recent_messages = vanet_system.get_recent_messages(2)
     
-    # Larger status box for detailed info
-    cv2.rectangle(frame, (10, 400), (400, 490), (0, 0, 0), -1)  # Black background
-    cv2.rectangle(frame, (10, 400), (400, 490), text_color, 2)   # White border
-    
-    cv2.putText(frame, "DETAILED VANET ANALYSIS", (20, 420), cv2.FONT_HERSHEY_SIMPLEX, 0.5, orange_color, 2)
-    cv2.putText(frame, f"Frame: {current_frame}/{total_frames} - MANUAL MODE", (20, 440), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Active Vehicles: {total_vehicles}", (20, 455), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Communication Links: {communication_pairs}", (20, 470), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Recent Messages: {len(recent_messages)}", (20, 485), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
+    overlay.text(frame, 'frame', f"Frame: {current_frame}/{total_frames} - MANUAL MODE", (20, 440), 0.4, text_color)
+    overlay.text(frame, 'vehicles', f"Active Vehicles: {total_vehicles}", (20, 455), 0.4, text_color)
+    overlay.text(frame, 'links', f"Communication Links: {communication_pairs}", (20, 470), 0.4, text_color)
+    overlay.text(frame, 'messages', f"Recent Messages: {len(recent_messages)}", (20, 485), 0.4, text_color)
 
 def print_communication_log(vanet_system, frame_number):
     """Print detailed communication log to console"""
@@ -114,6 +120,7 @@ print("="*50)
 print("This mode provides detailed frame-by-frame VANET analysis")
 print("\nControls:")
 print("  SPACEBAR - Next frame (MANUAL MODE ONLY)")
+print("  'a' / 'd' - Step back / forward through recent frames (no re-detection)")
 print("  ESC - Exit")
 print("\nFeatures:")
 print("✓ Detailed vehicle communication info boxes")
@@ -125,119 +132,119 @@ print("="*50)
 print("Press SPACEBAR to advance frame-by-frame...")
 print()
 
-current_frame = 0
-total_frames = int(vi.get(cv2.CAP_PROP_FRAME_COUNT))
+def on_end():
+    print("End of video. Press any key to exit...")
+    cv2.waitKey(0)
+    return False
 
-while True:
-    ret, frame = vi.read()
-    if not ret:
-        print("End of video. Press any key to exit...")
-        cv2.waitKey(0)
-        break
-        
-    count += 1
-    current_frame = int(vi.get(cv2.CAP_PROP_POS_FRAMES))
-    frame = cv2.resize(frame, (1020, 500))
-
-    # YOLO detection
-    results = model.predict(frame)
-    a = results[0].boxes.data
-    a = a.detach().cpu().numpy()
-    px = pd.DataFrame(a).astype("float")
-    
-    detected_cars = []
-
-    # Extract car detections
-    for index, row in px.iterrows():
-        x1 = int(row[0])
-        y1 = int(row[1])
-        x2 = int(row[2])
-        y2 = int(row[3])
-        d = int(row[5])
-        c = class_list[d]
-        if 'car' in c:
-            detected_cars.append([x1, y1, x2, y2])
-
-    # Update tracker
-    bbox_id = tracker.update(detected_cars)
+source = pipeline.VideoSource(args.video, on_end=None if args.headless else on_end)
+total_frames = source.total_frames
+
+def update_vanet(packet):
+    """Feed tracked vehicles into the VANET simulation and log the messages"""
+    measured = {event['id']: event['speed'] for event in packet['events']}
     vehicle_speeds = {}
-    
-    for bbox in bbox_id:
-        x3, y3, x4, y4, vehicle_id = bbox
+    shared = {}
+
+    for x3, y3, x4, y4, vehicle_id in packet['tracks']:
         cx = int((x3 + x4) / 2)
         cy = int((y3 + y4) / 2)
-        red_line_y = 198
-        blue_line_y = 268
-        offset = 7
-        
-        current_speed = 0
-
-        # Speed calculation (simplified for demo)
-        if red_line_y < (cy + offset) and red_line_y > (cy - offset):
-            down[vehicle_id] = time.time()
-        if vehicle_id in down:
-            if blue_line_y < (cy + offset) and blue_line_y > (cy - offset):
-                elapsed_time = time.time() - down[vehicle_id]
-                if counter_down.count(vehicle_id) == 0:
-                    counter_down.append(vehicle_id)
-                    distance = 100
-                    a_speed_ms = distance / elapsed_time
-                    current_speed = a_speed_ms * 3.6
-                    vehicle_speeds[vehicle_id] = current_speed
 
         # For demo purposes, assign realistic speeds
-        if vehicle_id not in vehicle_speeds:
+        if vehicle_id in measured:
+            current_speed = measured[vehicle_id]
+        else:
             current_speed = random.uniform(45, 75)  # km/h
-            vehicle_speeds[vehicle_id] = current_speed
+        vehicle_speeds[vehicle_id] = current_speed
 
         # Update VANET with vehicle position and speed
         vanet.add_or_update_vehicle(vehicle_id, cx, cy, current_speed)
 
-        # Draw enhanced vehicle visualization
-        cv2.rectangle(frame, (x3, y3), (x4, y4), green_color, 2)
-        cv2.circle(frame, (cx, cy), 6, red_color, -1)
-        
-        # Get and display detailed communication info
+        # Get detailed communication info
         if vehicle_id in vanet.vehicles:
-            vehicle_node = vanet.vehicles[vehicle_id]
-            shared_speeds = vehicle_node.get_nearby_speeds()
-            draw_detailed_vehicle_info(frame, vehicle_id, x3, y3, current_speed, shared_speeds)
+            shared[vehicle_id] = dict(vanet.vehicles[vehicle_id].get_nearby_speeds())
 
     # Simulate VANET communication
     messages_sent = vanet.simulate_communication()
     
     # Print communication log for this frame
     if messages_sent > 0:
-        print_communication_log(vanet, current_frame)
-    
+        print_communication_log(vanet, packet['position'])
+
+    packet['vehicle_speeds'] = vehicle_speeds
+    packet['shared_speeds'] = shared
+
+def draw(packet):
+    frame = packet['frame']
+    current_frame = packet['position']
+
+    for x3, y3, x4, y4, vehicle_id in packet['tracks']:
+        cx = int((x3 + x4) / 2)
+        cy = int((y3 + y4) / 2)
+
+        # Draw enhanced vehicle visualization
+        cv2.rectangle(frame, (x3, y3), (x4, y4), green_color, 2)
+        cv2.circle(frame, (cx, cy), 6, red_color, -1)
+        
+        # Display detailed communication info
+        if vehicle_id in packet['shared_speeds']:
+            draw_detailed_vehicle_info(frame, vehicle_id, x3, y3, packet['vehicle_speeds'][vehicle_id],
+                                       packet['shared_speeds'][vehicle_id])
+
     # Draw detailed communication analysis
     draw_communication_analysis(frame, vanet)
     
-    # Draw reference lines
-    cv2.line(frame, (172, 198), (774, 198), red_color, 3)
-    cv2.putText(frame, ('red line'), (172, 190), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    
-    cv2.line(frame, (8, 268), (927, 268), blue_color, 3)
-    cv2.putText(frame, ('blue line'), (8, 260), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+    # Reference lines and the analysis panel come from the cached overlay
+    overlay.apply(frame)
     
     # Draw traffic counters
-    cv2.putText(frame, ('Going Down - ' + str(len(counter_down))), (10, 130), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
-    cv2.putText(frame, ('Going Up - ' + str(len(counter_up))), (10, 150), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1, cv2.LINE_AA)
+    overlay.text(frame, 'down', 'Going Down - ' + str(trap.count_down), (10, 130), 0.5, text_color, line_type=cv2.LINE_AA)
+    overlay.text(frame, 'up', 'Going Up - ' + str(trap.count_up), (10, 150), 0.5, text_color, line_type=cv2.LINE_AA)
     
     # Draw detailed VANET status
     draw_detailed_vanet_status(frame, vanet, current_frame, total_frames)
 
-    cv2.imshow('VANET Ultra-Slow Analysis', frame)
-    
     # Wait for SPACEBAR to continue (frame-by-frame only)
     print(f"Frame {current_frame}: Press SPACEBAR for next frame, ESC to exit...")
-    key = cv2.waitKey(0) & 0xFF
-    
-    if key == 27:  # ESC to exit
-        break
-    elif key == ord(' '):  # SPACEBAR to continue
-        continue
 
-vi.release()
-cv2.destroyAllWindows()
+# Recent frames with their detections and tracker/VANET state, for stepping back
+history = pipeline.FrameHistory(args.history_mb, snapshot=lambda: {
+    'tracker': tracker,
+    'going_down': trap.count_down,
+    'vehicles': {vid: (v.x, v.y, v.speed, dict(v.shared_speeds)) for vid, v in vanet.vehicles.items()},
+})
+
+def on_review(entry):
+    state = history.state(entry)
+    print(f"\n--- Reviewing frame {entry['position']}/{total_frames} (vehicles going down: {state['going_down']}) ---")
+    for vid, (x, y, speed, received) in state['vehicles'].items():
+        print(f"Vehicle {vid} at ({x:.0f}, {y:.0f}): {speed:.1f} km/h, hears {len(received)} neighbours")
+
+# With --headless frames run as fast as possible and crossings go to --output
+# --record also encodes the annotated frames, on a background thread
+recorder = pipeline.recording(args, source.fps)
+if args.headless:
+    output = pipeline.batch_sink(args.output)
+    if recorder is not None:
+        output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder, output)
+else:
+    output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder,
+                            pipeline.display('VANET Ultra-Slow Analysis', wait=0,
+                                             history=history, on_review=on_review))
+
+pipeline.run(source,
+             pipeline.preprocess((1020, 500), model_size=640,
+                                 rect=args.backend in detectors.RECT_BACKENDS, buffers=args.batch_size + 8,
+                                 display=not args.headless or recorder is not None),
+             pipeline.skipping(args, tracker, trap),
+             pipeline.detect(model, batch_size=args.batch_size, max_latency=args.max_latency,
+                             cache=DetectionCache.for_args(args)),
+             pipeline.track(tracker),
+             pipeline.speed(trap, clock=args.clock),
+             pipeline.vanet(update_vanet),
+             output)
+
+source.release()
+if not args.headless:
+    cv2.destroyAllWindows()
 print("Analysis complete!")
@@ -5,10 +5,11 @@ Real-time analytics and performance metrics for project presentations
 """
 
 import cv2
-import pandas as pd
-from ultralytics import YOLO
+import detectors
+from detection_cache import DetectionCache
 from tracker import*
 from vanet_speed_sharing import VANETSpeedSharing
+import pipeline
 import time
 import math
 import numpy as np
@@ -69,7 +70,7 @@ class VANETAnalytics:
         
         # Network density calculation
         if len(vehicles_data) > 1:
-            positions = [(v['x'], v['y']) for v in vehicles_data.values()]
+            positions = [(v.x, v.y) for v in vehicles_data.values()]
             distances = []
             for i, pos1 in enumerate(positions):
                 for pos2 in positions[i+1:]:
@@ -155,32 +156,54 @@ class EnhancedVANET(VANETSpeedSharing):
         
         return messages_sent
 
-def draw_professional_dashboard(frame, vanet_system, frame_count, processing_time):
-    """Draw comprehensive analytics dashboard"""
-    height, width = frame.shape[:2]
-    
-    # Update analytics
-    detections = len(vanet_system.vehicles)
-    communications = len(vanet_system.get_recent_broadcasts())
-    speeds = {vid: v.speed for vid, v in vanet_system.vehicles.items() if v.speed}
-    
-    vanet_system.analytics.update_performance(processing_time, detections, communications)
-    vanet_system.analytics.update_traffic_metrics(vanet_system.vehicles, speeds)
-    
-    # Main Dashboard Panel
-    panel_width = 350
-    panel_height = 200
-    panel_x = width - panel_width - 10
+# Dashboard layout, relative to the top-right corner of the frame
+PANEL_WIDTH = 350
+PANEL_HEIGHT = 200
+NETWORK_PANEL_HEIGHT = 120
+
+def draw_dashboard_panels(layer):
+    """Static dashboard parts: reference lines, panel backgrounds, borders and titles.
+
+    Drawn once per frame size into a pipeline.Overlay layer.
+    """
+    height, width = layer.shape[:2]
+    panel_x = width - PANEL_WIDTH - 10
     panel_y = 10
     
+    # Reference lines
+    cv2.line(layer, (0, 280), (1400, 280), (0, 0, 255), 3)
+    cv2.line(layer, (0, 420), (1400, 420), (255, 0, 0), 3)
+    
     # Dashboard background
-    cv2.rectangle(frame, (panel_x, panel_y), (width-10, panel_y + panel_height), (20, 20, 20), -1)
-    cv2.rectangle(frame, (panel_x, panel_y), (width-10, panel_y + panel_height), (0, 255, 255), 2)
+    cv2.rectangle(layer, (panel_x, panel_y), (width-10, panel_y + PANEL_HEIGHT), (20, 20, 20), -1)
+    cv2.rectangle(layer, (panel_x, panel_y), (width-10, panel_y + PANEL_HEIGHT), (0, 255, 255), 2)
     
     # Title
-    cv2.putText(frame, "VANET ANALYTICS DASHBOARD", (panel_x + 10, panel_y + 25), 
+    cv2.putText(layer, "VANET ANALYTICS DASHBOARD", (panel_x + 10, panel_y + 25), 
                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
     
+    # Performance graph background
+    graph_x, graph_y, graph_w, graph_h = panel_x + 180, panel_y + 60, 150, 60
+    cv2.rectangle(layer, (graph_x, graph_y), (graph_x + graph_w, graph_y + graph_h), (40, 40, 40), -1)
+    cv2.rectangle(layer, (graph_x, graph_y), (graph_x + graph_w, graph_y + graph_h), (100, 100, 100), 1)
+    
+    # Communication network panel
+    network_panel_y = panel_y + PANEL_HEIGHT + 20
+    cv2.rectangle(layer, (panel_x, network_panel_y), (width-10, network_panel_y + NETWORK_PANEL_HEIGHT), (20, 20, 20), -1)
+    cv2.rectangle(layer, (panel_x, network_panel_y), (width-10, network_panel_y + NETWORK_PANEL_HEIGHT), (255, 165, 0), 2)
+    
+    cv2.putText(layer, "NETWORK TOPOLOGY", (panel_x + 10, network_panel_y + 25), 
+               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 165, 0), 2)
+
+def draw_professional_dashboard(frame, overlay, vanet_system, frame_count):
+    """Draw comprehensive analytics dashboard over the static panels of `overlay`"""
+    height, width = frame.shape[:2]
+    
+    # Main Dashboard Panel
+    panel_x = width - PANEL_WIDTH - 10
+    panel_y = 10
+    overlay.apply(frame)
+    
     # Current Statistics
     stats = vanet_system.analytics.current_stats
     y_offset = 50
@@ -196,9 +219,9 @@ def draw_professional_dashboard(frame, vanet_system, frame_count, processing_tim
         f"Runtime: {time.time() - vanet_system.analytics.start_time:.0f}s"
     ]
     
+    # Each line is rendered again only when its text changes
     for i, metric in enumerate(metrics):
-        cv2.putText(frame, metric, (panel_x + 15, panel_y + y_offset + i * line_height), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        overlay.text(frame, i, metric, (panel_x + 15, panel_y + y_offset + i * line_height), 0.4, (255, 255, 255))
     
     # Performance Graph (Mini)
     if len(vanet_system.analytics.processing_times) > 1:
@@ -207,10 +230,6 @@ def draw_professional_dashboard(frame, vanet_system, frame_count, processing_tim
         graph_w = 150
         graph_h = 60
         
-        # Graph background
-        cv2.rectangle(frame, (graph_x, graph_y), (graph_x + graph_w, graph_y + graph_h), (40, 40, 40), -1)
-        cv2.rectangle(frame, (graph_x, graph_y), (graph_x + graph_w, graph_y + graph_h), (100, 100, 100), 1)
-        
         # Plot FPS over time
         fps_data = [1.0/t if t > 0 else 0 for t in list(vanet_system.analytics.processing_times)[-50:]]
         if fps_data:
@@ -224,22 +243,12 @@ def draw_professional_dashboard(frame, vanet_system, frame_count, processing_tim
                 y2 = graph_y + graph_h - normalized[i+1]
                 cv2.line(frame, (x1, y1), (x2, y2), (0, 255, 0), 1)
         
-        cv2.putText(frame, "FPS Graph", (graph_x + 5, graph_y + 15), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
-    
-    # Communication Network Visualization
-    network_panel_y = panel_y + panel_height + 20
-    network_panel_h = 120
-    
-    cv2.rectangle(frame, (panel_x, network_panel_y), (width-10, network_panel_y + network_panel_h), (20, 20, 20), -1)
-    cv2.rectangle(frame, (panel_x, network_panel_y), (width-10, network_panel_y + network_panel_h), (255, 165, 0), 2)
-    
-    cv2.putText(frame, "NETWORK TOPOLOGY", (panel_x + 10, network_panel_y + 25), 
-               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 165, 0), 2)
+        overlay.text(frame, 'graph', "FPS Graph", (graph_x + 5, graph_y + 15), 0.3, (255, 255, 255))
     
     # Mini network graph
+    network_panel_y = panel_y + PANEL_HEIGHT + 20
     if len(vanet_system.vehicles) > 1:
-        mini_graph_area = (panel_x + 20, network_panel_y + 35, panel_width - 40, network_panel_h - 50)
+        mini_graph_area = (panel_x + 20, network_panel_y + 35, PANEL_WIDTH - 40, NETWORK_PANEL_HEIGHT - 50)
         draw_mini_network_topology(frame, vanet_system, mini_graph_area)
 
 def draw_mini_network_topology(frame, vanet_system, area):
@@ -271,6 +280,7 @@ def draw_mini_network_topology(frame, vanet_system, area):
                     cv2.line(frame, pos1, pos2, (0, 255, 255), 1)
 
 def main():
+    args = pipeline.script_args('VANET professional analytics dashboard')
     print("🚀 VANET Professional Analytics Dashboard")
     print("=" * 50)
     print("Features:")
@@ -282,110 +292,97 @@ def main():
     print("=" * 50)
     
     # Initialize components
-    model = YOLO('yolov8n.pt')
-    tracker = Tracker()
+    model = detectors.load_detector(args.backend)  # --backend onnxruntime/opencv runs the exported model on CPU
+    tracker = make_tracker(args.tracker)
     vanet = EnhancedVANET()
     
-    vi = cv2.VideoCapture('highway_mini.mp4')
+    source = pipeline.VideoSource(args.video)
     
-    class_list = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck']
-    
-    # Analytics variables
-    down = {}
-    up = {}
-    counter_down = []
-    counter_up = []
-    frame_count = 0
-    
-    print("📊 Starting professional analysis...")
+    # Speed calculations (downward traffic, 100 meters between the lines)
+    trap = pipeline.SpeedTrap(red_line_y=280, blue_line_y=420, offset=7, distance=100, directions=('down',), crossing=args.crossing)
     
-    while True:
-        frame_start_time = time.time()
-        
-        ret, frame = vi.read()
-        if not ret:
-            break
-            
-        frame_count += 1
-        frame = cv2.resize(frame, (1400, 700))  # Larger for dashboard
-        
-        # YOLO detection
-        results = model.predict(frame, verbose=False)
-        a = results[0].boxes.data
-        a = a.detach().cpu().numpy()
-        px = pd.DataFrame(a).astype("float")
-        
-        detected_cars = []
-        for index, row in px.iterrows():
-            x1, y1, x2, y2 = int(row[0]), int(row[1]), int(row[2]), int(row[3])
-            d = int(row[5])
-            c = class_list[min(d, len(class_list)-1)]
-            if 'car' in c.lower():
-                detected_cars.append([x1, y1, x2, y2])
-        
-        # Update tracker and VANET
-        bbox_id = tracker.update(detected_cars)
-        vehicle_speeds = {}
-        
-        for bbox in bbox_id:
-            x3, y3, x4, y4, vehicle_id = bbox
+    def update_vanet(packet):
+        measured = {event['id']: event['speed'] for event in packet['events']}
+        for x3, y3, x4, y4, vehicle_id in packet['tracks']:
             cx = int((x3 + x4) / 2)
             cy = int((y3 + y4) / 2)
             
             # Add to VANET
             vanet.add_or_update_vehicle(vehicle_id, cx, cy, 0)
             
-            # Speed calculations
-            red_line_y = 280
-            blue_line_y = 420
-            offset = 7
-            
-            if red_line_y < (cy + offset) and red_line_y > (cy - offset):
-                down[vehicle_id] = time.time()
-                
-            if vehicle_id in down:
-                if blue_line_y < (cy + offset) and blue_line_y > (cy - offset):
-                    elapsed_time = time.time() - down[vehicle_id]
-                    if counter_down.count(vehicle_id) == 0:
-                        counter_down.append(vehicle_id)
-                        distance = 100
-                        calculated_speed = (distance / elapsed_time) * 3.6
-                        vehicle_speeds[vehicle_id] = calculated_speed
-                        
-                        # Update VANET with calculated speed
-                        vanet.add_or_update_vehicle(vehicle_id, cx, cy, calculated_speed)
-            
-            # Draw vehicle
-            cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)
-            cv2.circle(frame, (cx, cy), 4, (0, 0, 255), -1)
-            cv2.putText(frame, f"ID:{vehicle_id}", (x3, y3-5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+            # Update VANET with calculated speed
+            if vehicle_id in measured:
+                vanet.add_or_update_vehicle(vehicle_id, cx, cy, measured[vehicle_id])
         
         # VANET communication
         vanet.simulate_communication()
         
-        # Draw reference lines
-        cv2.line(frame, (0, 280), (1400, 280), (0, 0, 255), 3)
-        cv2.line(frame, (0, 420), (1400, 420), (255, 0, 0), 3)
-        
-        # Calculate processing time
-        processing_time = time.time() - frame_start_time
+        # Calculate processing time as the interval between processed frames;
+        # with threaded stages a frame's own latency includes queue time
+        now = time.time()
+        processing_time = now - (last_frame[0] or packet['start_time'])
+        last_frame[0] = now
         
-        # Draw professional dashboard
-        draw_professional_dashboard(frame, vanet, frame_count, processing_time)
+        # Update analytics on every frame, also those that are not rendered
+        detections = len(vanet.vehicles)
+        communications = len(vanet.get_recent_messages(1))
+        speeds = {vid: v.speed for vid, v in vanet.vehicles.items() if v.speed}
+        vanet.analytics.update_performance(processing_time, detections, communications)
+        vanet.analytics.update_traffic_metrics(vanet.vehicles, speeds)
+    
+    last_frame = [None]
+    overlay = pipeline.Overlay(draw_dashboard_panels)
+
+    def draw(packet):
+        frame = packet['frame']
         
-        cv2.imshow('VANET Professional Analytics Dashboard', frame)
+        # Draw vehicles
+        for x3, y3, x4, y4, vehicle_id in packet['tracks']:
+            cx = int((x3 + x4) / 2)
+            cy = int((y3 + y4) / 2)
+            cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 255, 0), 2)
+            cv2.circle(frame, (cx, cy), 4, (0, 0, 255), -1)
+            cv2.putText(frame, f"ID:{vehicle_id}", (x3, y3-5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
         
-        # Controls
-        key = cv2.waitKey(30) & 0xFF
-        if key == 27:  # ESC
-            break
-        elif key == ord('s'):  # Save analytics report
+        # Draw professional dashboard (reference lines are part of its overlay)
+        draw_professional_dashboard(frame, overlay, vanet, packet['index'])
+    
+    def on_key(key):
+        if key == ord('s'):  # Save analytics report
             report = vanet.analytics.export_analytics(f"vanet_report_{int(time.time())}.json")
             print(f"📊 Analytics report saved!")
             print(f"   Average FPS: {report['current_snapshot']['processing_fps']:.1f}")
             print(f"   Total Vehicles: {report['traffic_metrics']['peak_vehicle_count']}")
             print(f"   Network Efficiency: {report['communication_metrics']['average_success_rate']:.2%}")
     
+    print("📊 Starting professional analysis...")
+    
+    # With --headless frames run as fast as possible and crossings go to --output
+    # --record also encodes the annotated frames, on a background thread
+    recorder = pipeline.recording(args, source.fps)
+    if args.headless:
+        output = pipeline.batch_sink(args.output)
+        if recorder is not None:
+            output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder, output)
+    else:
+        output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder,
+                                pipeline.display('VANET Professional Analytics Dashboard', wait=30, on_key=on_key))
+    
+    # Decode, inference and dashboard rendering overlap on three threads
+    pipeline.run(source,
+                 pipeline.preprocess((1400, 700), model_size=640,  # Larger for dashboard; the model sees the original frame
+                                     rect=args.backend in detectors.RECT_BACKENDS, buffers=args.batch_size + 8,
+                                     display=not args.headless or recorder is not None),
+                 pipeline.threaded(maxsize=4, name='decode'),
+                 pipeline.skipping(args, tracker, trap, size=(1400, 700)),  # same thread as track(), whose tracker stride() reads
+                 pipeline.detect(model, batch_size=args.batch_size, max_latency=args.max_latency,
+                                 cache=DetectionCache.for_args(args), verbose=False),
+                 pipeline.track(tracker),
+                 pipeline.threaded(maxsize=4, name='inference'),
+                 pipeline.speed(trap, clock=args.clock),
+                 pipeline.vanet(update_vanet),
+                 output)
+    
     # Final report
     final_report = vanet.analytics.export_analytics("final_analytics_report.json")
     print("\n🎯 FINAL ANALYTICS REPORT")
@@ -396,8 +393,9 @@ def main():
     print(f"📡 Network Efficiency: {final_report['communication_metrics']['average_success_rate']:.2%}")
     print(f"💾 Report saved: final_analytics_report.json")
     
-    vi.release()
-    cv2.destroyAllWindows()
+    source.release()
+    if not args.headless:
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     main()
@@ -2,17 +2,17 @@
 """VANET Car Speed Estimator - Range-Based Communication"""
 
 import cv2
-import pandas as pd
-from ultralytics import YOLO
+import detectors
+from detection_cache import DetectionCache
 from tracker import*
+import pipeline
 import time
 import math
 
-model = YOLO('yolov8n.pt')
-vi = cv2.VideoCapture('highway_mini.mp4')
+args = pipeline.script_args('Range-based VANET speed sharing')
 
-class_list = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave', 'oven',
-              'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush']
+model = detectors.load_detector(args.backend)  # --backend onnxruntime/opencv runs the exported model on CPU
+source = pipeline.VideoSource(args.video)
 
 class RangeBasedVANET:
     def __init__(self, communication_range=200):
@@ -116,15 +116,11 @@ class RangeBasedVANET:
         ]
 
 # Initialize
-tracker = Tracker()
+tracker = make_tracker(args.tracker)
 vanet = RangeBasedVANET(communication_range=180)  # 180 pixel communication range
-count = 0
 
-# Speed calculation variables
-down = {}
-up = {}
-counter_down = []
-counter_up = []
+# Speed calculation (100 meters between the lines)
+trap = pipeline.SpeedTrap(red_line_y=198, blue_line_y=268, offset=7, distance=100, crossing=args.crossing)
 
 # Colors
 text_color = (255, 255, 255)  # white
@@ -211,8 +207,24 @@ def draw_communication_lines(frame, vanet_system):
                 mid_y = int((sender_pos[1] + recipient_pos[1]) / 2)
                 cv2.circle(frame, (mid_x, mid_y), 2, yellow_color, -1)
 
+def draw_static_overlay(layer):
+    """Reference lines and the status panel: drawn once, then pasted by the overlay"""
+    cv2.line(layer, (172, 198), (774, 198), red_color, 3)
+    cv2.putText(layer, ('red line'), (172, 190), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1)
+    
+    cv2.line(layer, (8, 268), (927, 268), blue_color, 3)
+    cv2.putText(layer, ('blue line'), (8, 260), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1)
+    
+    # Status panel
+    cv2.rectangle(layer, (750, 10), (1010, 120), (0, 0, 0), -1)
+    cv2.rectangle(layer, (750, 10), (1010, 120), text_color, 2)
+    
+    cv2.putText(layer, "RANGE-BASED VANET", (760, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, yellow_color, 2)
+
+overlay = pipeline.Overlay(draw_static_overlay)
+
 def draw_vanet_status(frame, vanet_system):
-    """Draw VANET status panel"""
+    """Draw VANET status panel values (the panel itself is in the overlay)"""
     total_vehicles = len(vanet_system.vehicles)
     recent_broadcasts = len(vanet_system.recent_broadcasts)
     
@@ -220,15 +232,10 @@ def draw_vanet_status(frame, vanet_system):
     vehicles_with_data = sum(1 for v in vanet_system.vehicles.values() 
                             if len(v['received_speeds']) > 0)
     
-    # Status panel
-    cv2.rectangle(frame, (750, 10), (1010, 120), (0, 0, 0), -1)
-    cv2.rectangle(frame, (750, 10), (1010, 120), text_color, 2)
-    
-    cv2.putText(frame, "RANGE-BASED VANET", (760, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, yellow_color, 2)
-    cv2.putText(frame, f"Total Vehicles: {total_vehicles}", (760, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Receiving Data: {vehicles_with_data}", (760, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Recent Broadcasts: {recent_broadcasts}", (760, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
-    cv2.putText(frame, f"Range: {vanet_system.communication_range}px", (760, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.4, text_color, 1)
+    overlay.text(frame, 'vehicles', f"Total Vehicles: {total_vehicles}", (760, 50), 0.4, text_color)
+    overlay.text(frame, 'receiving', f"Receiving Data: {vehicles_with_data}", (760, 70), 0.4, text_color)
+    overlay.text(frame, 'broadcasts', f"Recent Broadcasts: {recent_broadcasts}", (760, 90), 0.4, text_color)
+    overlay.text(frame, 'range', f"Range: {vanet_system.communication_range}px", (760, 110), 0.4, text_color)
 
 print("🚗📡 RANGE-BASED VANET SPEED SHARING 📡🚗")
 print("="*55)
@@ -247,82 +254,31 @@ print("="*55)
 
 auto_play = False
 
-while True:
-    ret, frame = vi.read()
-    if not ret:
-        break
-        
-    count += 1
-    frame = cv2.resize(frame, (1020, 500))
-
-    # YOLO detection
-    results = model.predict(frame)
-    a = results[0].boxes.data
-    a = a.detach().cpu().numpy()
-    px = pd.DataFrame(a).astype("float")
-    
-    detected_cars = []
-    for index, row in px.iterrows():
-        x1, y1, x2, y2 = int(row[0]), int(row[1]), int(row[2]), int(row[3])
-        d = int(row[5])
-        c = class_list[d]
-        if 'car' in c:
-            detected_cars.append([x1, y1, x2, y2])
+def update_vanet(packet):
+    """Register vehicles and broadcast each measured speed to ALL vehicles within range"""
+    # Cleanup old data from the previous frame
+    vanet.cleanup_old_speeds()
 
-    # Update tracker
-    bbox_id = tracker.update(detected_cars)
-    
-    # Add all detected vehicles to VANET
-    for bbox in bbox_id:
-        x3, y3, x4, y4, vehicle_id = bbox
+    measured = {event['id']: event for event in packet['events']}
+    for x3, y3, x4, y4, vehicle_id in packet['tracks']:
         cx = int((x3 + x4) / 2)
         cy = int((y3 + y4) / 2)
-        
+
         # Add vehicle to VANET system
         vanet.add_vehicle(vehicle_id, cx, cy)
-        
-        red_line_y = 198
-        blue_line_y = 268
-        offset = 7
-        
-        # Speed calculation for DOWNWARD traffic
-        if red_line_y < (cy + offset) and red_line_y > (cy - offset):
-            down[vehicle_id] = time.time()
-            
-        if vehicle_id in down:
-            if blue_line_y < (cy + offset) and blue_line_y > (cy - offset):
-                elapsed_time = time.time() - down[vehicle_id]
-                if counter_down.count(vehicle_id) == 0:
-                    counter_down.append(vehicle_id)
-                    distance = 100  # meters
-                    a_speed_ms = distance / elapsed_time
-                    calculated_speed = a_speed_ms * 3.6  # km/h
-                    
-                    # VANET: Broadcast speed to ALL vehicles within range
-                    recipients = vanet.broadcast_speed_to_range(vehicle_id, calculated_speed, "DOWN")
-                    if recipients:
-                        print(f"🚗 Vehicle {vehicle_id} broadcasts {int(calculated_speed)}km/h to {len(recipients)} cars: {recipients}")
 
-        # Speed calculation for UPWARD traffic
-        if blue_line_y < (cy + offset) and blue_line_y > (cy - offset):
-            up[vehicle_id] = time.time()
-            
-        if vehicle_id in up:
-            if red_line_y < (cy + offset) and red_line_y > (cy - offset):
-                elapsed1_time = time.time() - up[vehicle_id]
-                if counter_up.count(vehicle_id) == 0:
-                    counter_up.append(vehicle_id)
-                    distance1 = 100  # meters
-                    a_speed_ms1 = distance1 / elapsed1_time
-                    calculated_speed = a_speed_ms1 * 3.6  # km/h
-                    
-                    # VANET: Broadcast speed to ALL vehicles within range
-                    recipients = vanet.broadcast_speed_to_range(vehicle_id, calculated_speed, "UP")
-                    if recipients:
-                        print(f"🚗 Vehicle {vehicle_id} broadcasts {int(calculated_speed)}km/h to {len(recipients)} cars: {recipients}")
+        if vehicle_id in measured:
+            event = measured[vehicle_id]
+            calculated_speed = event['speed']
+            recipients = vanet.broadcast_speed_to_range(vehicle_id, calculated_speed, event['direction'].upper())
+            if recipients:
+                print(f"🚗 Vehicle {vehicle_id} broadcasts {int(calculated_speed)}km/h to {len(recipients)} cars: {recipients}")
+
+def draw(packet):
+    frame = packet['frame']
 
     # Draw all vehicles (green squares with red dots)
-    draw_all_vehicles(frame, bbox_id, vanet)
+    draw_all_vehicles(frame, packet['tracks'], vanet)
     
     # Draw communication range circles
     draw_communication_range_circles(frame, vanet)
@@ -330,36 +286,47 @@ while True:
     # Draw communication lines
     draw_communication_lines(frame, vanet)
     
-    # Draw reference lines
-    cv2.line(frame, (172, 198), (774, 198), red_color, 3)
-    cv2.putText(frame, ('red line'), (172, 190), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1)
-    
-    cv2.line(frame, (8, 268), (927, 268), blue_color, 3)
-    cv2.putText(frame, ('blue line'), (8, 260), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1)
+    # Reference lines and the status panel come from the cached overlay
+    overlay.apply(frame)
     
     # Draw counters
-    cv2.putText(frame, f'Going Down - {len(counter_down)}', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1)
-    cv2.putText(frame, f'Going Up - {len(counter_up)}', (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1)
+    overlay.text(frame, 'down', f'Going Down - {trap.count_down}', (10, 30), 0.5, text_color)
+    overlay.text(frame, 'up', f'Going Up - {trap.count_up}', (10, 60), 0.5, text_color)
     
     # Draw VANET status
     draw_vanet_status(frame, vanet)
-    
-    # Cleanup old data
-    vanet.cleanup_old_speeds()
 
-    cv2.imshow('Range-Based VANET Speed Sharing', frame)
-    
-    # Frame control
-    wait_time = 100 if auto_play else 0
-    key = cv2.waitKey(wait_time) & 0xFF
-    
-    if key == 27:  # ESC
-        break
-    elif key == ord(' '):  # SPACEBAR
-        continue
-    elif key == ord('p'):  # Toggle mode
+def on_key(key):
+    global auto_play
+    if key == ord('p'):  # Toggle mode
         auto_play = not auto_play
         print(f"Mode: {'AUTO' if auto_play else 'MANUAL'}")
 
-vi.release()
-cv2.destroyAllWindows()
+# Frame control
+# With --headless frames run as fast as possible and crossings go to --output
+# --record also encodes the annotated frames, on a background thread
+recorder = pipeline.recording(args, source.fps)
+if args.headless:
+    output = pipeline.batch_sink(args.output)
+    if recorder is not None:
+        output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder, output)
+else:
+    output = pipeline.chain(pipeline.render(draw, every=args.render_every), recorder,
+                            pipeline.display('Range-Based VANET Speed Sharing',
+                                             wait=lambda: 100 if auto_play else 0, on_key=on_key))
+
+pipeline.run(source,
+             pipeline.preprocess((1020, 500), model_size=640,
+                                 rect=args.backend in detectors.RECT_BACKENDS, buffers=args.batch_size + 8,
+                                 display=not args.headless or recorder is not None),
+             pipeline.skipping(args, tracker, trap),
+             pipeline.detect(model, batch_size=args.batch_size, max_latency=args.max_latency,
+                             cache=DetectionCache.for_args(args)),
+             pipeline.track(tracker),
+             pipeline.speed(trap, clock=args.clock),
+             pipeline.vanet(update_vanet),
+             output)
+
+source.release()
+if not args.headless:
+    cv2.destroyAllWindows()